@@ -0,0 +1,190 @@
+from datetime import datetime
+from typing import Optional
+import asyncio
+from database import database, customers_collection, deals_collection, activities_collection
+
+# Contadores materializados dos dashboards (documento único em crm_counters).
+# As rotas de escrita aplicam deltas com $inc; a reconciliação periódica
+# recalcula tudo por agregação e corrige qualquer divergência.
+counters_collection = database.get_collection("crm_counters")
+COUNTERS_ID = "global"
+
+# Cada delta incrementa version; a reconciliação só grava se nenhum delta chegou
+# durante o recálculo (senão tenta de novo, até este número de vezes)
+RECONCILE_ATTEMPTS = 3
+
+
+def _key(value) -> str:
+    """Normalizar valor de status para uso como chave de campo"""
+    if value is None:
+        return "none"
+    return str(value).replace(".", "_").replace("$", "_")
+
+
+def _add(inc: dict, field: str, amount):
+    inc[field] = inc.get(field, 0) + amount
+
+
+def _non_zero(inc: dict) -> dict:
+    return {field: amount for field, amount in inc.items() if amount}
+
+
+def customer_delta(before: Optional[dict] = None, after: Optional[dict] = None) -> dict:
+    """Delta dos contadores de clientes entre a imagem anterior e a posterior"""
+    inc = {}
+    for doc, sign in ((before, -1), (after, 1)):
+        if doc is not None:
+            _add(inc, "customers.total", sign)
+            _add(inc, f"customers.status.{_key(doc.get('status'))}", sign)
+    return _non_zero(inc)
+
+
+def deal_delta(before: Optional[dict] = None, after: Optional[dict] = None) -> dict:
+    """Delta dos contadores de negócios (quantidade e valor por status)"""
+    inc = {}
+    for doc, sign in ((before, -1), (after, 1)):
+        if doc is not None:
+            status = _key(doc.get("status"))
+            _add(inc, "deals.total", sign)
+            _add(inc, f"deals.status.{status}.count", sign)
+            _add(inc, f"deals.status.{status}.value", sign * (doc.get("value") or 0))
+    return _non_zero(inc)
+
+
+def activity_delta(before: Optional[dict] = None, after: Optional[dict] = None) -> dict:
+    """Delta dos contadores de atividades por status"""
+    inc = {}
+    for doc, sign in ((before, -1), (after, 1)):
+        if doc is not None:
+            _add(inc, "activities.total", sign)
+            _add(inc, f"activities.status.{_key(doc.get('status'))}", sign)
+    return _non_zero(inc)
+
+
+def merge_deltas(*deltas: dict) -> dict:
+    """Somar vários deltas (útil para escritas em lote)"""
+    inc = {}
+    for delta in deltas:
+        for field, amount in delta.items():
+            _add(inc, field, amount)
+    return _non_zero(inc)
+
+
+async def apply_delta(inc: dict):
+    """Aplicar delta com $inc; falhas ficam para a reconciliação corrigir"""
+    if not inc:
+        return
+    try:
+        # Sem upsert: enquanto o documento não existir, a leitura dispara a reconciliação
+        await counters_collection.update_one(
+            {"_id": COUNTERS_ID},
+            {"$inc": {**inc, "version": 1}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+    except Exception as e:
+        print(f"Erro ao atualizar contadores: {str(e)}")
+
+
+async def compute_counters() -> dict:
+    """Recalcular todos os contadores a partir das coleções"""
+    customers_rows, deals_rows, activities_rows = await asyncio.gather(
+        customers_collection.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(100),
+        deals_collection.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}, "value": {"$sum": "$value"}}}
+        ]).to_list(100),
+        activities_collection.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(100)
+    )
+
+    return {
+        "customers": {
+            "total": sum(row["count"] for row in customers_rows),
+            "status": {_key(row["_id"]): row["count"] for row in customers_rows}
+        },
+        "deals": {
+            "total": sum(row["count"] for row in deals_rows),
+            "status": {
+                _key(row["_id"]): {"count": row["count"], "value": row["value"]}
+                for row in deals_rows
+            }
+        },
+        "activities": {
+            "total": sum(row["count"] for row in activities_rows),
+            "status": {_key(row["_id"]): row["count"] for row in activities_rows}
+        }
+    }
+
+
+def _flatten(doc: dict, prefix: str = "") -> dict:
+    flat = {}
+    for field, value in doc.items():
+        path = f"{prefix}{field}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+async def reconcile_counters() -> dict:
+    """Recalcular contadores, gravar e informar as divergências encontradas
+
+    Gravação condicional (compare-and-set na version lida antes do recálculo):
+    se um delta for aplicado enquanto a agregação roda, a rodada é refeita,
+    para não apagar o delta nem contá-lo duas vezes.
+    """
+    for _ in range(RECONCILE_ATTEMPTS):
+        previous = await counters_collection.find_one({"_id": COUNTERS_ID})
+        fresh = await compute_counters()
+        now = datetime.utcnow()
+
+        if previous is None:
+            # Primeira reconciliação: outra instância pode ter criado o documento nesse meio tempo
+            await counters_collection.update_one(
+                {"_id": COUNTERS_ID},
+                {"$setOnInsert": {**fresh, "version": 0, "reconciled_at": now, "updated_at": now}},
+                upsert=True
+            )
+            return {"counters": fresh, "drift": {}, "initialized": True, "applied": True}
+
+        drift = {}
+        old = _flatten({k: previous.get(k, {}) for k in ("customers", "deals", "activities")})
+        new = _flatten(fresh)
+        for field in set(old) | set(new):
+            if round(new.get(field, 0) - old.get(field, 0), 6) != 0:
+                drift[field] = {"stored": old.get(field, 0), "actual": new.get(field, 0)}
+
+        # version ausente (documento anterior a este campo) casa com None
+        result = await counters_collection.update_one(
+            {"_id": COUNTERS_ID, "version": previous.get("version")},
+            {"$set": {**fresh, "reconciled_at": now, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.matched_count:
+            return {"counters": fresh, "drift": drift, "initialized": False, "applied": True}
+
+    # Escritas contínuas durante todas as tentativas: fica para a próxima rodada
+    return {"counters": fresh, "drift": drift, "initialized": False, "applied": False}
+
+
+async def get_counters() -> dict:
+    """Ler contadores (O(1)); na primeira leitura são calculados"""
+    counters = await counters_collection.find_one({"_id": COUNTERS_ID})
+    if counters is None:
+        counters = (await reconcile_counters())["counters"]
+    return counters
+
+
+async def reconcile_loop(interval: int):
+    """Tarefa periódica de reconciliação dos contadores"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await reconcile_counters()
+            if not report["applied"]:
+                print("Contadores não reconciliados: escritas concorrentes durante o recálculo")
+            elif report["drift"]:
+                print(f"Contadores reconciliados, {len(report['drift'])} divergências corrigidas")
+        except Exception as e:
+            print(f"Erro ao reconciliar contadores: {str(e)}")
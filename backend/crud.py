@@ -0,0 +1,101 @@
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Escritas com uma única ida ao banco: a resposta é montada a partir do
+# documento inserido ou da imagem pós-atualização devolvida pelo MongoDB.
+
+# Limite de itens por requisição nos endpoints de criação em lote
+BULK_MAX_ITEMS = 1000
+
+
+async def insert_and_return(collection, document: dict) -> dict:
+    """Inserir documento e retorná-lo com o _id gerado, sem reler do banco"""
+    result = await collection.insert_one(document)
+    document["_id"] = result.inserted_id
+    return document
+
+
+async def update_and_return(collection, document_id: ObjectId, update_data: dict) -> Optional[dict]:
+    """Aplicar $set e retornar o documento atualizado (None se não existir)"""
+    return await collection.find_one_and_update(
+        {"_id": document_id},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def update_with_images(collection, document_id: ObjectId, update_data: dict) -> Tuple[Optional[dict], Optional[dict]]:
+    """Aplicar $set retornando as imagens anterior e posterior em uma ida ao banco"""
+    before = await collection.find_one_and_update(
+        {"_id": document_id},
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        return None, None
+    return before, {**before, **update_data}
+
+
+async def exists(collection, document_id: ObjectId) -> bool:
+    """Verificar existência buscando apenas o _id"""
+    return await collection.find_one({"_id": document_id}, {"_id": 1}) is not None
+
+
+async def existing_ids(collection, ids: Iterable[ObjectId]) -> Set[ObjectId]:
+    """Retornar quais dos ids existem, com uma única consulta $in"""
+    ids = list(set(ids))
+    if not ids:
+        return set()
+    cursor = collection.find({"_id": {"$in": ids}}, {"_id": 1})
+    return {doc["_id"] async for doc in cursor}
+
+
+def check_bulk_size(items: list):
+    """Validar tamanho do lote"""
+    if not items:
+        raise HTTPException(status_code=400, detail="Nenhum item enviado")
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {BULK_MAX_ITEMS} itens por requisição")
+
+
+# Código de erro do MongoDB para violação de índice único
+DUPLICATE_KEY_ERROR = 11000
+
+
+async def insert_many_write_errors(collection, documents: List[dict]) -> Dict[int, dict]:
+    """insert_many não ordenado; retorna {posição no lote: writeError} dos que falharam"""
+    if not documents:
+        return {}
+    try:
+        await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"]: error for error in e.details.get("writeErrors", [])}
+    return {}
+
+
+async def insert_many_and_report(collection, documents: List[dict]) -> Dict[int, str]:
+    """insert_many não ordenado; retorna {posição no lote: erro} dos que falharam"""
+    errors = await insert_many_write_errors(collection, documents)
+    return {index: error.get("errmsg", "Erro ao inserir") for index, error in errors.items()}
+
+
+async def bulk_insert(collection, results: list, documents: List[dict], positions: List[int]) -> dict:
+    """Inserir os documentos válidos e completar o resultado por item"""
+    errors = await insert_many_and_report(collection, documents)
+
+    for batch_index, (document, position) in enumerate(zip(documents, positions)):
+        if batch_index in errors:
+            results[position] = {"index": position, "success": False, "error": errors[batch_index]}
+        else:
+            results[position] = {"index": position, "success": True, "id": str(document["_id"])}
+
+    created = sum(1 for r in results if r["success"])
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+
+def inserted_documents(result: dict, documents: List[dict], positions: List[int]) -> List[dict]:
+    """Documentos efetivamente inseridos por bulk_insert"""
+    return [doc for doc, position in zip(documents, positions) if result["results"][position]["success"]]
@@ -0,0 +1,349 @@
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+from database import customers_collection
+from counters import apply_delta, customer_delta, merge_deltas
+from crud import DUPLICATE_KEY_ERROR, insert_many_write_errors
+from lead_scoring import mark_leads_dirty, score_inputs_changed
+
+# Importação de clientes em lote: as linhas são acumuladas em blocos, os emails
+# repetidos dentro do bloco são descartados, os já cadastrados (inclusive por
+# blocos anteriores do mesmo arquivo) são buscados com um único $in por bloco e
+# o restante vai em um insert_many não ordenado. O índice único de email garante
+# a deduplicação mesmo com importações simultâneas. A memória usada não depende
+# do tamanho do arquivo.
+#
+# No modo upsert a chave (email ou CNPJ normalizado) localiza o cliente: os
+# existentes são buscados com um $in por bloco, só as linhas que mudam algo
+# geram escrita e tudo vai em um único bulk_write com UpdateOne(upsert=True).
+IMPORT_CHUNK_SIZE = 500
+
+IMPORT_MODES = ("insert", "upsert")
+UPSERT_KEYS = ("email", "cnpj")
+# overwrite: valores do arquivo substituem os atuais; fill_empty: só preenche
+# campos vazios; skip: clientes existentes não são alterados
+CONFLICT_POLICIES = ("overwrite", "fill_empty", "skip")
+
+# Campos aceitos no CSV (além dos obrigatórios) e seus valores padrão
+CSV_FIELDS = {
+    "phone": "",
+    "company": "",
+    "cnpj": "",
+    "status": "lead",
+    "origem": "importacao",
+    "categoria": "",
+    "segmento": "",
+    "responsavel": "",
+    "cep": "",
+    "municipio": "",
+    "uf": "",
+    "observacoes": "",
+}
+
+IMPORT_FIELDS = ("name", "email", *CSV_FIELDS)
+
+
+def customer_from_csv_row(row: dict, with_defaults: bool = True) -> dict:
+    """Montar documento de cliente a partir de uma linha do CSV
+
+    Sem os padrões, apenas as colunas preenchidas entram (base do upsert).
+    """
+    customer = {
+        "name": (row.get("name") or "").strip(),
+        "email": (row.get("email") or "").strip(),
+    }
+    for field, default in CSV_FIELDS.items():
+        customer[field] = row.get(field) or (default if with_defaults else "")
+
+    if with_defaults:
+        return customer
+    return {field: value for field, value in customer.items() if value}
+
+
+def normalize_cnpj(cnpj: Optional[str]) -> str:
+    return ''.join(filter(str.isdigit, cnpj or ""))
+
+
+def cnpj_variants(digits: str) -> List[str]:
+    """Formas em que o CNPJ pode estar gravado: só dígitos ou formatado"""
+    formatted = f"{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}"
+    return [digits, formatted]
+
+
+def validate_import_options(mode: str, key: str, on_conflict: str):
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo inválido. Use: {', '.join(IMPORT_MODES)}")
+    if key not in UPSERT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Chave inválida. Use: {', '.join(UPSERT_KEYS)}")
+    if on_conflict not in CONFLICT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Política de conflito inválida. Use: {', '.join(CONFLICT_POLICIES)}")
+
+
+def empty_import_summary() -> Dict[str, int]:
+    return {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+
+
+class CustomerImporter:
+    """Acumula clientes e grava em blocos, registrando os erros por linha
+
+    label identifica o item nas mensagens ("Linha 12", "Cliente 3").
+    """
+
+    def __init__(
+        self,
+        label: str = "Linha",
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        on_flush: Optional[Callable[["CustomerImporter"], Awaitable[None]]] = None,
+        mode: str = "insert",
+        key: str = "email",
+        on_conflict: str = "overwrite"
+    ):
+        self.label = label
+        self.chunk_size = chunk_size
+        # Chamado após cada bloco gravado (checkpoint dos jobs de importação)
+        self.on_flush = on_flush
+        self.mode = mode
+        self.key = key if mode == "upsert" else "email"
+        self.on_conflict = on_conflict
+        self.imported = 0
+        self.processed = 0
+        self.last_row = 0
+        self.summary = empty_import_summary()
+        # Resumo de cada bloco gravado
+        self.batches: List[dict] = []
+        self._batch = empty_import_summary()
+        self._batch_first_row: Optional[int] = None
+        self._since_flush = 0
+        self._errors: List[Tuple[int, str]] = []
+        # Chaves do bloco atual (repetições em blocos anteriores caem no $in do bloco)
+        self._seen_keys = set()
+        self._pending: List[Tuple[int, dict, str]] = []
+
+    def _error(self, row_num: int, message: str):
+        self._errors.append((row_num, message))
+
+    @property
+    def errors(self) -> List[str]:
+        """Erros em ordem de linha (duplicados no banco só aparecem ao gravar o bloco)"""
+        return [f"{self.label} {row_num}: {message}" for row_num, message in sorted(self._errors)]
+
+    def drain_errors(self) -> List[str]:
+        """Retornar e descartar os erros acumulados (importações longas)"""
+        errors = self.errors
+        self._errors = []
+        return errors
+
+    def _key_of(self, row_num: int, customer: dict) -> Optional[str]:
+        """Validar a linha e devolver a chave de deduplicação (None se inválida)"""
+        if self.key == "cnpj":
+            digits = normalize_cnpj(customer.get("cnpj"))
+            if len(digits) != 14:
+                self._error(row_num, "CNPJ inválido ou ausente")
+                return None
+            return digits
+
+        if self.mode == "insert" and (not customer.get("name") or not customer.get("email")):
+            self._error(row_num, "Nome e email são obrigatórios")
+            return None
+        if not customer.get("email"):
+            self._error(row_num, "Email é obrigatório")
+            return None
+        return customer["email"]
+
+    async def add(self, row_num: int, customer: dict):
+        """Validar e enfileirar um cliente; grava quando o bloco enche"""
+        self.processed += 1
+        self.last_row = row_num
+        self._since_flush += 1
+        if self._batch_first_row is None:
+            self._batch_first_row = row_num
+
+        key = self._key_of(row_num, customer)
+        if key is None:
+            self._batch["failed"] += 1
+        elif key in self._seen_keys:
+            label = "CNPJ" if self.key == "cnpj" else "Email"
+            self._error(row_num, f"{label} {key} repetido no arquivo")
+            self._batch["failed"] += 1
+        else:
+            self._seen_keys.add(key)
+            self._pending.append((row_num, customer, key))
+
+        if self._since_flush >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        """Gravar o bloco pendente"""
+        pending, self._pending = self._pending, []
+        self._seen_keys = set()
+        batch, self._batch = self._batch, empty_import_summary()
+        first_row, self._batch_first_row = self._batch_first_row, None
+        self._since_flush = 0
+        if first_row is not None:
+            if pending and self.mode == "upsert":
+                await self._write_upserts(pending, batch)
+            elif pending:
+                await self._write_inserts(pending, batch)
+
+            for field, amount in batch.items():
+                self.summary[field] += amount
+            self.imported += batch["created"] + batch["updated"]
+            self.batches.append({"first_row": first_row, "last_row": self.last_row, **batch})
+        if self.on_flush:
+            await self.on_flush(self)
+
+    def _write_error(self, row_num: int, customer: dict, error: dict):
+        if error.get("code") == DUPLICATE_KEY_ERROR:
+            # Campo do índice único que colidiu (com chave CNPJ, pode ser o email)
+            key_value = error.get("keyValue") or {self.key: customer.get(self.key)}
+            field, value = next(iter(key_value.items()))
+            label = "CNPJ" if field == "cnpj" else field
+            self._error(row_num, f"Cliente com {label} {value} já existe")
+        else:
+            self._error(row_num, error.get("errmsg", "Erro ao gravar"))
+
+    async def _write_inserts(self, pending: List[Tuple[int, dict, str]], batch: dict):
+        # Emails já cadastrados: uma consulta por bloco
+        emails = [key for _, _, key in pending]
+        existing = {
+            doc["email"]
+            async for doc in customers_collection.find({"email": {"$in": emails}}, {"email": 1})
+        }
+
+        rows, documents = [], []
+        now = datetime.now()
+        for row_num, customer, key in pending:
+            if key in existing:
+                self._error(row_num, f"Cliente com email {key} já existe")
+                batch["failed"] += 1
+                continue
+            customer["created_at"] = now
+            customer["updated_at"] = now
+            rows.append(row_num)
+            documents.append(customer)
+
+        # Duplicados que escaparam da consulta (importação concorrente) caem no índice único
+        write_errors = await insert_many_write_errors(customers_collection, documents)
+        inserted = []
+        for index, (row_num, document) in enumerate(zip(rows, documents)):
+            error = write_errors.get(index)
+            if error is None:
+                inserted.append(document)
+            else:
+                self._write_error(row_num, document, error)
+                batch["failed"] += 1
+
+        batch["created"] += len(inserted)
+        await apply_delta(merge_deltas(*(customer_delta(after=doc) for doc in inserted)))
+        # Score dos novos leads pelo worker incremental
+        await mark_leads_dirty(doc["_id"] for doc in inserted)
+
+    def _key_filter(self, keys: List[str]) -> dict:
+        if self.key == "cnpj":
+            return {"cnpj": {"$in": [variant for key in keys for variant in cnpj_variants(key)]}}
+        return {"email": {"$in": keys}}
+
+    def _stored_key(self, doc: dict) -> str:
+        return normalize_cnpj(doc.get("cnpj")) if self.key == "cnpj" else doc.get("email")
+
+    def _changes(self, current: dict, values: dict) -> dict:
+        """Campos a gravar em um cliente existente conforme a política de conflito"""
+        if self.on_conflict == "fill_empty":
+            changes = {field: value for field, value in values.items() if current.get(field) in (None, "")}
+        else:
+            changes = {field: value for field, value in values.items() if current.get(field) != value}
+
+        # CNPJ que só difere na formatação não é alteração
+        if "cnpj" in changes and current.get("cnpj") and normalize_cnpj(changes["cnpj"]) == normalize_cnpj(current["cnpj"]):
+            del changes["cnpj"]
+        return changes
+
+    async def _write_upserts(self, pending: List[Tuple[int, dict, str]], batch: dict):
+        # Clientes existentes do bloco: uma consulta por bloco
+        existing = {}
+        projection = {field: 1 for field in IMPORT_FIELDS}
+        async for doc in customers_collection.find(self._key_filter([key for _, _, key in pending]), projection):
+            existing.setdefault(self._stored_key(doc), doc)
+
+        now = datetime.now()
+        operations, targets = [], []
+        for row_num, values, key in pending:
+            current = existing.get(key)
+
+            if current is None:
+                if not values.get("name") or not values.get("email"):
+                    self._error(row_num, "Nome e email são obrigatórios para criar o cliente")
+                    batch["failed"] += 1
+                    continue
+                document = {**CSV_FIELDS, **values, "created_at": now, "updated_at": now}
+                # Upsert pela chave: se outro processo criou o cliente nesse meio tempo, nada é sobrescrito
+                operations.append(UpdateOne(self._key_filter([key]), {"$setOnInsert": document}, upsert=True))
+                targets.append((row_num, None, document))
+                continue
+
+            if self.on_conflict == "skip":
+                batch["skipped"] += 1
+                continue
+
+            changes = self._changes(current, values)
+            if not changes:
+                batch["unchanged"] += 1
+                continue
+
+            operations.append(UpdateOne({"_id": current["_id"]}, {"$set": {**changes, "updated_at": now}}))
+            targets.append((row_num, current, changes))
+
+        if not operations:
+            return
+
+        try:
+            result = await customers_collection.bulk_write(operations, ordered=False)
+            write_errors, upserted = {}, result.upserted_ids
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+
+        deltas, dirty = [], []
+        for index, (row_num, current, values) in enumerate(targets):
+            if index in write_errors:
+                self._write_error(row_num, values, write_errors[index])
+                batch["failed"] += 1
+            elif current is None:
+                if index in upserted:
+                    batch["created"] += 1
+                    deltas.append(customer_delta(after=values))
+                    dirty.append(upserted[index])
+                else:
+                    batch["unchanged"] += 1
+            else:
+                batch["updated"] += 1
+                deltas.append(customer_delta(current, {**current, **values}))
+                if score_inputs_changed(current, {**current, **values}):
+                    dirty.append(current["_id"])
+
+        await apply_delta(merge_deltas(*deltas))
+        await mark_leads_dirty(dirty)
+
+    async def finish(self) -> dict:
+        await self.flush()
+        return {
+            "imported": self.imported,
+            "processed": self.processed,
+            "errors": self.errors,
+            "summary": self.summary,
+            "batches": self.batches
+        }
+
+
+async def import_customers(items, label: str = "Linha", **options) -> dict:
+    """Importar um iterável (síncrono ou assíncrono) de (número da linha, cliente)"""
+    importer = CustomerImporter(label, **options)
+    if hasattr(items, "__aiter__"):
+        async for row_num, customer in items:
+            await importer.add(row_num, customer)
+    else:
+        for row_num, customer in items:
+            await importer.add(row_num, customer)
+    return await importer.finish()
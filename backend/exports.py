@@ -0,0 +1,143 @@
+from fastapi import Request
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, Callable, List, Optional
+from datetime import datetime
+from rendering import render_excel, run_render
+import csv
+import io
+import json
+import os
+import tempfile
+
+# Exportações em streaming: o cursor do MongoDB é percorrido em lotes e o
+# arquivo é enviado em pedaços, com memória constante e sem limite de linhas.
+EXPORT_BATCH_SIZE = 1000
+
+# Linhas acumuladas antes de enviar um pedaço do CSV
+CSV_FLUSH_ROWS = 500
+
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def format_date(value, fmt: str = "%d/%m/%Y %H:%M") -> str:
+    """Formatar datas para exportação (outros valores passam como texto)"""
+    if isinstance(value, datetime):
+        return value.strftime(fmt)
+    return value or ""
+
+
+async def csv_stream(cursor, headers: List[str], row: Callable[[dict], list]) -> AsyncIterator[bytes]:
+    """Gerar o CSV em pedaços a partir de um cursor Motor"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM + cabeçalho saem imediatamente (Excel reconhece UTF-8 pelo BOM)
+    writer.writerow(headers)
+    yield buffer.getvalue().encode("utf-8-sig")
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    pending = 0
+    try:
+        async for doc in cursor:
+            writer.writerow(row(doc))
+            pending += 1
+            if pending >= CSV_FLUSH_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate(0)
+                pending = 0
+    except Exception as e:
+        # Com o download em andamento não há como responder 500
+        print(f"Erro durante exportação CSV: {str(e)}")
+        raise
+    finally:
+        await cursor.close()
+
+    if pending:
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def csv_file(cursor, headers: List[str], row: Callable[[dict], list]) -> str:
+    """Gravar o CSV em um arquivo temporário, retornando o caminho"""
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            async for chunk in csv_stream(cursor, headers, row):
+                output.write(chunk)
+    except Exception:
+        _remove_quietly(path)
+        raise
+    return path
+
+
+def csv_response(stream: AsyncIterator[bytes], filename: str) -> StreamingResponse:
+    """Resposta de download para um CSV em streaming"""
+    return StreamingResponse(
+        stream,
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+def _remove_quietly(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def excel_file(
+    cursor,
+    sheet_title: str,
+    headers: List[str],
+    row: Callable[[dict], list],
+    request: Optional[Request] = None
+) -> str:
+    """Gerar planilha a partir de um cursor Motor, retornando o caminho do arquivo
+
+    As linhas do cursor vão em lotes para um arquivo temporário (JSON por linha)
+    e a planilha write-only é montada no pool de renderização.
+    """
+    rows_fd, rows_path = tempfile.mkstemp(suffix=".jsonl")
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+
+    try:
+        with os.fdopen(rows_fd, "w", encoding="utf-8") as rows_file:
+            try:
+                lines = []
+                async for doc in cursor:
+                    lines.append(json.dumps(row(doc), default=str))
+                    if len(lines) >= EXPORT_BATCH_SIZE:
+                        rows_file.write("\n".join(lines) + "\n")
+                        lines = []
+                if lines:
+                    rows_file.write("\n".join(lines) + "\n")
+            finally:
+                await cursor.close()
+
+        await run_render(
+            render_excel, rows_path, path, sheet_title, headers,
+            request=request,
+            # Renderização já em andamento quando o cliente saiu: limpar ao terminar
+            on_abandoned=lambda: _remove_quietly(rows_path, path)
+        )
+    except Exception:
+        _remove_quietly(rows_path, path)
+        raise
+
+    _remove_quietly(rows_path)
+    return path
+
+
+def excel_response(path: str, filename: str) -> FileResponse:
+    """Enviar a planilha do disco e remover o temporário ao final"""
+    return FileResponse(
+        path,
+        media_type=EXCEL_MEDIA_TYPE,
+        filename=filename,
+        background=BackgroundTask(os.remove, path)
+    )
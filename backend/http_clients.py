@@ -0,0 +1,140 @@
+from typing import Dict, Optional
+import asyncio
+import os
+import random
+import time
+import httpx
+
+# Clientes HTTP compartilhados para as integrações externas: um cliente por
+# serviço, com pool de conexões (keep-alive) reaproveitado entre requisições.
+# Abertos no lifespan da aplicação e fechados no shutdown.
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    # HTTP/2 exige o extra httpx[http2]; sem ele, HTTP/1.1 com keep-alive
+    HTTP2_AVAILABLE = False
+
+# Conexões simultâneas por serviço (cada serviço é um host)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+
+# Novas tentativas para chamadas idempotentes (falha de rede, 429, 502, 503, 504)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = 0.25
+HTTP_RETRY_MAX_DELAY = 5.0
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# Serviços externos: {nome: opções do cliente}
+HTTP_SERVICES = {
+    "brasilapi": {"base_url": "https://brasilapi.com.br", "timeout": httpx.Timeout(30.0, connect=5.0)},
+    "viacep": {"base_url": "https://viacep.com.br", "timeout": httpx.Timeout(5.0)},
+    # URL completa montada em routers/whatsapp.py (WHATSAPP_API_URL)
+    "whatsapp": {"timeout": httpx.Timeout(30.0, connect=5.0)},
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    options = HTTP_SERVICES[name]
+    return httpx.AsyncClient(
+        base_url=options.get("base_url", ""),
+        timeout=options["timeout"],
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE
+        ),
+        http2=HTTP2_AVAILABLE
+    )
+
+
+def open_http_clients():
+    """Criar os clientes de todos os serviços (startup)"""
+    for name in HTTP_SERVICES:
+        get_http_client(name)
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Cliente compartilhado do serviço (criado sob demanda fora do lifespan)"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _create_client(name)
+    return client
+
+
+async def close_http_clients():
+    """Fechar os clientes e suas conexões (shutdown)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"Erro ao fechar cliente HTTP: {str(e)}")
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    """Backoff exponencial com jitter (respeita Retry-After em segundos)"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), HTTP_RETRY_MAX_DELAY)
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF * 2 ** attempt, HTTP_RETRY_MAX_DELAY))
+
+
+async def request_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    retries: int = HTTP_RETRIES,
+    idempotent: Optional[bool] = None,
+    **kwargs
+) -> httpx.Response:
+    """Requisição com novas tentativas, apenas para chamadas idempotentes
+
+    Métodos como POST só são repetidos com idempotent=True explícito (um envio
+    repetido de mensagem, por exemplo, chegaria duas vezes ao destinatário).
+    """
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    attempts = retries + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if last_attempt:
+                raise
+            await asyncio.sleep(_retry_delay(attempt, None))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+            await response.aclose()
+            await asyncio.sleep(_retry_delay(attempt, response))
+            continue
+        return response
+
+
+class RateLimiter:
+    """Limite de ritmo (token bucket): até rate chamadas por segundo, com rajadas de até burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,277 @@
+from fastapi import HTTPException, UploadFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from typing import Awaitable, Callable, List, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from database import database
+from customer_import import CustomerImporter, customer_from_csv_row, empty_import_summary
+from uploads import csv_dict_rows, upload_chunks
+import asyncio
+import os
+import time
+
+# Jobs de importação: o upload vai para o GridFS, o worker processa em blocos
+# e grava um checkpoint (última linha, contadores, erros) a cada bloco gravado.
+# Se o processo cair, outro worker retoma o job a partir do último checkpoint.
+import_jobs_collection = database.get_collection("import_jobs")
+import_uploads = AsyncIOMotorGridFSBucket(database, bucket_name="import_uploads")
+
+# Sem checkpoint por esse tempo (segundos), o job é considerado abandonado e retomado
+IMPORT_JOB_STALE_SECONDS = int(os.getenv("IMPORT_JOB_STALE_SECONDS", "300"))
+
+# Erros guardados no job (o total continua sendo contado)
+IMPORT_JOB_MAX_ERRORS = 1000
+
+IMPORT_WORKER_POLL_SECONDS = 5
+
+# Runner de cada tipo de job: recebe o documento do job e grava o progresso
+ImportRunner = Callable[[dict], Awaitable[None]]
+
+# Ouvintes de progresso (ex.: WebSocket de notificações), chamados a cada checkpoint
+ProgressListener = Callable[[dict], Awaitable[None]]
+_progress_listeners: List[ProgressListener] = []
+
+_wakeup = asyncio.Event()
+
+
+def add_progress_listener(listener: ProgressListener):
+    _progress_listeners.append(listener)
+
+
+def register_import_runner(kind: str, runner: ImportRunner):
+    """Registrar um tipo de job processado pelo worker de importação"""
+    IMPORT_RUNNERS[kind] = runner
+
+
+def import_job_helper(job: dict) -> dict:
+    return {
+        "id": str(job["_id"]),
+        "kind": job["kind"],
+        "filename": job.get("filename"),
+        "user_id": job.get("user_id"),
+        "status": job["status"],
+        "rows_done": job.get("rows_done", 0),
+        "last_row": job.get("last_row", 0),
+        "imported": job.get("imported", 0),
+        "options": job.get("options", {}),
+        "summary": job.get("summary", empty_import_summary()),
+        "last_batch": job.get("last_batch"),
+        "errors_count": job.get("errors_count", 0),
+        "errors": job.get("errors", []),
+        # Contadores específicos do tipo de job (ex.: enriquecimento de CNPJ)
+        "progress": job.get("progress", {}),
+        "rows_per_second": job.get("rows_per_second", 0),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "updated_at": job.get("updated_at"),
+        "finished_at": job.get("finished_at")
+    }
+
+
+async def _notify(job: dict):
+    progress = import_job_helper(job)
+    progress.pop("errors")
+    for listener in _progress_listeners:
+        try:
+            await listener(progress)
+        except Exception as e:
+            print(f"Erro ao notificar progresso da importação: {str(e)}")
+
+
+async def create_job(
+    kind: str,
+    user_id: Optional[str] = None,
+    options: Optional[dict] = None,
+    job_id: Optional[ObjectId] = None,
+    **fields
+) -> dict:
+    """Enfileirar um job (fields: dados próprios do tipo, ex.: o upload)"""
+    now = datetime.utcnow()
+    job = {
+        "_id": job_id or ObjectId(),
+        "kind": kind,
+        "user_id": user_id,
+        "options": options or {},
+        **fields,
+        "status": "queued",
+        "rows_done": 0,
+        "last_row": 0,
+        "imported": 0,
+        "errors_count": 0,
+        "errors": [],
+        "created_at": now,
+        "updated_at": now
+    }
+    await import_jobs_collection.insert_one(job)
+    _wakeup.set()
+    return job
+
+
+async def create_import_job(file: UploadFile, kind: str, user_id: Optional[str] = None, options: Optional[dict] = None) -> dict:
+    """Guardar o upload no GridFS e enfileirar o job"""
+    job_id = ObjectId()
+    upload = import_uploads.open_upload_stream(file.filename, metadata={"job_id": job_id})
+    try:
+        async for chunk in upload_chunks(file):
+            await upload.write(chunk)
+        await upload.close()
+    except Exception:
+        await upload.abort()
+        raise
+
+    return await create_job(
+        kind, user_id, options, job_id,
+        filename=file.filename,
+        upload_id=upload._id,
+        size=upload.length
+    )
+
+
+async def find_active_job(kind: str) -> Optional[dict]:
+    """Job do tipo ainda na fila ou em execução"""
+    return await import_jobs_collection.find_one({"kind": kind, "status": {"$in": ["queued", "running"]}})
+
+
+async def get_import_job(job_id: str) -> dict:
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="ID inválido")
+
+    job = await import_jobs_collection.find_one({"_id": ObjectId(job_id)})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job de importação não encontrado")
+    return job
+
+
+async def resume_import_job(job_id: str) -> dict:
+    """Recolocar na fila um job que falhou (continua do último checkpoint)"""
+    job = await import_jobs_collection.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": "failed"},
+        {"$set": {"status": "queued", "error": None, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        await get_import_job(job_id)
+        raise HTTPException(status_code=409, detail="Apenas jobs com falha podem ser retomados")
+    _wakeup.set()
+    return job
+
+
+async def _claim_job() -> Optional[dict]:
+    """Pegar o próximo job da fila ou um cujo worker parou de gravar checkpoints"""
+    now = datetime.utcnow()
+    return await import_jobs_collection.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "updated_at": {"$lt": now - timedelta(seconds=IMPORT_JOB_STALE_SECONDS)}}
+        ]},
+        {"$set": {"status": "running", "updated_at": now}, "$min": {"started_at": now}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def rows_per_second(rows: int, run_started: float) -> float:
+    """Ritmo da execução atual (desde run_started, em time.monotonic())"""
+    elapsed = time.monotonic() - run_started
+    return round(rows / elapsed, 1) if elapsed > 0 else 0
+
+
+async def save_progress(job: dict, fields: dict, errors: Optional[List[str]] = None):
+    """Gravar checkpoint do job (campos + erros novos) e avisar os ouvintes"""
+    update = {"$set": {**fields, "updated_at": datetime.utcnow()}}
+    if errors:
+        update["$inc"] = {"errors_count": len(errors)}
+        update["$push"] = {"errors": {"$each": errors, "$slice": IMPORT_JOB_MAX_ERRORS}}
+
+    updated = await import_jobs_collection.find_one_and_update(
+        {"_id": job["_id"]}, update, return_document=ReturnDocument.AFTER
+    )
+    await _notify(updated)
+
+
+async def _checkpoint(job: dict, importer: CustomerImporter, run_started: float, run_start_rows: int, extra: Optional[dict] = None):
+    await save_progress(job, {
+        "rows_done": importer.processed,
+        "last_row": importer.last_row,
+        "imported": importer.imported,
+        "summary": importer.summary,
+        "last_batch": importer.batches[-1] if importer.batches else None,
+        "rows_per_second": rows_per_second(importer.processed - run_start_rows, run_started),
+        **(extra or {})
+    }, importer.drain_errors())
+
+
+async def run_customers_csv_job(job: dict):
+    """Processar (ou retomar) a importação de clientes a partir do CSV guardado"""
+    resume_after = job.get("last_row", 0)
+    run_started = time.monotonic()
+
+    options = job.get("options", {})
+    with_defaults = options.get("mode", "insert") == "insert"
+
+    importer = CustomerImporter(label="Linha", **options)
+    importer.imported = job.get("imported", 0)
+    importer.summary.update(job.get("summary", {}))
+    importer.processed = job.get("rows_done", 0)
+    importer.last_row = resume_after
+    run_start_rows = importer.processed
+
+    async def on_flush(importer: CustomerImporter):
+        await _checkpoint(job, importer, run_started, run_start_rows)
+
+    importer.on_flush = on_flush
+
+    upload = await import_uploads.open_download_stream(job["upload_id"])
+    async for row_num, row in csv_dict_rows(upload):
+        # Linhas até o último checkpoint já foram gravadas
+        if row_num <= resume_after:
+            continue
+        await importer.add(row_num, customer_from_csv_row(row, with_defaults))
+
+    importer.on_flush = None
+    await importer.flush()
+    await _checkpoint(job, importer, run_started, run_start_rows, {"status": "done", "finished_at": datetime.utcnow()})
+
+    try:
+        await import_uploads.delete(job["upload_id"])
+    except Exception:
+        pass  # Arquivo já removido
+
+
+IMPORT_RUNNERS = {
+    "customers_csv": run_customers_csv_job,
+}
+
+
+async def run_import_job(job: dict):
+    try:
+        await IMPORT_RUNNERS[job["kind"]](job)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"Erro na importação {job['_id']}: {error}")
+        failed = await import_jobs_collection.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$set": {"status": "failed", "error": error, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        await _notify(failed)
+
+
+async def import_worker_loop():
+    """Worker dos jobs de importação (um job por vez por processo)"""
+    while True:
+        _wakeup.clear()
+        try:
+            job = await _claim_job()
+            while job is not None:
+                await run_import_job(job)
+                job = await _claim_job()
+        except Exception as e:
+            print(f"Erro no worker de importação: {str(e)}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=IMPORT_WORKER_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
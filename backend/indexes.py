@@ -0,0 +1,249 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import Optional
+from datetime import datetime
+from database import database
+
+# Especificação versionada dos índices do CRM.
+# Ao alterar qualquer índice abaixo, incremente INDEX_SPEC_VERSION.
+INDEX_SPEC_VERSION = 10
+
+# Prefixo dos índices gerenciados: apenas estes são removidos quando saem da especificação
+MANAGED_PREFIX = "crm_"
+
+# Opções que definem um índice (usadas para detectar divergências)
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+INDEX_SPEC = {
+    "customers": [
+        {"name": "crm_status_created_at", "keys": [("status", ASCENDING), ("created_at", DESCENDING)]},
+        # Único apenas para emails preenchidos (importação deduplica por email)
+        {"name": "crm_email", "keys": [("email", ASCENDING)], "unique": True, "partialFilterExpression": {"email": {"$gt": ""}}},
+        {"name": "crm_cnpj", "keys": [("cnpj", ASCENDING)], "sparse": True},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "crm_updated_at", "keys": [("updated_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "crm_responsavel", "keys": [("responsavel", ASCENDING)], "sparse": True},
+        {"name": "crm_valor_contrato", "keys": [("valor_contrato", DESCENDING)], "sparse": True},
+    ],
+    "deals": [
+        {"name": "crm_status_stage_created_at", "keys": [("status", ASCENDING), ("stage", ASCENDING), ("created_at", DESCENDING)]},
+        {"name": "crm_status_updated_at", "keys": [("status", ASCENDING), ("updated_at", DESCENDING)]},
+        {"name": "crm_customer_id", "keys": [("customer_id", ASCENDING)]},
+        {"name": "crm_updated_at", "keys": [("updated_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "activities": [
+        {"name": "crm_customer_status_due_date", "keys": [("customer_id", ASCENDING), ("status", ASCENDING), ("due_date", ASCENDING)]},
+        {"name": "crm_status_due_date", "keys": [("status", ASCENDING), ("due_date", ASCENDING)]},
+        {"name": "crm_deal_id", "keys": [("deal_id", ASCENDING)], "sparse": True},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "crm_due_date", "keys": [("due_date", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "contacts": [
+        {"name": "crm_customer_id", "keys": [("customer_id", ASCENDING)]},
+        {"name": "crm_email", "keys": [("email", ASCENDING)], "sparse": True},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "attachments": [
+        {"name": "crm_customer_created_at", "keys": [("customer_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "interactions": [
+        {"name": "crm_customer_data", "keys": [("customer_id", ASCENDING), ("data", DESCENDING)]},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "notes": [
+        {"name": "crm_customer_pinned_created_at", "keys": [("customer_id", ASCENDING), ("pinned", DESCENDING), ("created_at", DESCENDING)]},
+    ],
+    "tasks": [
+        {"name": "crm_status_due_date", "keys": [("status", ASCENDING), ("due_date", ASCENDING)]},
+        {"name": "crm_assigned_status", "keys": [("assigned_to", ASCENDING), ("status", ASCENDING)]},
+        {"name": "crm_customer_id", "keys": [("customer_id", ASCENDING)], "sparse": True},
+        {"name": "crm_deal_id", "keys": [("deal_id", ASCENDING)], "sparse": True},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "whatsapp_messages": [
+        {"name": "crm_whatsapp_message_id", "keys": [("whatsapp_message_id", ASCENDING)], "sparse": True},
+        {"name": "crm_customer_created_at", "keys": [("customer_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"name": "crm_status_created_at", "keys": [("status", ASCENDING), ("created_at", DESCENDING)]},
+        {"name": "crm_created_at", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "custom_dashboards": [
+        {"name": "crm_user_created_at", "keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"name": "crm_shared_with", "keys": [("shared_with", ASCENDING)]},
+    ],
+    "deal_stage_events": [
+        {"name": "crm_deal_ts", "keys": [("deal_id", ASCENDING), ("ts", ASCENDING)]},
+        {"name": "crm_to_stage_ts", "keys": [("to_stage", ASCENDING), ("ts", ASCENDING)]},
+        {"name": "crm_ts", "keys": [("ts", ASCENDING)]},
+    ],
+    "report_jobs": [
+        {"name": "crm_key_expires_at", "keys": [("key", ASCENDING), ("expires_at", DESCENDING)]},
+        # Um único job reaproveitável por chave (pedidos simultâneos não duplicam o job)
+        {"name": "crm_key_active", "keys": [("key", ASCENDING)], "unique": True, "partialFilterExpression": {"active": True}},
+        {"name": "crm_status_created_at", "keys": [("status", ASCENDING), ("created_at", ASCENDING)]},
+        {"name": "crm_expires_at", "keys": [("expires_at", ASCENDING)]},
+    ],
+    "import_jobs": [
+        {"name": "crm_status_created_at", "keys": [("status", ASCENDING), ("created_at", ASCENDING)]},
+    ],
+    # Cache de consultas externas (lookup_cache.py): removidas ao vencer
+    "cnpj_cache": [
+        {"name": "crm_expires_at_ttl", "keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "cep_cache": [
+        {"name": "crm_expires_at_ttl", "keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "lead_score_dirty": [
+        {"name": "crm_marked_at", "keys": [("marked_at", ASCENDING)]},
+    ],
+    "dashboard_widgets": [
+        {"name": "crm_data_source", "keys": [("data_source", ASCENDING)]},
+    ],
+}
+
+# Coleção onde fica registrada a última versão aplicada
+schema_meta_collection = database.get_collection("schema_meta")
+
+
+def _index_model(spec: dict) -> IndexModel:
+    """Converter uma entrada da especificação em IndexModel"""
+    options = {k: spec[k] for k in INDEX_OPTIONS if k in spec}
+    return IndexModel(spec["keys"], name=spec["name"], **options)
+
+
+def _existing_model(existing: dict) -> IndexModel:
+    """IndexModel com a definição atual de um índice (restauração)"""
+    options = {k: existing[k] for k in INDEX_OPTIONS if k in existing}
+    return IndexModel(list(existing["key"].items()), name=existing["name"], **options)
+
+
+async def _duplicate_keys(collection, spec: dict) -> Optional[dict]:
+    """Valores repetidos que impediriam um índice único (None se não houver)"""
+    fields = [field for field, _ in spec["keys"]]
+    match = dict(spec.get("partialFilterExpression", {}))
+    if spec.get("sparse"):
+        match.update({field: {"$exists": True} for field in fields if field not in match})
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 1},
+    ]
+    async for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        return doc
+    return None
+
+
+async def _replace_index(collection, spec: dict, current: dict) -> Optional[str]:
+    """Recriar um índice divergente; retorna o erro (o índice anterior é mantido)
+
+    Índices com as mesmas chaves e opções diferentes não coexistem no MongoDB,
+    então o anterior só é removido depois de verificar que o novo pode ser
+    criado (sem duplicados, no caso de índice único) e volta se a criação falhar.
+    """
+    if spec.get("unique"):
+        duplicate = await _duplicate_keys(collection, spec)
+        if duplicate is not None:
+            return (
+                f"{duplicate['count']} documentos com {duplicate['_id']} impedem o índice único; "
+                "índice anterior mantido"
+            )
+
+    await collection.drop_index(spec["name"])
+    try:
+        await collection.create_indexes([_index_model(spec)])
+    except Exception as e:
+        try:
+            await collection.create_indexes([_existing_model(current)])
+        except Exception as restore_error:
+            return f"{str(e)}; falha ao restaurar o índice anterior: {str(restore_error)}"
+        return f"{str(e)}; índice anterior restaurado"
+    return None
+
+
+def _is_drifted(spec: dict, existing: dict) -> bool:
+    """Verificar se o índice existente difere da especificação"""
+    if list(existing["key"].items()) != [(field, direction) for field, direction in spec["keys"]]:
+        return True
+    for option in INDEX_OPTIONS:
+        if spec.get(option) != existing.get(option):
+            # unique/sparse ausentes equivalem a False
+            if option in ("unique", "sparse") and not spec.get(option) and not existing.get(option):
+                continue
+            return True
+    return False
+
+
+async def sync_indexes(drop_unknown: bool = True, force: bool = False) -> dict:
+    """Criar, recriar e remover índices para alinhar o banco à especificação
+
+    A versão aplicada fica em schema_meta. Com o banco já nessa versão (ou em uma
+    mais nova, de um deploy que subiu antes deste) nada é alterado, a menos que
+    force seja informado. A versão só é gravada quando a sincronização termina
+    sem erros, para que a próxima inicialização tente de novo.
+    """
+    report = {
+        "version": INDEX_SPEC_VERSION,
+        "previous_version": None,
+        "skipped": False,
+        "created": [],
+        "dropped": [],
+        "drifted": [],
+        "errors": [],
+    }
+
+    meta = await schema_meta_collection.find_one({"_id": "indexes"})
+    if meta:
+        report["previous_version"] = meta.get("version")
+
+    previous = report["previous_version"]
+    if not force and isinstance(previous, int) and previous >= INDEX_SPEC_VERSION:
+        report["skipped"] = True
+        return report
+
+    for collection_name, specs in INDEX_SPEC.items():
+        collection = database.get_collection(collection_name)
+        existing = {index["name"]: index async for index in collection.list_indexes()}
+        wanted = {spec["name"]: spec for spec in specs}
+        to_create = []
+
+        for name, spec in wanted.items():
+            current = existing.get(name)
+            if current is None:
+                to_create.append(spec)
+            elif _is_drifted(spec, current):
+                # Índice com mesmo nome mas definição diferente: recriar
+                report["drifted"].append(f"{collection_name}.{name}")
+                try:
+                    error = await _replace_index(collection, spec, current)
+                except Exception as e:
+                    error = str(e)
+                if error:
+                    report["errors"].append(f"{collection_name}.{name}: {error}")
+                else:
+                    report["created"].append(f"{collection_name}.{name}")
+
+        if drop_unknown:
+            for name in existing:
+                if name.startswith(MANAGED_PREFIX) and name not in wanted:
+                    try:
+                        await collection.drop_index(name)
+                    except Exception as e:
+                        report["errors"].append(f"{collection_name}.{name}: {str(e)}")
+                    else:
+                        report["dropped"].append(f"{collection_name}.{name}")
+
+        for spec in to_create:
+            try:
+                await collection.create_indexes([_index_model(spec)])
+                report["created"].append(f"{collection_name}.{spec['name']}")
+            except Exception as e:
+                report["errors"].append(f"{collection_name}.{spec['name']}: {str(e)}")
+
+    if not report["errors"]:
+        await schema_meta_collection.update_one(
+            {"_id": "indexes"},
+            {"$set": {"version": INDEX_SPEC_VERSION, "applied_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    return report
@@ -0,0 +1,259 @@
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from typing import Dict, Iterable, List, Optional, Union
+from datetime import datetime
+from bson import ObjectId
+from database import database, customers_collection, interactions_collection
+import asyncio
+import os
+import time
+
+# Score de leads (0-100) calculado em conjunto: uma agregação lê os leads,
+# conta as interações ($lookup limitado ao que pontua), aplica as regras em
+# $addFields e grava com $merge, sem ida e volta por lead. Se o servidor não
+# suportar a agregação, o cálculo é feito em Python por blocos, com uma
+# contagem agrupada de interações e um bulk_write por bloco.
+#
+# Regras (as mesmas nos dois caminhos):
+#   CNPJ +20, website +15, LinkedIn +10, valor de contrato > 0 +10,
+#   responsável +5, categoria grande/medio/pequeno +20/+10/+5,
+#   +20 por interação (máximo 60)
+#
+# Além do recálculo completo, alterações em clientes e interações marcam o
+# lead como pendente (lead_score_dirty) e um worker recalcula só os pendentes.
+SCORE_BATCH_SIZE = 1000
+
+lead_score_dirty_collection = database.get_collection("lead_score_dirty")
+
+# Leads pendentes recalculados por vez pelo worker
+DIRTY_BATCH_SIZE = 500
+# Intervalo de verificação da fila quando não há aviso de alteração
+LEAD_SCORE_POLL_SECONDS = float(os.getenv("LEAD_SCORE_POLL_SECONDS", "5"))
+
+INTERACTION_POINTS = 20
+MAX_INTERACTION_POINTS = 60
+# Interações além disso não mudam o score
+MAX_SCORED_INTERACTIONS = MAX_INTERACTION_POINTS // INTERACTION_POINTS
+
+FIELD_POINTS = {"cnpj": 20, "website": 15, "linkedin": 10, "responsavel": 5}
+CONTRACT_VALUE_POINTS = 10
+CATEGORY_POINTS = {"grande": 20, "medio": 10, "pequeno": 5}
+
+# Campos do cliente que influenciam o score
+LEAD_SCORE_FIELDS = ("status", *FIELD_POINTS, "valor_contrato", "categoria")
+
+_INTERACTIONS_FIELD = "_scored_interactions"
+
+_wakeup = asyncio.Event()
+
+# Erros do servidor que indicam falta de suporte à agregação (versão antiga ou
+# plano sem $merge): estágio/operador desconhecido, opção inválida em
+# $lookup/$merge, $merge na própria coleção, comando não suportado
+UNSUPPORTED_AGGREGATION_CODES = {
+    9,      # FailedToParse ($lookup com localField e pipeline antes do 5.0)
+    115,    # CommandNotSupported
+    168,    # InvalidPipelineOperator ($isNumber, $toString)
+    40324,  # Unrecognized pipeline stage name ($merge)
+    40415,  # Campo desconhecido nas opções do estágio
+    51188,  # $merge na coleção de origem da agregação
+}
+# Com a agregação desligada, ela volta a ser tentada após este intervalo (atualização do servidor)
+AGGREGATION_REPROBE_SECONDS = float(os.getenv("LEAD_SCORE_AGGREGATION_REPROBE_SECONDS", "3600"))
+
+# Momento (monotônico) em que o servidor recusou a agregação; None = suportada
+_aggregation_unsupported_at: Optional[float] = None
+
+
+def lead_score(lead: dict, interactions_count: int) -> int:
+    """Score de um lead a partir do documento e do número de interações"""
+    score = sum(points for field, points in FIELD_POINTS.items() if lead.get(field))
+
+    value = lead.get("valor_contrato")
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        score += CONTRACT_VALUE_POINTS
+
+    score += CATEGORY_POINTS.get(lead.get("categoria"), 0)
+    score += min(interactions_count * INTERACTION_POINTS, MAX_INTERACTION_POINTS)
+
+    # Limitar score entre 0 e 100
+    return min(max(score, 0), 100)
+
+
+def _empty(field: str) -> dict:
+    # Equivalente ao teste de verdade do Python para os valores usados nos cadastros
+    return {"$in": [{"$ifNull": [f"${field}", None]}, [None, "", False, 0, []]]}
+
+
+def score_expression(interactions_count_field: str) -> dict:
+    """Regras de lead_score como expressão de agregação"""
+    terms = [{"$cond": [_empty(field), 0, points]} for field, points in FIELD_POINTS.items()]
+    terms.append({"$cond": [
+        {"$and": [{"$isNumber": "$valor_contrato"}, {"$gt": ["$valor_contrato", 0]}]},
+        CONTRACT_VALUE_POINTS, 0
+    ]})
+    terms.append({"$switch": {
+        "branches": [
+            {"case": {"$eq": ["$categoria", category]}, "then": points}
+            for category, points in CATEGORY_POINTS.items()
+        ],
+        "default": 0
+    }})
+    terms.append({"$min": [
+        {"$multiply": [f"${interactions_count_field}", INTERACTION_POINTS]},
+        MAX_INTERACTION_POINTS
+    ]})
+    return {"$min": [{"$max": [{"$add": terms}, 0]}, 100]}
+
+
+def _leads_query(match: Optional[dict]) -> dict:
+    return {**(match or {}), "status": "lead"}
+
+
+async def score_leads_aggregation(match: Optional[dict] = None):
+    """Calcular e gravar os scores no servidor (requer MongoDB 5.0+)"""
+    pipeline = [
+        {"$match": _leads_query(match)},
+        {"$project": {field: 1 for field in LEAD_SCORE_FIELDS}},
+        # Interações usam o id do cliente como string
+        {"$addFields": {"_customer_id": {"$toString": "$_id"}}},
+        {"$lookup": {
+            "from": interactions_collection.name,
+            "localField": "_customer_id",
+            "foreignField": "customer_id",
+            "pipeline": [{"$limit": MAX_SCORED_INTERACTIONS}, {"$project": {"_id": 1}}],
+            "as": "_interactions"
+        }},
+        {"$addFields": {_INTERACTIONS_FIELD: {"$size": "$_interactions"}}},
+        {"$project": {"score": score_expression(_INTERACTIONS_FIELD)}},
+        {"$merge": {
+            "into": customers_collection.name,
+            "on": "_id",
+            "whenMatched": "merge",
+            "whenNotMatched": "discard"
+        }},
+    ]
+    async for _ in customers_collection.aggregate(pipeline, allowDiskUse=True):
+        pass
+
+
+async def interaction_counts(customer_ids: List[str]) -> Dict[str, int]:
+    """Número de interações por cliente, em uma única consulta agrupada"""
+    pipeline = [
+        {"$match": {"customer_id": {"$in": customer_ids}}},
+        {"$group": {"_id": "$customer_id", "count": {"$sum": 1}}},
+    ]
+    return {doc["_id"]: doc["count"] async for doc in interactions_collection.aggregate(pipeline)}
+
+
+async def score_leads_bulk(match: Optional[dict] = None, batch_size: int = SCORE_BATCH_SIZE) -> int:
+    """Calcular os scores em Python, por blocos de leads; retorna quantos scores mudaram"""
+    changed = 0
+    last_id = None
+    projection = {field: 1 for field in (*LEAD_SCORE_FIELDS, "score")}
+
+    while True:
+        query = _leads_query(match)
+        if last_id is not None:
+            query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+        leads = await customers_collection.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not leads:
+            break
+        last_id = leads[-1]["_id"]
+
+        counts = await interaction_counts([str(lead["_id"]) for lead in leads])
+        operations = []
+        for lead in leads:
+            score = lead_score(lead, counts.get(str(lead["_id"]), 0))
+            if score != lead.get("score"):
+                operations.append(UpdateOne({"_id": lead["_id"]}, {"$set": {"score": score}}))
+
+        if operations:
+            await customers_collection.bulk_write(operations, ordered=False)
+            changed += len(operations)
+
+    return changed
+
+
+async def score_leads(match: Optional[dict] = None) -> dict:
+    """Recalcular o score dos leads (todos ou os que atendem match)"""
+    global _aggregation_unsupported_at
+    total = await customers_collection.count_documents(_leads_query(match))
+    if (
+        _aggregation_unsupported_at is None
+        or time.monotonic() - _aggregation_unsupported_at >= AGGREGATION_REPROBE_SECONDS
+    ):
+        try:
+            await score_leads_aggregation(match)
+            _aggregation_unsupported_at = None
+            return {"total_leads": total, "mode": "aggregation"}
+        except OperationFailure as e:
+            # Demais falhas (rede, eleição de primário, timeout) sobem: os leads
+            # pendentes continuam marcados e o worker tenta de novo
+            if e.code not in UNSUPPORTED_AGGREGATION_CODES:
+                raise
+            print(f"Score por agregação indisponível, calculando em Python: {str(e)}")
+            _aggregation_unsupported_at = time.monotonic()
+
+    changed = await score_leads_bulk(match)
+    return {"total_leads": total, "mode": "bulk", "changed": changed}
+
+
+def score_inputs_changed(before: Optional[dict], after: Optional[dict]) -> bool:
+    """Verificar se a alteração do cliente pode mudar o score"""
+    before, after = before or {}, after or {}
+    return any(before.get(field) != after.get(field) for field in LEAD_SCORE_FIELDS)
+
+
+async def mark_leads_dirty(customer_ids: Iterable[Union[str, ObjectId]]):
+    """Marcar clientes para recálculo do score pelo worker"""
+    ids = {ObjectId(customer_id) for customer_id in customer_ids if ObjectId.is_valid(customer_id)}
+    if not ids:
+        return
+
+    now = datetime.utcnow()
+    try:
+        await lead_score_dirty_collection.bulk_write(
+            [UpdateOne({"_id": customer_id}, {"$set": {"marked_at": now}}, upsert=True) for customer_id in ids],
+            ordered=False
+        )
+    except Exception as e:
+        # A marcação não deve impedir a alteração; o recálculo completo corrige o score
+        print(f"Erro ao marcar leads para recálculo do score: {str(e)}")
+        return
+    _wakeup.set()
+
+
+async def mark_lead_dirty(customer_id: Union[str, ObjectId, None]):
+    if customer_id:
+        await mark_leads_dirty([customer_id])
+
+
+async def rescore_dirty_leads(batch_size: int = DIRTY_BATCH_SIZE) -> int:
+    """Recalcular um bloco de leads pendentes; retorna quantos foram processados"""
+    dirty = await lead_score_dirty_collection.find().sort("marked_at", 1).limit(batch_size).to_list(batch_size)
+    if not dirty:
+        return 0
+
+    await score_leads({"_id": {"$in": [doc["_id"] for doc in dirty]}})
+
+    # Remarcados durante o recálculo (marked_at diferente) ficam para o próximo bloco
+    await lead_score_dirty_collection.delete_many(
+        {"$or": [{"_id": doc["_id"], "marked_at": doc["marked_at"]} for doc in dirty]}
+    )
+    return len(dirty)
+
+
+async def lead_score_worker_loop():
+    """Worker do recálculo incremental dos scores"""
+    while True:
+        _wakeup.clear()
+        try:
+            while await rescore_dirty_leads():
+                pass
+        except Exception as e:
+            print(f"Erro no worker de score de leads: {str(e)}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=LEAD_SCORE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
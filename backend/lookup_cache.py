@@ -0,0 +1,186 @@
+from fastapi import HTTPException
+from collections import OrderedDict
+from typing import AsyncContextManager, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from datetime import datetime, timedelta
+from database import database
+import asyncio
+
+# Cache de consultas a APIs externas (CNPJ, CEP) em dois níveis: um LRU em
+# memória por processo e uma coleção no MongoDB compartilhada entre processos,
+# com índice TTL removendo entradas vencidas.
+#
+# Cada entrada passa por três fases: fresca (devolvida direto), velha (devolvida
+# na hora enquanto uma atualização roda em segundo plano) e vencida (nova
+# consulta). "Não encontrado" também fica em cache, por um tempo menor.
+# Consultas simultâneas à mesma chave compartilham uma única chamada externa, e
+# o total de chamadas externas simultâneas por cache é limitado (jobs em lote
+# podem usar vagas próprias, sem disputar as das consultas interativas).
+
+# Busca na API externa: devolve os dados ou None quando não encontrado
+Fetcher = Callable[[str], Awaitable[Optional[dict]]]
+
+
+class LookupCache:
+    def __init__(
+        self,
+        name: str,
+        fresh_ttl: int,
+        stale_ttl: int,
+        negative_ttl: int,
+        max_entries: int = 1024,
+        max_concurrent_fetches: int = 10
+    ):
+        self.name = name
+        # Segundos em que a entrada é servida sem revalidar
+        self.fresh_ttl = fresh_ttl
+        # Segundos (a partir da consulta) em que a entrada ainda pode ser servida enquanto revalida
+        self.stale_ttl = max(stale_ttl, fresh_ttl)
+        # Segundos em que "não encontrado" fica em cache
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.collection = database.get_collection(f"{name}_cache")
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._fetch_slots = asyncio.Semaphore(max_concurrent_fetches)
+
+    def _remember(self, entry: dict):
+        self._memory[entry["_id"]] = entry
+        self._memory.move_to_end(entry["_id"])
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def _load(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+
+        try:
+            entry = await self.collection.find_one({"_id": key})
+        except Exception as e:
+            # Cache indisponível não impede a consulta
+            print(f"Erro ao ler cache de {self.name}: {str(e)}")
+            return None
+        if entry is not None:
+            self._remember(entry)
+        return entry
+
+    async def _store(self, key: str, data: Optional[dict]) -> dict:
+        now = datetime.utcnow()
+        if data is None:
+            stale_at = expires_at = now + timedelta(seconds=self.negative_ttl)
+        else:
+            stale_at = now + timedelta(seconds=self.fresh_ttl)
+            expires_at = now + timedelta(seconds=self.stale_ttl)
+
+        entry = {
+            "_id": key,
+            "found": data is not None,
+            "data": data,
+            "fetched_at": now,
+            "stale_at": stale_at,
+            "expires_at": expires_at
+        }
+        self._remember(entry)
+        try:
+            await self.collection.replace_one({"_id": key}, entry, upsert=True)
+        except Exception as e:
+            print(f"Erro ao gravar cache de {self.name}: {str(e)}")
+        return entry
+
+    def _fetch_once(self, key: str, fetch: Fetcher, fetch_slots: Optional[AsyncContextManager] = None) -> asyncio.Task:
+        """Consulta externa compartilhada por todos que pedirem a mesma chave ao mesmo tempo"""
+        task = self._in_flight.get(key)
+        if task is None:
+            async def run():
+                try:
+                    async with fetch_slots or self._fetch_slots:
+                        data = await fetch(key)
+                    return await self._store(key, data)
+                finally:
+                    self._in_flight.pop(key, None)
+
+            task = asyncio.create_task(run())
+            self._in_flight[key] = task
+        return task
+
+    def _revalidate(self, key: str, fetch: Fetcher, fetch_slots: Optional[AsyncContextManager] = None):
+        task = self._fetch_once(key, fetch, fetch_slots)
+
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                # Falha na atualização: a entrada velha continua valendo até vencer
+                print(f"Erro ao atualizar cache de {self.name} ({key}): {task.exception()}")
+
+        task.add_done_callback(log_failure)
+
+    async def get(self, key: str, fetch: Fetcher) -> Optional[dict]:
+        """Dados da chave (None se não encontrada), consultando a API só quando necessário"""
+        now = datetime.utcnow()
+        entry = await self._load(key)
+
+        if entry is not None and entry["expires_at"] > now:
+            if entry["stale_at"] <= now:
+                self._revalidate(key, fetch)
+            return entry["data"]
+
+        # shield: o cancelamento de quem pediu não interrompe a consulta compartilhada
+        entry = await asyncio.shield(self._fetch_once(key, fetch))
+        return entry["data"]
+
+    async def get_many(
+        self,
+        keys: Iterable[str],
+        fetch: Fetcher,
+        fetch_slots: Optional[AsyncContextManager] = None
+    ) -> Tuple[Dict[str, Optional[dict]], Dict[str, str]]:
+        """Resolver várias chaves: memória, um $in no MongoDB e consulta externa só do restante
+
+        fetch_slots substitui o limite de consultas simultâneas do cache (ex.: vagas
+        de um job em lote). Retorna ({chave: dados ou None}, {chave: erro}) para as
+        chaves que falharam.
+        """
+        keys = list(dict.fromkeys(keys))
+        entries = {}
+        missing = []
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                self._memory.move_to_end(key)
+                entries[key] = entry
+
+        if missing:
+            try:
+                async for entry in self.collection.find({"_id": {"$in": missing}}):
+                    self._remember(entry)
+                    entries[entry["_id"]] = entry
+            except Exception as e:
+                print(f"Erro ao ler cache de {self.name}: {str(e)}")
+
+        now = datetime.utcnow()
+        results: Dict[str, Optional[dict]] = {}
+        errors: Dict[str, str] = {}
+        to_fetch = []
+        for key in keys:
+            entry = entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                if entry["stale_at"] <= now:
+                    self._revalidate(key, fetch, fetch_slots)
+                results[key] = entry["data"]
+            else:
+                to_fetch.append(key)
+
+        async def resolve(key: str):
+            try:
+                entry = await asyncio.shield(self._fetch_once(key, fetch, fetch_slots))
+                results[key] = entry["data"]
+            except Exception as e:
+                errors[key] = e.detail if isinstance(e, HTTPException) else str(e)
+
+        await asyncio.gather(*(resolve(key) for key in to_fetch))
+        return results, errors
+
+    def clear_memory(self):
+        self._memory.clear()
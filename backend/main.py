@@ -3,6 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from routers import customers, deals, activities, contacts, cnpj, cep, customer_extras, analytics, automation, pipeline, reports, import_data, email, notifications, tasks, whatsapp, custom_dashboards, business_intelligence
 from database import client
+from indexes import sync_indexes
+from counters import reconcile_loop
+from rendering import shutdown_render_executor
+from report_jobs import report_worker_loop
+from import_jobs import import_worker_loop
+from http_clients import open_http_clients, close_http_clients
+from lead_scoring import lead_score_worker_loop
+from stage_events import ensure_stage_history
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -14,7 +23,51 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     # Startup: conectar ao MongoDB
     print("Conectando ao MongoDB...")
+
+    # Sincronizar índices com a especificação versionada
+    if os.getenv("SYNC_INDEXES_ON_STARTUP", "true").lower() == "true":
+        try:
+            report = await sync_indexes(
+                force=os.getenv("SYNC_INDEXES_FORCE", "false").lower() == "true"
+            )
+            app.state.index_report = report
+            if report["skipped"]:
+                print(f"Índices já na versão {report['previous_version']} (especificação v{report['version']})")
+            else:
+                print(
+                    f"Índices v{report['version']} (anterior: {report['previous_version']}): "
+                    f"{len(report['created'])} criados, {len(report['dropped'])} removidos, "
+                    f"{len(report['drifted'])} divergentes"
+                )
+            for key in ("created", "dropped", "drifted", "errors"):
+                for name in report[key]:
+                    print(f"  [{key}] {name}")
+        except Exception as e:
+            print(f"Erro ao sincronizar índices: {str(e)}")
+
+    # Clientes HTTP compartilhados das integrações (CNPJ, CEP, WhatsApp)
+    open_http_clients()
+
+    # Reconciliação periódica dos contadores dos dashboards
+    reconcile_task = asyncio.create_task(
+        reconcile_loop(int(os.getenv("COUNTERS_RECONCILE_INTERVAL", "900")))
+    )
+    # Worker dos jobs de relatório
+    report_worker_task = asyncio.create_task(report_worker_loop())
+    # Worker dos jobs de importação
+    import_worker_task = asyncio.create_task(import_worker_loop())
+    # Recálculo incremental do score dos leads alterados
+    lead_score_task = asyncio.create_task(lead_score_worker_loop())
+    # Evento inicial dos deals anteriores ao histórico de estágios (uma vez)
+    stage_history_task = asyncio.create_task(ensure_stage_history())
     yield
+    reconcile_task.cancel()
+    report_worker_task.cancel()
+    import_worker_task.cancel()
+    lead_score_task.cancel()
+    stage_history_task.cancel()
+    shutdown_render_executor()
+    await close_http_clients()
     # Shutdown: fechar conexão
     print("Fechando conexão MongoDB...")
     client.close()
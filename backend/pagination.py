@@ -0,0 +1,131 @@
+from fastapi import HTTPException
+from typing import List, Optional, Tuple
+from bson import json_util
+from bson.errors import BSONError
+import base64
+import json
+
+# Paginação por cursor (keyset) baseada em (campo de ordenação, _id).
+# O token é opaco para o cliente: JSON estendido do BSON em base64 url-safe.
+
+
+def encode_cursor(sort_field: str, direction: int, last_doc: dict) -> str:
+    """Gerar token do próximo cursor a partir do último documento da página"""
+    payload = {"s": sort_field, "d": direction, "id": last_doc["_id"]}
+    if sort_field != "_id":
+        payload["v"] = last_doc.get(sort_field)
+    raw = json_util.dumps(payload).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _has_operator(value) -> bool:
+    """Verificar se o valor traz chaves de operador ($gt, $ne, ...) em qualquer nível"""
+    if isinstance(value, dict):
+        return any(str(key).startswith("$") or _has_operator(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(_has_operator(item) for item in value)
+    return False
+
+
+def decode_cursor(token: str) -> dict:
+    """Decodificar token de cursor"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        decoded = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, TypeError, json.JSONDecodeError, BSONError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    if not isinstance(decoded, dict) or "id" not in decoded:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    # Os valores do cursor entram direto no filtro: um token adulterado não
+    # pode injetar operadores (o JSON estendido já converteu $oid, $date etc.)
+    if _has_operator(decoded.get("id")) or _has_operator(decoded.get("v")):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    return decoded
+
+
+def sort_spec(sort_field: str, direction: int) -> list:
+    """Ordenação estável com _id como desempate"""
+    if sort_field == "_id":
+        return [("_id", direction)]
+    return [(sort_field, direction), ("_id", direction)]
+
+
+def parse_sort(sort: Optional[str], allowed: List[str]) -> Tuple[str, int]:
+    """Interpretar ordenação no formato 'campo' ou '-campo'"""
+    if not sort:
+        return "_id", 1
+
+    direction = -1 if sort.startswith("-") else 1
+    field = sort.lstrip("-")
+
+    if field != "_id" and field not in allowed:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordenação inválida. Campos permitidos: {', '.join(allowed)}"
+        )
+
+    return field, direction
+
+
+def keyset_filter(sort_field: str, direction: int, cursor: dict) -> dict:
+    """Filtro que retoma a listagem logo após a posição do cursor
+
+    No MongoDB null (ou campo ausente) ordena antes de qualquer valor: vem no
+    início da ordem crescente e no fim da decrescente, e não é alcançado por
+    $gt/$lt, então é tratado à parte.
+    """
+    op = "$gt" if direction == 1 else "$lt"
+
+    if sort_field == "_id":
+        return {"_id": {op: cursor["id"]}}
+
+    value = cursor.get("v")
+    same_value = {sort_field: value, "_id": {op: cursor["id"]}}
+    if value is None:
+        if direction == 1:
+            return {"$or": [{sort_field: {"$ne": None}}, same_value]}
+        return same_value
+
+    after = [{sort_field: {op: value}}, same_value]
+    if direction == -1:
+        after.append({sort_field: None})
+    return {"$or": after}
+
+
+async def find_page(
+    collection,
+    query: dict,
+    limit: int,
+    cursor: str,
+    sort: Optional[str],
+    allowed_sorts: List[str],
+    projection: Optional[dict] = None
+) -> Tuple[list, Optional[str]]:
+    """Buscar uma página por cursor, retornando os documentos e o próximo cursor"""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit deve ser maior que zero")
+
+    sort_field, direction = parse_sort(sort, allowed_sorts)
+
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded.get("s") != sort_field or decoded.get("d") != direction:
+            raise HTTPException(status_code=400, detail="Cursor não corresponde à ordenação solicitada")
+        query = {"$and": [query, keyset_filter(sort_field, direction, decoded)]} if query else keyset_filter(sort_field, direction, decoded)
+
+    # O campo de ordenação precisa vir na projeção para gerar o próximo cursor
+    if projection is not None and sort_field != "_id":
+        projection = {**projection, sort_field: 1}
+
+    # Buscar um documento extra para saber se existe próxima página
+    docs = await collection.find(query, projection).sort(sort_spec(sort_field, direction)).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(sort_field, direction, docs[-1])
+
+    return docs, next_cursor
@@ -0,0 +1,218 @@
+from fastapi import HTTPException, Request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+from datetime import datetime
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import threading
+
+# Renderização de relatórios (ReportLab/openpyxl) em um pool de processos,
+# fora do event loop. As funções de renderização recebem apenas dados simples
+# (linhas já formatadas ou caminhos de arquivo) e devolvem bytes ou um caminho.
+# Este módulo não importa o banco: é carregado também pelos processos do pool.
+RENDER_WORKERS = int(os.getenv("REPORT_RENDER_WORKERS", "2"))
+
+# Renderizações aguardando um processo livre além das que estão rodando
+RENDER_MAX_QUEUE = int(os.getenv("REPORT_RENDER_MAX_QUEUE", "8"))
+
+# Intervalo para verificar se o cliente desconectou durante a renderização
+DISCONNECT_POLL_SECONDS = 0.5
+
+EXCEL_WIDTH_SAMPLE_ROWS = 200
+EXCEL_MAX_COLUMN_WIDTH = 50
+
+_executor: Optional[ProcessPoolExecutor] = None
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    """Pool criado na primeira renderização (spawn: processos limpos, sem herdar o loop/conexões)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown_render_executor():
+    """Encerrar o pool, descartando renderizações ainda na fila"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _release_slot(_=None):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
+async def run_render(
+    fn: Callable,
+    *args,
+    request: Optional[Request] = None,
+    on_abandoned: Optional[Callable[[], None]] = None
+):
+    """Executar renderização no pool, respeitando o limite da fila
+
+    Com request informado, a renderização é cancelada se o cliente desconectar
+    (se ainda estiver na fila; se já estiver rodando, o resultado é descartado
+    e on_abandoned é chamado quando ela terminar). A vaga na fila só é liberada
+    quando o processo do pool de fato termina.
+    """
+    global _in_flight
+    with _in_flight_lock:
+        if _in_flight >= RENDER_WORKERS + RENDER_MAX_QUEUE:
+            raise HTTPException(status_code=503, detail="Fila de relatórios cheia, tente novamente em instantes")
+        _in_flight += 1
+
+    try:
+        render = get_render_executor().submit(fn, *args)
+    except Exception:
+        _release_slot()
+        raise
+    # Chamado na thread do pool ao terminar (ou ao ser cancelado ainda na fila)
+    render.add_done_callback(_release_slot)
+    future = asyncio.wrap_future(render)
+
+    try:
+        while True:
+            # asyncio.wait não cancela o future se quem aguarda for cancelado
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS if request else None)
+            if done:
+                return future.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Cliente desconectado")
+    except BaseException:
+        # Cliente desconectado ou tarefa cancelada: cancelar só se ainda não começou
+        if not render.done() and not render.cancel() and on_abandoned:
+            render.add_done_callback(lambda _: on_abandoned())
+        raise
+
+
+def render_pipeline_pdf(pipeline_data: List[list], generated_at: datetime) -> bytes:
+    """PDF do pipeline a partir das linhas [estágio, quantidade, valor total]"""
+    pdf_file = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_file, pagesize=A4)
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # Título
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1a1a1a'),
+        spaceAfter=30,
+        alignment=1  # Center
+    )
+    title = Paragraph("Relatório Pipeline de Vendas", title_style)
+    elements.append(title)
+
+    # Data
+    date_style = ParagraphStyle(
+        'DateStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.grey,
+        alignment=1
+    )
+    date_text = Paragraph(f"Gerado em: {generated_at.strftime('%d/%m/%Y %H:%M')}", date_style)
+    elements.append(date_text)
+    elements.append(Spacer(1, 20))
+
+    # Tabela
+    table_data = [['Estágio', 'Quantidade', 'Valor Total']] + [
+        [stage, count, f"R$ {value:,.2f}"] for stage, count, value in pipeline_data
+    ]
+    table = Table(table_data, colWidths=[2*inch, 1.5*inch, 2*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(table)
+
+    # Stats adicionais
+    elements.append(Spacer(1, 30))
+    total_deals = sum(row[1] for row in pipeline_data)
+    total_value = sum(row[2] for row in pipeline_data)
+
+    stats_text = f"""
+    <b>Resumo Geral:</b><br/>
+    Total de Deals Abertos: {total_deals}<br/>
+    Valor Total em Negociação: R$ {total_value:,.2f}
+    """
+    stats_para = Paragraph(stats_text, styles['Normal'])
+    elements.append(stats_para)
+
+    doc.build(elements)
+    return pdf_file.getvalue()
+
+
+def _column_widths(headers: List[str], rows: List[list]) -> List[int]:
+    """Estimar larguras pelo cabeçalho e por uma amostra de linhas"""
+    widths = [len(str(header)) for header in headers]
+    for values in rows:
+        for col, value in enumerate(values):
+            if value is not None and col < len(widths):
+                widths[col] = max(widths[col], len(str(value)))
+    return [min(width + 2, EXCEL_MAX_COLUMN_WIDTH) for width in widths]
+
+
+def _header_cells(ws, headers: List[str]) -> list:
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+        cells.append(cell)
+    return cells
+
+
+def render_excel(rows_path: str, output_path: str, sheet_title: str, headers: List[str]) -> str:
+    """Planilha write-only a partir de um arquivo de linhas (uma lista JSON por linha)"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+
+    with open(rows_path, encoding="utf-8") as rows_file:
+        sample = []
+        for line in rows_file:
+            sample.append(json.loads(line))
+            if len(sample) >= EXCEL_WIDTH_SAMPLE_ROWS:
+                break
+
+        # No modo write-only as larguras precisam ser definidas antes da primeira linha
+        for col, width in enumerate(_column_widths(headers, sample), start=1):
+            ws.column_dimensions[get_column_letter(col)].width = width
+        ws.append(_header_cells(ws, headers))
+
+        for values in sample:
+            ws.append(values)
+        for line in rows_file:
+            ws.append(json.loads(line))
+
+    wb.save(output_path)
+    return output_path
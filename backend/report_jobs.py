@@ -0,0 +1,263 @@
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta
+from bson import ObjectId
+from database import database
+import asyncio
+import hashlib
+import json
+import os
+
+# Jobs de relatório: o POST registra o job, o worker gera o arquivo em segundo
+# plano e o artefato fica no GridFS até expirar. Pedidos com o mesmo tipo e
+# parâmetros dentro do TTL reaproveitam o mesmo job (e o mesmo arquivo): jobs
+# reaproveitáveis têm active=True, com índice único parcial na chave.
+report_jobs_collection = database.get_collection("report_jobs")
+report_artifacts = AsyncIOMotorGridFSBucket(database, bucket_name="report_artifacts")
+
+# Tempo (segundos) que um relatório gerado fica disponível e é reaproveitado,
+# contado a partir do fim da geração
+REPORT_JOB_TTL = int(os.getenv("REPORT_JOB_TTL", "3600"))
+
+# Jobs em execução há mais tempo que isso voltam para a fila (worker caiu)
+REPORT_JOB_TIMEOUT = int(os.getenv("REPORT_JOB_TIMEOUT", "900"))
+
+# Intervalo de verificação da fila quando não há aviso de novo job
+REPORT_WORKER_POLL_SECONDS = 5
+
+# Job devolvido à fila com o pool de renderização cheio (503) espera isso para voltar a rodar
+REPORT_JOB_RETRY_SECONDS = 5
+
+# Tentativas de criar o job quando a chave colide no índice único
+CREATE_JOB_ATTEMPTS = 3
+
+# Builder: recebe os parâmetros e devolve (bytes ou caminho de arquivo, nome do arquivo, media type)
+ReportBuilder = Callable[[dict], Awaitable[Tuple[Union[bytes, str], str, str]]]
+
+# Tipos de relatório registrados: {tipo: (builder, parâmetros aceitos)}
+REPORT_TYPES: Dict[str, Tuple[ReportBuilder, Tuple[str, ...]]] = {}
+
+_wakeup = asyncio.Event()
+
+
+def register_report(report_type: str, builder: ReportBuilder, params: Tuple[str, ...] = ()):
+    """Registrar um tipo de relatório disponível para jobs"""
+    REPORT_TYPES[report_type] = (builder, params)
+
+
+def normalize_params(report_type: str, params: Optional[dict]) -> dict:
+    """Validar tipo e parâmetros, descartando valores vazios (para a deduplicação)"""
+    if report_type not in REPORT_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de relatório inválido. Tipos disponíveis: {', '.join(sorted(REPORT_TYPES))}"
+        )
+
+    allowed = REPORT_TYPES[report_type][1]
+    params = params or {}
+    invalid = [key for key in params if key not in allowed]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Parâmetros inválidos: {', '.join(invalid)}")
+
+    return {key: params[key] for key in sorted(params) if params[key] not in (None, "")}
+
+
+def job_key(report_type: str, params: dict) -> str:
+    raw = json.dumps({"type": report_type, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def job_helper(job: dict) -> dict:
+    return {
+        "id": str(job["_id"]),
+        "report_type": job["report_type"],
+        "params": job["params"],
+        "status": job["status"],
+        "filename": job.get("filename"),
+        "size": job.get("size"),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "expires_at": job["expires_at"]
+    }
+
+
+async def create_job(report_type: str, params: Optional[dict]) -> Tuple[dict, bool]:
+    """Criar job ou reaproveitar um idêntico ainda válido; retorna (job, deduplicado)"""
+    params = normalize_params(report_type, params)
+    key = job_key(report_type, params)
+
+    for attempt in range(CREATE_JOB_ATTEMPTS):
+        now = datetime.utcnow()
+        new_id = ObjectId()
+        try:
+            job = await report_jobs_collection.find_one_and_update(
+                {"key": key, "active": True, "expires_at": {"$gt": now}},
+                {"$setOnInsert": {
+                    "_id": new_id,
+                    "report_type": report_type,
+                    "params": params,
+                    "status": "queued",
+                    "active": True,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=REPORT_JOB_TTL)
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Pedido idêntico simultâneo (a próxima tentativa encontra o job dele) ou
+            # job expirado, ainda não removido, ocupando a chave
+            if attempt == CREATE_JOB_ATTEMPTS - 1:
+                raise
+            await report_jobs_collection.update_many(
+                {"key": key, "active": True, "expires_at": {"$lte": now}},
+                {"$unset": {"active": ""}}
+            )
+            continue
+
+        created = job["_id"] == new_id
+        if created:
+            _wakeup.set()
+        return job, not created
+
+
+async def get_job(job_id: str) -> dict:
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="ID inválido")
+
+    job = await report_jobs_collection.find_one({"_id": ObjectId(job_id)})
+    if job is None or job["expires_at"] <= datetime.utcnow():
+        raise HTTPException(status_code=404, detail="Job de relatório não encontrado")
+    return job
+
+
+async def open_artifact(job: dict):
+    """Stream de leitura do arquivo gerado (GridOut)"""
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Relatório ainda não disponível (status: {job['status']})")
+    return await report_artifacts.open_download_stream(job["artifact_id"])
+
+
+async def _claim_job() -> Optional[dict]:
+    """Pegar o próximo job da fila (ou um travado por worker que caiu)"""
+    now = datetime.utcnow()
+    return await report_jobs_collection.find_one_and_update(
+        {"$or": [
+            # retry_at ausente ou já passado
+            {"status": "queued", "retry_at": {"$not": {"$gt": now}}},
+            {"status": "running", "started_at": {"$lt": now - timedelta(seconds=REPORT_JOB_TIMEOUT)}}
+        ]},
+        {"$set": {"status": "running", "started_at": now}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _store_artifact(job: dict, content: Union[bytes, str], filename: str, media_type: str):
+    metadata = {"job_id": job["_id"], "media_type": media_type}
+    if isinstance(content, bytes):
+        artifact_id = await report_artifacts.upload_from_stream(filename, content, metadata=metadata)
+        size = len(content)
+    else:
+        try:
+            size = os.path.getsize(content)
+            with open(content, "rb") as source:
+                artifact_id = await report_artifacts.upload_from_stream(filename, source, metadata=metadata)
+        finally:
+            os.remove(content)
+
+    finished_at = datetime.utcnow()
+    await report_jobs_collection.update_one(
+        {"_id": job["_id"]},
+        {"$set": {
+            "status": "done",
+            "artifact_id": artifact_id,
+            "filename": filename,
+            "media_type": media_type,
+            "size": size,
+            "finished_at": finished_at,
+            # Job que ficou na fila não expira logo depois de pronto
+            "expires_at": finished_at + timedelta(seconds=REPORT_JOB_TTL)
+        }}
+    )
+
+
+async def run_job(job: dict):
+    if job["report_type"] not in REPORT_TYPES:
+        # Tipo removido ou não registrado neste processo: não fica preso em running
+        await _fail_job(job, f"Tipo de relatório não registrado: {job['report_type']}")
+        return
+
+    builder, _ = REPORT_TYPES[job["report_type"]]
+    try:
+        content, filename, media_type = await builder(job["params"])
+        await _store_artifact(job, content, filename, media_type)
+    except HTTPException as e:
+        if e.status_code != 503:
+            await _fail_job(job, e.detail)
+            return
+        # Pool de renderização cheio: volta para a fila e tenta de novo em instantes
+        await report_jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {"status": "queued", "retry_at": datetime.utcnow() + timedelta(seconds=REPORT_JOB_RETRY_SECONDS)},
+                "$unset": {"started_at": ""}
+            }
+        )
+    except Exception as e:
+        await _fail_job(job, str(e))
+
+
+async def _fail_job(job: dict, error: str):
+    print(f"Erro ao gerar relatório {job['_id']}: {error}")
+    # Job com falha não é reaproveitado: o próximo pedido idêntico cria outro
+    await report_jobs_collection.update_one(
+        {"_id": job["_id"]},
+        {
+            "$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow()},
+            "$unset": {"active": ""}
+        }
+    )
+
+
+async def purge_expired_jobs() -> int:
+    """Remover jobs expirados e seus arquivos no GridFS"""
+    expired = await report_jobs_collection.find(
+        {"expires_at": {"$lte": datetime.utcnow()}},
+        {"artifact_id": 1}
+    ).to_list(1000)
+
+    for job in expired:
+        if job.get("artifact_id"):
+            try:
+                await report_artifacts.delete(job["artifact_id"])
+            except Exception:
+                pass  # Arquivo já removido
+
+    if expired:
+        await report_jobs_collection.delete_many({"_id": {"$in": [job["_id"] for job in expired]}})
+    return len(expired)
+
+
+async def report_worker_loop():
+    """Worker dos jobs de relatório (um job por vez por processo)"""
+    while True:
+        _wakeup.clear()
+        try:
+            await purge_expired_jobs()
+            job = await _claim_job()
+            while job is not None:
+                await run_job(job)
+                job = await _claim_job()
+        except Exception as e:
+            print(f"Erro no worker de relatórios: {str(e)}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=REPORT_WORKER_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
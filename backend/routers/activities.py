@@ -1,28 +1,66 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional, Union
 from datetime import datetime
 from bson import ObjectId
+import asyncio
 import schemas
 from database import activities_collection, customers_collection, deals_collection
 from models import activity_helper
+from pagination import find_page, parse_sort, sort_spec
+from sparse import parse_fields, build_projection, sparse_response
+from counters import apply_delta, activity_delta, merge_deltas
+from crud import insert_and_return, update_with_images, exists, existing_ids, check_bulk_size, bulk_insert, inserted_documents
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Activity])
-async def get_activities(skip: int = 0, limit: int = 100):
+# Campos de ordenação cobertos pelos índices (campo, _id)
+ACTIVITY_SORT_FIELDS = ["created_at", "due_date"]
+
+@router.get("/", response_model=Union[List[schemas.Activity], schemas.ActivityPage])
+async def get_activities(
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    # Modo esparso: ?fields=campo1,campo2 projeta apenas esses campos no MongoDB
+    selected = parse_fields(fields, schemas.Activity)
+    projection = build_projection(selected) if selected else None
+
+    # Paginação por cursor: envie cursor vazio na primeira página e next_cursor nas seguintes
+    if cursor is not None:
+        docs, next_cursor = await find_page(activities_collection, {}, limit, cursor, sort, ACTIVITY_SORT_FIELDS, projection)
+        if selected:
+            return sparse_response(schemas.Activity, selected, docs, next_cursor, paged=True)
+        return {"items": [activity_helper(doc) for doc in docs], "next_cursor": next_cursor}
+
+    query = activities_collection.find({}, projection)
+    if sort:
+        query = query.sort(sort_spec(*parse_sort(sort, ACTIVITY_SORT_FIELDS)))
+
+    if selected:
+        docs = await query.skip(skip).limit(limit).to_list(limit)
+        return sparse_response(schemas.Activity, selected, docs)
+
     activities = []
-    async for activity in activities_collection.find().skip(skip).limit(limit):
+    async for activity in query.skip(skip).limit(limit):
         activities.append(activity_helper(activity))
     return activities
 
 @router.get("/{activity_id}", response_model=schemas.Activity)
-async def get_activity(activity_id: str):
+async def get_activity(activity_id: str, fields: Optional[str] = None):
     if not ObjectId.is_valid(activity_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    activity = await activities_collection.find_one({"_id": ObjectId(activity_id)})
+    selected = parse_fields(fields, schemas.Activity)
+    projection = build_projection(selected) if selected else None
+
+    activity = await activities_collection.find_one({"_id": ObjectId(activity_id)}, projection)
     if activity is None:
         raise HTTPException(status_code=404, detail="Atividade não encontrada")
+    if selected:
+        return sparse_response(schemas.Activity, selected, activity)
     return activity_helper(activity)
 
 @router.post("/", response_model=schemas.Activity)
@@ -31,17 +69,19 @@ async def create_activity(activity: schemas.ActivityCreate):
     if not ObjectId.is_valid(activity.customer_id):
         raise HTTPException(status_code=400, detail="ID do cliente inválido")
 
-    customer = await customers_collection.find_one({"_id": ObjectId(activity.customer_id)})
-    if not customer:
-        raise HTTPException(status_code=404, detail="Cliente não encontrado")
-
     # Verificar se deal_id é válido (se fornecido)
-    if activity.deal_id:
-        if not ObjectId.is_valid(activity.deal_id):
-            raise HTTPException(status_code=400, detail="ID do negócio inválido")
-        deal = await deals_collection.find_one({"_id": ObjectId(activity.deal_id)})
-        if not deal:
-            raise HTTPException(status_code=404, detail="Negócio não encontrado")
+    if activity.deal_id and not ObjectId.is_valid(activity.deal_id):
+        raise HTTPException(status_code=400, detail="ID do negócio inválido")
+
+    # Verificar cliente e negócio em paralelo, buscando apenas o _id
+    customer_exists, deal_exists = await asyncio.gather(
+        exists(customers_collection, ObjectId(activity.customer_id)),
+        exists(deals_collection, ObjectId(activity.deal_id)) if activity.deal_id else asyncio.sleep(0, result=True)
+    )
+    if not customer_exists:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    if not deal_exists:
+        raise HTTPException(status_code=404, detail="Negócio não encontrado")
 
     activity_dict = activity.model_dump()
     activity_dict["customer_id"] = ObjectId(activity.customer_id)
@@ -49,10 +89,53 @@ async def create_activity(activity: schemas.ActivityCreate):
         activity_dict["deal_id"] = ObjectId(activity.deal_id)
     activity_dict["created_at"] = datetime.utcnow()
 
-    result = await activities_collection.insert_one(activity_dict)
-    new_activity = await activities_collection.find_one({"_id": result.inserted_id})
+    new_activity = await insert_and_return(activities_collection, activity_dict)
+    await apply_delta(activity_delta(after=new_activity))
     return activity_helper(new_activity)
 
+@router.post("/bulk", response_model=schemas.BulkCreateResult)
+async def create_activities_bulk(activities: List[schemas.ActivityCreate]):
+    # Clientes e negócios referenciados validados com uma consulta $in cada
+    check_bulk_size(activities)
+
+    customer_ids = [ObjectId(item.customer_id) for item in activities if ObjectId.is_valid(item.customer_id)]
+    deal_ids = [ObjectId(item.deal_id) for item in activities if item.deal_id and ObjectId.is_valid(item.deal_id)]
+    found_customers, found_deals = await asyncio.gather(
+        existing_ids(customers_collection, customer_ids),
+        existing_ids(deals_collection, deal_ids)
+    )
+
+    results = [None] * len(activities)
+    documents, positions = [], []
+    now = datetime.utcnow()
+
+    for idx, activity in enumerate(activities):
+        error = None
+        if not ObjectId.is_valid(activity.customer_id):
+            error = "ID do cliente inválido"
+        elif ObjectId(activity.customer_id) not in found_customers:
+            error = "Cliente não encontrado"
+        elif activity.deal_id and not ObjectId.is_valid(activity.deal_id):
+            error = "ID do negócio inválido"
+        elif activity.deal_id and ObjectId(activity.deal_id) not in found_deals:
+            error = "Negócio não encontrado"
+
+        if error:
+            results[idx] = {"index": idx, "success": False, "error": error}
+            continue
+
+        activity_dict = activity.model_dump()
+        activity_dict["customer_id"] = ObjectId(activity.customer_id)
+        if activity.deal_id:
+            activity_dict["deal_id"] = ObjectId(activity.deal_id)
+        activity_dict["created_at"] = now
+        documents.append(activity_dict)
+        positions.append(idx)
+
+    result = await bulk_insert(activities_collection, results, documents, positions)
+    await apply_delta(merge_deltas(*(activity_delta(after=doc) for doc in inserted_documents(result, documents, positions))))
+    return result
+
 @router.put("/{activity_id}", response_model=schemas.Activity)
 async def update_activity(activity_id: str, activity: schemas.ActivityUpdate):
     if not ObjectId.is_valid(activity_id):
@@ -63,17 +146,12 @@ async def update_activity(activity_id: str, activity: schemas.ActivityUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
 
-    result = await activities_collection.update_one(
-        {"_id": ObjectId(activity_id)},
-        {"$set": update_data}
-    )
+    previous_activity, updated_activity = await update_with_images(activities_collection, ObjectId(activity_id), update_data)
+    if updated_activity is None:
+        raise HTTPException(status_code=404, detail="Atividade não encontrada")
 
-    if result.modified_count == 0:
-        existing = await activities_collection.find_one({"_id": ObjectId(activity_id)})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Atividade não encontrada")
+    await apply_delta(activity_delta(previous_activity, updated_activity))
 
-    updated_activity = await activities_collection.find_one({"_id": ObjectId(activity_id)})
     return activity_helper(updated_activity)
 
 @router.delete("/{activity_id}")
@@ -81,9 +159,11 @@ async def delete_activity(activity_id: str):
     if not ObjectId.is_valid(activity_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    result = await activities_collection.delete_one({"_id": ObjectId(activity_id)})
+    deleted_activity = await activities_collection.find_one_and_delete({"_id": ObjectId(activity_id)}, {"status": 1})
 
-    if result.deleted_count == 0:
+    if deleted_activity is None:
         raise HTTPException(status_code=404, detail="Atividade não encontrada")
 
+    await apply_delta(activity_delta(before=deleted_activity))
+
     return {"message": "Atividade deletada com sucesso"}
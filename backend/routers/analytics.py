@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from typing import List, Dict
 from datetime import datetime, timedelta
 from bson import ObjectId
+import asyncio
 from ..database import (
     customers_collection,
     deals_collection,
@@ -9,6 +10,7 @@ from ..database import (
     interactions_collection,
     notes_collection
 )
+from ..counters import get_counters, reconcile_counters
 
 router = APIRouter()
 
@@ -16,82 +18,58 @@ router = APIRouter()
 async def get_dashboard_stats():
     """Estatísticas gerais do CRM"""
     try:
-        # Total de clientes por status
-        total_customers = await customers_collection.count_documents({})
-        leads = await customers_collection.count_documents({"status": "lead"})
-        prospects = await customers_collection.count_documents({"status": "prospect"})
-        clientes = await customers_collection.count_documents({"status": "cliente"})
-        inativos = await customers_collection.count_documents({"status": "inativo"})
-
-        # Novos clientes este mês
         start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        new_this_month = await customers_collection.count_documents({
-            "created_at": {"$gte": start_of_month}
-        })
-
-        # Total de deals
-        total_deals = await deals_collection.count_documents({})
-        open_deals = await deals_collection.count_documents({"status": "open"})
-        won_deals = await deals_collection.count_documents({"status": "won"})
-        lost_deals = await deals_collection.count_documents({"status": "lost"})
-
-        # Valor total em negociações
-        pipeline = [
-            {"$match": {"status": "open"}},
-            {"$group": {"_id": None, "total": {"$sum": "$value"}}}
-        ]
-        open_value = await deals_collection.aggregate(pipeline).to_list(1)
-        total_open_value = open_value[0]["total"] if open_value else 0
-
-        # Valor ganho este mês
-        won_pipeline = [
-            {"$match": {
-                "status": "won",
-                "updated_at": {"$gte": start_of_month}
-            }},
-            {"$group": {"_id": None, "total": {"$sum": "$value"}}}
-        ]
-        won_value = await deals_collection.aggregate(won_pipeline).to_list(1)
-        won_this_month = won_value[0]["total"] if won_value else 0
-
-        # Atividades pendentes
-        pending_activities = await activities_collection.count_documents({"status": "pending"})
-
-        # Interações esta semana
         start_of_week = datetime.now() - timedelta(days=7)
-        interactions_week = await interactions_collection.count_documents({
-            "created_at": {"$gte": start_of_week}
-        })
 
-        # Top 5 clientes por valor de contrato
-        top_customers = await customers_collection.find(
-            {"valor_contrato": {"$gt": 0}},
-            {"name": 1, "valor_contrato": 1, "email": 1}
-        ).sort("valor_contrato", -1).limit(5).to_list(5)
+        # Contagens por status vêm dos contadores materializados;
+        # apenas as janelas de tempo e o top 5 consultam as coleções (via índices)
+        counters, new_this_month, won_value, interactions_week, top_customers = await asyncio.gather(
+            get_counters(),
+            # Novos clientes este mês
+            customers_collection.count_documents({"created_at": {"$gte": start_of_month}}),
+            # Valor ganho este mês
+            deals_collection.aggregate([
+                {"$match": {"status": "won", "updated_at": {"$gte": start_of_month}}},
+                {"$group": {"_id": None, "total": {"$sum": "$value"}}}
+            ]).to_list(1),
+            # Interações esta semana
+            interactions_collection.count_documents({"created_at": {"$gte": start_of_week}}),
+            # Top 5 clientes por valor de contrato
+            customers_collection.find(
+                {"valor_contrato": {"$gt": 0}},
+                {"name": 1, "valor_contrato": 1, "email": 1}
+            ).sort("valor_contrato", -1).limit(5).to_list(5)
+        )
+
+        customers_by_status = counters["customers"]["status"]
+        deals_by_status = counters["deals"]["status"]
+
+        leads = customers_by_status.get("lead", 0)
+        clientes = customers_by_status.get("cliente", 0)
 
         # Conversão de leads
         conversion_rate = (clientes / leads * 100) if leads > 0 else 0
 
         return {
             "customers": {
-                "total": total_customers,
+                "total": counters["customers"]["total"],
                 "leads": leads,
-                "prospects": prospects,
+                "prospects": customers_by_status.get("prospect", 0),
                 "clientes": clientes,
-                "inativos": inativos,
+                "inativos": customers_by_status.get("inativo", 0),
                 "new_this_month": new_this_month,
                 "conversion_rate": round(conversion_rate, 2)
             },
             "deals": {
-                "total": total_deals,
-                "open": open_deals,
-                "won": won_deals,
-                "lost": lost_deals,
-                "total_open_value": total_open_value,
-                "won_this_month": won_this_month
+                "total": counters["deals"]["total"],
+                "open": deals_by_status.get("open", {}).get("count", 0),
+                "won": deals_by_status.get("won", {}).get("count", 0),
+                "lost": deals_by_status.get("lost", {}).get("count", 0),
+                "total_open_value": deals_by_status.get("open", {}).get("value", 0),
+                "won_this_month": won_value[0]["total"] if won_value else 0
             },
             "activities": {
-                "pending": pending_activities
+                "pending": counters["activities"]["status"].get("pending", 0)
             },
             "interactions": {
                 "this_week": interactions_week
@@ -110,6 +88,21 @@ async def get_dashboard_stats():
         raise HTTPException(status_code=500, detail=f"Erro ao buscar estatísticas: {str(e)}")
 
 
+@router.post("/dashboard/counters/reconcile")
+async def reconcile_dashboard_counters():
+    """Recalcular os contadores materializados e informar divergências"""
+    try:
+        report = await reconcile_counters()
+        return {
+            "message": "Contadores reconciliados",
+            "initialized": report["initialized"],
+            "applied": report["applied"],
+            "drift": report["drift"]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao reconciliar contadores: {str(e)}")
+
+
 @router.get("/dashboard/timeline")
 async def get_timeline(days: int = 30):
     """Timeline de atividades dos últimos N dias"""
@@ -166,21 +159,25 @@ async def get_timeline(days: int = 30):
 async def get_sales_funnel():
     """Funil de vendas"""
     try:
+        counters = await get_counters()
+
         # Contagem por status
-        leads = await customers_collection.count_documents({"status": "lead"})
-        prospects = await customers_collection.count_documents({"status": "prospect"})
-        clientes = await customers_collection.count_documents({"status": "cliente"})
+        customers_by_status = counters["customers"]["status"]
+        leads = customers_by_status.get("lead", 0)
+        prospects = customers_by_status.get("prospect", 0)
+        clientes = customers_by_status.get("cliente", 0)
 
         # Valor médio por deal
-        pipeline = [
-            {"$group": {
-                "_id": "$status",
-                "count": {"$sum": 1},
-                "avg_value": {"$avg": "$value"},
-                "total_value": {"$sum": "$value"}
-            }}
+        deals_by_status = [
+            {
+                "_id": status,
+                "count": d["count"],
+                "avg_value": d["value"] / d["count"] if d["count"] else 0,
+                "total_value": d["value"]
+            }
+            for status, d in counters["deals"]["status"].items()
+            if d.get("count")
         ]
-        deals_by_status = await deals_collection.aggregate(pipeline).to_list(10)
 
         return {
             "funnel": [
@@ -3,6 +3,8 @@ from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 from bson import ObjectId
 from ..database import customers_collection, interactions_collection, activities_collection
+from ..lead_scoring import mark_leads_dirty, score_leads
+from ..counters import apply_delta, activity_delta, customer_delta, merge_deltas
 import asyncio
 
 router = APIRouter()
@@ -18,6 +20,7 @@ async def create_follow_up_sequence(customer_id: str, days: List[int] = [1, 3, 7
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
 
     activities_created = []
+    deltas = []
 
     for day in days:
         activity = {
@@ -33,6 +36,9 @@ async def create_follow_up_sequence(customer_id: str, days: List[int] = [1, 3, 7
 
         result = await activities_collection.insert_one(activity)
         activities_created.append(str(result.inserted_id))
+        deltas.append(activity_delta(after=activity))
+
+    await apply_delta(merge_deltas(*deltas))
 
     return {
         "message": f"Sequência de {len(days)} follow-ups criada",
@@ -42,62 +48,16 @@ async def create_follow_up_sequence(customer_id: str, days: List[int] = [1, 3, 7
 
 @router.post("/automation/score-leads")
 async def calculate_lead_scores():
-    """Calcular score de leads automaticamente"""
-    try:
-        leads = await customers_collection.find({"status": "lead"}).to_list(1000)
-        updated = 0
-
-        for lead in leads:
-            score = 0
-            lead_id = str(lead["_id"])
-
-            # +20 pontos se tem CNPJ
-            if lead.get("cnpj"):
-                score += 20
-
-            # +15 pontos se tem website
-            if lead.get("website"):
-                score += 15
-
-            # +10 pontos se tem LinkedIn
-            if lead.get("linkedin"):
-                score += 10
+    """Calcular score de leads automaticamente
 
-            # +20 pontos por cada interação
-            interactions_count = await interactions_collection.count_documents({
-                "customer_id": lead_id
-            })
-            score += min(interactions_count * 20, 60)  # Máximo 60 pontos
-
-            # +10 pontos se tem valor de contrato estimado
-            if lead.get("valor_contrato") and lead.get("valor_contrato") > 0:
-                score += 10
-
-            # +5 pontos se tem responsável atribuído
-            if lead.get("responsavel"):
-                score += 5
-
-            # Categoria aumenta score
-            if lead.get("categoria") == "grande":
-                score += 20
-            elif lead.get("categoria") == "medio":
-                score += 10
-            elif lead.get("categoria") == "pequeno":
-                score += 5
-
-            # Limitar score entre 0 e 100
-            score = min(max(score, 0), 100)
-
-            # Atualizar lead
-            await customers_collection.update_one(
-                {"_id": lead["_id"]},
-                {"$set": {"score": score}}
-            )
-            updated += 1
+    Todos os leads, em uma agregação no servidor (ver lead_scoring.py para as regras).
+    """
+    try:
+        result = await score_leads()
 
         return {
-            "message": f"Score calculado para {updated} leads",
-            "total_leads": len(leads)
+            "message": f"Score calculado para {result['total_leads']} leads",
+            **result
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao calcular scores: {str(e)}")
@@ -113,14 +73,21 @@ async def auto_convert_hot_leads(min_score: int = 70):
         }).to_list(100)
 
         converted = 0
+        deltas, dirty = [], []
         for lead in hot_leads:
-            await customers_collection.update_one(
-                {"_id": lead["_id"]},
-                {"$set": {
-                    "status": "prospect",
-                    "updated_at": datetime.now()
-                }}
+            customer_update = {
+                "status": "prospect",
+                "updated_at": datetime.now()
+            }
+            # Só conta se ainda era lead (alteração concorrente não gera delta duplicado)
+            result = await customers_collection.update_one(
+                {"_id": lead["_id"], "status": "lead"},
+                {"$set": customer_update}
             )
+            if not result.modified_count:
+                continue
+            deltas.append(customer_delta(lead, {**lead, **customer_update}))
+            dirty.append(lead["_id"])
 
             # Criar interação automática
             await interactions_collection.insert_one({
@@ -135,6 +102,9 @@ async def auto_convert_hot_leads(min_score: int = 70):
 
             converted += 1
 
+        await apply_delta(merge_deltas(*deltas))
+        await mark_leads_dirty(dirty)
+
         return {
             "message": f"{converted} leads convertidos para prospect",
             "min_score": min_score
@@ -155,6 +125,7 @@ async def alert_inactive_customers(days: int = 30):
         }).to_list(100)
 
         activities_created = 0
+        deltas = []
 
         for customer in inactive_customers:
             # Verificar se já existe atividade pendente
@@ -165,7 +136,7 @@ async def alert_inactive_customers(days: int = 30):
             })
 
             if existing == 0:
-                await activities_collection.insert_one({
+                activity = {
                     "title": f"Reativar cliente - {customer['name']}",
                     "description": f"Cliente sem interação há {days}+ dias. Entrar em contato para reativação.",
                     "activity_type": "reativacao",
@@ -175,9 +146,13 @@ async def alert_inactive_customers(days: int = 30):
                     "created_at": datetime.now(),
                     "automated": True,
                     "priority": "high"
-                })
+                }
+                await activities_collection.insert_one(activity)
+                deltas.append(activity_delta(after=activity))
                 activities_created += 1
 
+        await apply_delta(merge_deltas(*deltas))
+
         return {
             "message": f"{activities_created} atividades de reativação criadas",
             "inactive_customers": len(inactive_customers)
@@ -200,6 +175,7 @@ async def contract_renewal_reminders(days_before: int = 30):
         }).to_list(100)
 
         reminders_created = 0
+        deltas = []
 
         for customer in expiring_contracts:
             # Verificar se já existe lembrete
@@ -210,7 +186,7 @@ async def contract_renewal_reminders(days_before: int = 30):
             })
 
             if existing == 0:
-                await activities_collection.insert_one({
+                activity = {
                     "title": f"Renovação de contrato - {customer['name']}",
                     "description": f"Contrato vence em {customer.get('data_fim_contrato')}. Entrar em contato para renovação.",
                     "activity_type": "renovacao",
@@ -220,9 +196,13 @@ async def contract_renewal_reminders(days_before: int = 30):
                     "created_at": datetime.now(),
                     "automated": True,
                     "priority": "high"
-                })
+                }
+                await activities_collection.insert_one(activity)
+                deltas.append(activity_delta(after=activity))
                 reminders_created += 1
 
+        await apply_delta(merge_deltas(*deltas))
+
         return {
             "message": f"{reminders_created} lembretes de renovação criados",
             "expiring_contracts": len(expiring_contracts)
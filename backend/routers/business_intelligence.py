@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 from bson import ObjectId
 from pydantic import BaseModel
 from ..database import customers_collection, deals_collection, activities_collection, db
+from ..stage_events import stage_stats
 from collections import defaultdict
 
 router = APIRouter()
@@ -394,8 +395,22 @@ async def deal_velocity():
     total_days = sum(r["avg_days"] * r["count"] for r in results)
     avg_velocity = total_days / total_deals if total_deals > 0 else 0
     
+    # Tempo real em cada estágio, a partir do histórico de mudanças de estágio
+    stats = await stage_stats()
+    time_in_stage = [
+        {
+            "stage": stage,
+            "avg_days": round(data["seconds"] / data["exits"] / 86400, 2),
+            "exits": data["exits"],
+            "advanced": data.get("advanced", 0)
+        }
+        for stage, data in stats.items()
+        if data.get("exits")
+    ]
+    
     return {
         "by_stage": results,
+        "time_in_stage": time_in_stage,
         "overall": {
             "avg_days_to_close": round(avg_velocity, 2),
             "total_deals_analyzed": total_deals
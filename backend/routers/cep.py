@@ -1,38 +1,106 @@
 from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import List, Optional
 import httpx
+import os
+from lookup_cache import LookupCache
+from http_clients import get_http_client, request_with_retry
 
 router = APIRouter()
 
-@router.get("/cep/{cep}")
-async def buscar_cep(cep: str):
-    """Busca dados de endereço pelo CEP usando ViaCEP"""
+# Cache das consultas ao ViaCEP (ver lookup_cache.py); endereço de CEP quase nunca muda
+cep_cache = LookupCache(
+    "cep",
+    fresh_ttl=int(os.getenv("CEP_CACHE_TTL", "7776000")),
+    stale_ttl=int(os.getenv("CEP_CACHE_STALE_TTL", "31536000")),
+    negative_ttl=int(os.getenv("CEP_CACHE_NEGATIVE_TTL", "86400")),
+    max_entries=int(os.getenv("CEP_CACHE_MAX_ENTRIES", "4096")),
+    max_concurrent_fetches=int(os.getenv("CEP_MAX_CONCURRENT_LOOKUPS", "10"))
+)
+
+# Máximo de CEPs por chamada de /cep/bulk
+CEP_BULK_MAX = 1000
+
+
+class CEPBulkRequest(BaseModel):
+    ceps: List[str]
+
+
+def limpar_cep(cep: str) -> str:
     # Remove caracteres não numéricos
-    cep_limpo = "".join(filter(str.isdigit, cep))
+    return "".join(filter(str.isdigit, cep or ""))
 
-    if len(cep_limpo) != 8:
-        raise HTTPException(status_code=400, detail="CEP deve ter 8 dígitos")
 
+async def fetch_cep(cep_limpo: str) -> Optional[dict]:
+    """Consultar o ViaCEP; None se o CEP não existir"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"https://viacep.com.br/ws/{cep_limpo}/json/")
-
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="CEP não encontrado")
-
-            data = response.json()
-
-            if "erro" in data:
-                raise HTTPException(status_code=404, detail="CEP não encontrado")
-
-            return {
-                "cep": data.get("cep"),
-                "logradouro": data.get("logradouro"),
-                "complemento": data.get("complemento"),
-                "bairro": data.get("bairro"),
-                "municipio": data.get("localidade"),
-                "uf": data.get("uf"),
-                "ibge": data.get("ibge"),
-                "ddd": data.get("ddd")
-            }
+        response = await request_with_retry(get_http_client("viacep"), "GET", f"/ws/{cep_limpo}/json/")
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar CEP: {str(e)}")
+
+    # Falha do ViaCEP não é "não encontrado" (e não vai para o cache)
+    if response.status_code >= 500:
+        raise HTTPException(status_code=502, detail="ViaCEP indisponível")
+
+    if response.status_code != 200:
+        return None
+
+    data = response.json()
+
+    if "erro" in data:
+        return None
+
+    return {
+        "cep": data.get("cep"),
+        "logradouro": data.get("logradouro"),
+        "complemento": data.get("complemento"),
+        "bairro": data.get("bairro"),
+        "municipio": data.get("localidade"),
+        "uf": data.get("uf"),
+        "ibge": data.get("ibge"),
+        "ddd": data.get("ddd")
+    }
+
+
+@router.get("/cep/{cep}")
+async def buscar_cep(cep: str):
+    """Busca dados de endereço pelo CEP usando ViaCEP (com cache)"""
+    cep_limpo = limpar_cep(cep)
+
+    if len(cep_limpo) != 8:
+        raise HTTPException(status_code=400, detail="CEP deve ter 8 dígitos")
+
+    endereco = await cep_cache.get(cep_limpo, fetch_cep)
+    if endereco is None:
+        raise HTTPException(status_code=404, detail="CEP não encontrado")
+    return endereco
+
+
+@router.post("/cep/bulk")
+async def buscar_ceps(request: CEPBulkRequest):
+    """Resolver vários CEPs de uma vez
+
+    CEPs em cache não geram chamada ao ViaCEP; os demais são consultados com
+    concorrência limitada (CEP_MAX_CONCURRENT_LOOKUPS).
+    """
+    if len(request.ceps) > CEP_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {CEP_BULK_MAX} CEPs por requisição")
+
+    validos, invalidos = [], []
+    for cep in request.ceps:
+        cep_limpo = limpar_cep(cep)
+        if len(cep_limpo) == 8:
+            validos.append(cep_limpo)
+        else:
+            invalidos.append(cep)
+
+    enderecos, erros = await cep_cache.get_many(validos, fetch_cep)
+
+    return {
+        "total": len(enderecos) + len(erros),
+        "encontrados": sum(1 for endereco in enderecos.values() if endereco is not None),
+        "enderecos": {cep: endereco for cep, endereco in enderecos.items() if endereco is not None},
+        "nao_encontrados": [cep for cep, endereco in enderecos.items() if endereco is None],
+        "invalidos": invalidos,
+        "erros": erros
+    }
@@ -1,14 +1,132 @@
 from fastapi import APIRouter, HTTPException
+from pymongo import UpdateOne
+from typing import Optional
+from datetime import datetime
+import asyncio
 import httpx
+import os
+import time
+from database import customers_collection
 from schemas import CNPJData
+from lookup_cache import LookupCache
+from http_clients import RateLimiter, get_http_client, request_with_retry
+from customer_import import normalize_cnpj
+from import_jobs import create_job, find_active_job, import_job_helper, register_import_runner, rows_per_second, save_progress
 
 router = APIRouter()
 
+# Cache das consultas à BrasilAPI (ver lookup_cache.py)
+cnpj_cache = LookupCache(
+    "cnpj",
+    fresh_ttl=int(os.getenv("CNPJ_CACHE_TTL", "86400")),
+    stale_ttl=int(os.getenv("CNPJ_CACHE_STALE_TTL", "2592000")),
+    negative_ttl=int(os.getenv("CNPJ_CACHE_NEGATIVE_TTL", "3600")),
+    max_entries=int(os.getenv("CNPJ_CACHE_MAX_ENTRIES", "2048")),
+    max_concurrent_fetches=int(os.getenv("CNPJ_MAX_CONCURRENT_LOOKUPS", "5"))
+)
+
+# Enriquecimento em lote: ritmo máximo de consultas à BrasilAPI (por segundo) e
+# consultas simultâneas, separadas das vagas das consultas interativas
+CNPJ_ENRICHMENT_RATE = float(os.getenv("CNPJ_ENRICHMENT_RATE", "3"))
+CNPJ_ENRICHMENT_CONCURRENCY = int(os.getenv("CNPJ_ENRICHMENT_CONCURRENCY", "2"))
+CNPJ_ENRICHMENT_BATCH_SIZE = 100
+CNPJ_ENRICHMENT_JOB = "customers_cnpj_enrichment"
+
+# Campos do cliente preenchidos com os dados do CNPJ (apenas se estiverem vazios)
+ENRICHMENT_FIELDS = (
+    "razao_social", "nome_fantasia", "porte", "natureza_juridica", "capital_social",
+    "cep", "logradouro", "numero", "complemento", "bairro", "municipio", "uf",
+    "atividade_principal", "data_abertura", "situacao",
+)
+
+# Clientes com CNPJ e algum destes campos vazio entram no enriquecimento
+ENRICHMENT_TRIGGER_FIELDS = ("razao_social", "porte", "municipio", "uf", "atividade_principal")
+
+
+
+class EnrichmentSlots:
+    """Vagas de consulta do enriquecimento: espera o ritmo antes de ocupar uma vaga"""
+
+    def __init__(self, limiter: RateLimiter, concurrency: int):
+        self.limiter = limiter
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        await self._slots.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self._slots.release()
+
+
+enrichment_slots = EnrichmentSlots(
+    RateLimiter(CNPJ_ENRICHMENT_RATE, burst=max(1, int(CNPJ_ENRICHMENT_RATE))),
+    CNPJ_ENRICHMENT_CONCURRENCY
+)
+
+
+async def fetch_cnpj(cnpj_clean: str) -> Optional[dict]:
+    """Consultar a BrasilAPI; None se o CNPJ não existir"""
+    try:
+        # Usando Brasil API (gratuita e confiável), cliente compartilhado (ver http_clients.py)
+        response = await request_with_retry(get_http_client("brasilapi"), "GET", f"/api/cnpj/v1/{cnpj_clean}")
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Timeout ao consultar CNPJ")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"Erro na requisição: {str(e)}")
+
+    if response.status_code == 404:
+        return None
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Erro ao consultar CNPJ")
+
+    data = response.json()
+
+    # Mapear dados da Brasil API para nosso schema
+    cnpj_data = {
+        "cnpj": data.get("cnpj", cnpj_clean),
+        "razao_social": data.get("razao_social", ""),
+        "nome_fantasia": data.get("nome_fantasia"),
+        "porte": data.get("porte"),
+        "natureza_juridica": data.get("natureza_juridica"),
+        "capital_social": data.get("capital_social"),
+        "cep": data.get("cep"),
+        "logradouro": data.get("logradouro"),
+        "numero": data.get("numero"),
+        "complemento": data.get("complemento"),
+        "bairro": data.get("bairro"),
+        "municipio": data.get("municipio"),
+        "uf": data.get("uf"),
+        "email": data.get("email"),
+        "telefone": data.get("ddd_telefone_1"),
+        "data_abertura": data.get("data_inicio_atividade"),
+        "situacao": data.get("descricao_situacao_cadastral"),
+    }
+
+    # Atividade principal
+    if data.get("cnae_fiscal_descricao"):
+        cnpj_data["atividade_principal"] = data.get("cnae_fiscal_descricao")
+    elif data.get("cnaes_secundarios") and len(data.get("cnaes_secundarios", [])) > 0:
+        cnpj_data["atividade_principal"] = data["cnaes_secundarios"][0].get("descricao")
+
+    # Validar antes de guardar em cache
+    return CNPJData(**cnpj_data).model_dump()
+
+
+async def lookup_cnpj(cnpj: str) -> Optional[dict]:
+    """Dados do CNPJ (14 dígitos) pelo cache; None se não encontrado"""
+    return await cnpj_cache.get(cnpj, fetch_cnpj)
+
+
 @router.get("/cnpj/{cnpj}", response_model=CNPJData)
 async def get_cnpj_data(cnpj: str):
     """
     Busca dados de CNPJ na API da Receita Federal
     API pública: https://brasilapi.com.br/docs
+
+    Respostas em cache (memória + MongoDB); dados velhos são servidos enquanto
+    uma atualização roda em segundo plano.
     """
     # Remove caracteres não numéricos
     cnpj_clean = ''.join(filter(str.isdigit, cnpj))
@@ -17,50 +135,133 @@ async def get_cnpj_data(cnpj: str):
         raise HTTPException(status_code=400, detail="CNPJ deve ter 14 dígitos")
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Usando Brasil API (gratuita e confiável)
-            response = await client.get(f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_clean}")
-
-            if response.status_code == 404:
-                raise HTTPException(status_code=404, detail="CNPJ não encontrado")
-
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Erro ao consultar CNPJ")
-
-            data = response.json()
-
-            # Mapear dados da Brasil API para nosso schema
-            cnpj_data = {
-                "cnpj": data.get("cnpj", cnpj_clean),
-                "razao_social": data.get("razao_social", ""),
-                "nome_fantasia": data.get("nome_fantasia"),
-                "porte": data.get("porte"),
-                "natureza_juridica": data.get("natureza_juridica"),
-                "capital_social": data.get("capital_social"),
-                "cep": data.get("cep"),
-                "logradouro": data.get("logradouro"),
-                "numero": data.get("numero"),
-                "complemento": data.get("complemento"),
-                "bairro": data.get("bairro"),
-                "municipio": data.get("municipio"),
-                "uf": data.get("uf"),
-                "email": data.get("email"),
-                "telefone": data.get("ddd_telefone_1"),
-                "data_abertura": data.get("data_inicio_atividade"),
-                "situacao": data.get("descricao_situacao_cadastral"),
-            }
-
-            # Atividade principal
-            if data.get("cnae_fiscal_descricao"):
-                cnpj_data["atividade_principal"] = data.get("cnae_fiscal_descricao")
-            elif data.get("cnaes_secundarios") and len(data.get("cnaes_secundarios", [])) > 0:
-                cnpj_data["atividade_principal"] = data["cnaes_secundarios"][0].get("descricao")
-
-            return CNPJData(**cnpj_data)
-
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="Timeout ao consultar CNPJ")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=500, detail=f"Erro na requisição: {str(e)}")
+        cnpj_data = await lookup_cnpj(cnpj_clean)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar dados: {str(e)}")
+
+    if cnpj_data is None:
+        raise HTTPException(status_code=404, detail="CNPJ não encontrado")
+    return CNPJData(**cnpj_data)
+
+
+def _empty(value) -> bool:
+    return value is None or value == ""
+
+
+def _enrichment_query(after_id=None) -> dict:
+    query = {
+        "cnpj": {"$nin": [None, ""]},
+        "$or": [{field: {"$in": [None, ""]}} for field in ENRICHMENT_TRIGGER_FIELDS]
+    }
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+    return query
+
+
+def enrichment_changes(customer: dict, cnpj_data: dict) -> dict:
+    """Campos vazios do cliente que os dados do CNPJ preenchem"""
+    changes = {
+        field: cnpj_data[field]
+        for field in ENRICHMENT_FIELDS
+        if _empty(customer.get(field)) and not _empty(cnpj_data.get(field))
+    }
+    if _empty(customer.get("company")):
+        company = cnpj_data.get("nome_fantasia") or cnpj_data.get("razao_social")
+        if company:
+            changes["company"] = company
+    return changes
+
+
+async def run_cnpj_enrichment_job(job: dict):
+    """Enriquecer clientes pelo CNPJ, em blocos por _id (retoma do último bloco gravado)"""
+    progress = {
+        "total": 0, "scanned": 0, "enriched": 0, "unchanged": 0,
+        "not_found": 0, "invalid": 0, "failed": 0,
+        **job.get("progress", {})
+    }
+    last_id = job.get("last_id")
+    if not progress["total"]:
+        progress["total"] = await customers_collection.count_documents(_enrichment_query())
+
+    run_started = time.monotonic()
+    run_start_rows = progress["scanned"]
+    projection = {field: 1 for field in ("cnpj", "company", *ENRICHMENT_FIELDS)}
+
+    while True:
+        customers = await customers_collection.find(
+            _enrichment_query(last_id), projection
+        ).sort("_id", 1).limit(CNPJ_ENRICHMENT_BATCH_SIZE).to_list(CNPJ_ENRICHMENT_BATCH_SIZE)
+        if not customers:
+            break
+
+        by_cnpj = {}
+        for customer in customers:
+            digits = normalize_cnpj(customer.get("cnpj"))
+            if len(digits) == 14:
+                by_cnpj.setdefault(digits, []).append(customer)
+            else:
+                progress["invalid"] += 1
+
+        # Cache primeiro; só os CNPJs sem cache consultam a BrasilAPI, com ritmo e
+        # vagas próprios (não ocupam as vagas do GET /cnpj)
+        found, failures = await cnpj_cache.get_many(by_cnpj, fetch_cnpj, fetch_slots=enrichment_slots)
+
+        errors = []
+        operations = []
+        now = datetime.now()
+        for digits, group in by_cnpj.items():
+            if digits in failures:
+                progress["failed"] += len(group)
+                errors.append(f"CNPJ {digits}: {failures[digits]}")
+                continue
+            cnpj_data = found.get(digits)
+            if cnpj_data is None:
+                progress["not_found"] += len(group)
+                continue
+
+            for customer in group:
+                changes = enrichment_changes(customer, cnpj_data)
+                if not changes:
+                    progress["unchanged"] += 1
+                    continue
+                # Só grava se os campos continuarem vazios (edição feita nesse meio tempo prevalece)
+                operations.append(UpdateOne(
+                    {"_id": customer["_id"], **{field: {"$in": [None, ""]} for field in changes}},
+                    {"$set": {**changes, "updated_at": now}}
+                ))
+
+        if operations:
+            result = await customers_collection.bulk_write(operations, ordered=False)
+            progress["enriched"] += result.modified_count
+            progress["unchanged"] += len(operations) - result.modified_count
+
+        progress["scanned"] += len(customers)
+        last_id = customers[-1]["_id"]
+        await save_progress(job, {
+            "last_id": last_id,
+            "progress": progress,
+            "rows_done": progress["scanned"],
+            "imported": progress["enriched"],
+            "rows_per_second": rows_per_second(progress["scanned"] - run_start_rows, run_started)
+        }, errors)
+
+    await save_progress(job, {"progress": progress, "status": "done", "finished_at": datetime.utcnow()})
+
+
+register_import_runner(CNPJ_ENRICHMENT_JOB, run_cnpj_enrichment_job)
+
+
+@router.post("/cnpj/enrichment/jobs", status_code=202)
+async def create_cnpj_enrichment_job(user_id: Optional[str] = None):
+    """Enriquecer em segundo plano os clientes com CNPJ e dados cadastrais faltando
+
+    Progresso em GET /import/jobs/{job_id} (campo progress) e, com user_id, pelo
+    WebSocket de notificações. Se falhar, POST /import/jobs/{job_id}/resume
+    continua do último bloco gravado. Um job em andamento é reaproveitado.
+    """
+    job = await find_active_job(CNPJ_ENRICHMENT_JOB)
+    if job is None:
+        job = await create_job(CNPJ_ENRICHMENT_JOB, user_id)
+    return import_job_helper(job)
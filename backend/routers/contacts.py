@@ -1,28 +1,64 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional, Union
 from datetime import datetime
 from bson import ObjectId
 import schemas
 from database import contacts_collection, customers_collection
 from models import contact_helper
+from pagination import find_page, parse_sort, sort_spec
+from sparse import parse_fields, build_projection, sparse_response
+from crud import insert_and_return, update_and_return, exists, existing_ids, check_bulk_size, bulk_insert
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Contact])
-async def get_contacts(skip: int = 0, limit: int = 100):
+# Campos de ordenação cobertos pelos índices (campo, _id)
+CONTACT_SORT_FIELDS = ["created_at"]
+
+@router.get("/", response_model=Union[List[schemas.Contact], schemas.ContactPage])
+async def get_contacts(
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    # Modo esparso: ?fields=campo1,campo2 projeta apenas esses campos no MongoDB
+    selected = parse_fields(fields, schemas.Contact)
+    projection = build_projection(selected) if selected else None
+
+    # Paginação por cursor: envie cursor vazio na primeira página e next_cursor nas seguintes
+    if cursor is not None:
+        docs, next_cursor = await find_page(contacts_collection, {}, limit, cursor, sort, CONTACT_SORT_FIELDS, projection)
+        if selected:
+            return sparse_response(schemas.Contact, selected, docs, next_cursor, paged=True)
+        return {"items": [contact_helper(doc) for doc in docs], "next_cursor": next_cursor}
+
+    query = contacts_collection.find({}, projection)
+    if sort:
+        query = query.sort(sort_spec(*parse_sort(sort, CONTACT_SORT_FIELDS)))
+
+    if selected:
+        docs = await query.skip(skip).limit(limit).to_list(limit)
+        return sparse_response(schemas.Contact, selected, docs)
+
     contacts = []
-    async for contact in contacts_collection.find().skip(skip).limit(limit):
+    async for contact in query.skip(skip).limit(limit):
         contacts.append(contact_helper(contact))
     return contacts
 
 @router.get("/{contact_id}", response_model=schemas.Contact)
-async def get_contact(contact_id: str):
+async def get_contact(contact_id: str, fields: Optional[str] = None):
     if not ObjectId.is_valid(contact_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
+    selected = parse_fields(fields, schemas.Contact)
+    projection = build_projection(selected) if selected else None
+
+    contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)}, projection)
     if contact is None:
         raise HTTPException(status_code=404, detail="Contato não encontrado")
+    if selected:
+        return sparse_response(schemas.Contact, selected, contact)
     return contact_helper(contact)
 
 @router.post("/", response_model=schemas.Contact)
@@ -31,18 +67,44 @@ async def create_contact(contact: schemas.ContactCreate):
     if not ObjectId.is_valid(contact.customer_id):
         raise HTTPException(status_code=400, detail="ID do cliente inválido")
 
-    customer = await customers_collection.find_one({"_id": ObjectId(contact.customer_id)})
-    if not customer:
+    if not await exists(customers_collection, ObjectId(contact.customer_id)):
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
 
     contact_dict = contact.model_dump()
     contact_dict["customer_id"] = ObjectId(contact.customer_id)
     contact_dict["created_at"] = datetime.utcnow()
 
-    result = await contacts_collection.insert_one(contact_dict)
-    new_contact = await contacts_collection.find_one({"_id": result.inserted_id})
+    new_contact = await insert_and_return(contacts_collection, contact_dict)
     return contact_helper(new_contact)
 
+@router.post("/bulk", response_model=schemas.BulkCreateResult)
+async def create_contacts_bulk(contacts: List[schemas.ContactCreate]):
+    # Clientes referenciados validados com uma única consulta $in
+    check_bulk_size(contacts)
+
+    customer_ids = [ObjectId(item.customer_id) for item in contacts if ObjectId.is_valid(item.customer_id)]
+    found_customers = await existing_ids(customers_collection, customer_ids)
+
+    results = [None] * len(contacts)
+    documents, positions = [], []
+    now = datetime.utcnow()
+
+    for idx, contact in enumerate(contacts):
+        if not ObjectId.is_valid(contact.customer_id):
+            results[idx] = {"index": idx, "success": False, "error": "ID do cliente inválido"}
+            continue
+        if ObjectId(contact.customer_id) not in found_customers:
+            results[idx] = {"index": idx, "success": False, "error": "Cliente não encontrado"}
+            continue
+
+        contact_dict = contact.model_dump()
+        contact_dict["customer_id"] = ObjectId(contact.customer_id)
+        contact_dict["created_at"] = now
+        documents.append(contact_dict)
+        positions.append(idx)
+
+    return await bulk_insert(contacts_collection, results, documents, positions)
+
 @router.put("/{contact_id}", response_model=schemas.Contact)
 async def update_contact(contact_id: str, contact: schemas.ContactUpdate):
     if not ObjectId.is_valid(contact_id):
@@ -53,17 +115,10 @@ async def update_contact(contact_id: str, contact: schemas.ContactUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
 
-    result = await contacts_collection.update_one(
-        {"_id": ObjectId(contact_id)},
-        {"$set": update_data}
-    )
-
-    if result.modified_count == 0:
-        existing = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Contato não encontrado")
+    updated_contact = await update_and_return(contacts_collection, ObjectId(contact_id), update_data)
+    if updated_contact is None:
+        raise HTTPException(status_code=404, detail="Contato não encontrado")
 
-    updated_contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
     return contact_helper(updated_contact)
 
 @router.delete("/{contact_id}")
@@ -3,6 +3,8 @@ from typing import List
 from datetime import datetime
 from bson import ObjectId
 from ..database import attachments_collection, interactions_collection, notes_collection
+from ..lead_scoring import mark_lead_dirty, mark_leads_dirty
+from pymongo import ReturnDocument
 from ..schemas import (
     AttachmentCreate, Attachment,
     InteractionCreate, Interaction,
@@ -79,6 +81,8 @@ async def create_interaction(interaction: InteractionCreate):
 
     result = await interactions_collection.insert_one(interaction_dict)
     new_interaction = await interactions_collection.find_one({"_id": result.inserted_id})
+    # Interações contam no score do lead
+    await mark_lead_dirty(new_interaction.get("customer_id"))
 
     return Interaction(**new_interaction)
 
@@ -101,14 +105,20 @@ async def update_interaction(interaction_id: str, interaction: InteractionCreate
 
     interaction_dict = interaction.model_dump()
 
-    result = await interactions_collection.update_one(
+    previous_interaction = await interactions_collection.find_one_and_update(
         {"_id": ObjectId(interaction_id)},
-        {"$set": interaction_dict}
+        {"$set": interaction_dict},
+        projection={"customer_id": 1},
+        return_document=ReturnDocument.BEFORE
     )
 
-    if result.matched_count == 0:
+    if previous_interaction is None:
         raise HTTPException(status_code=404, detail="Interação não encontrada")
 
+    # Interação movida para outro cliente muda o score dos dois
+    if previous_interaction.get("customer_id") != interaction_dict.get("customer_id"):
+        await mark_leads_dirty([previous_interaction.get("customer_id"), interaction_dict.get("customer_id")])
+
     updated_interaction = await interactions_collection.find_one({"_id": ObjectId(interaction_id)})
     return Interaction(**updated_interaction)
 
@@ -119,11 +129,16 @@ async def delete_interaction(interaction_id: str):
     if not ObjectId.is_valid(interaction_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    result = await interactions_collection.delete_one({"_id": ObjectId(interaction_id)})
+    deleted_interaction = await interactions_collection.find_one_and_delete(
+        {"_id": ObjectId(interaction_id)},
+        {"customer_id": 1}
+    )
 
-    if result.deleted_count == 0:
+    if deleted_interaction is None:
         raise HTTPException(status_code=404, detail="Interação não encontrada")
 
+    await mark_lead_dirty(deleted_interaction.get("customer_id"))
+
     return {"message": "Interação deletada com sucesso"}
 
 
@@ -1,28 +1,67 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional, Union
 from datetime import datetime
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import schemas
 from database import customers_collection
 from models import customer_helper
+from pagination import find_page, parse_sort, sort_spec
+from sparse import parse_fields, build_projection, sparse_response
+from counters import apply_delta, customer_delta
+from crud import insert_and_return, update_with_images
+from lead_scoring import mark_lead_dirty, score_inputs_changed
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Customer])
-async def get_customers(skip: int = 0, limit: int = 100):
+# Campos de ordenação cobertos pelos índices (campo, _id)
+CUSTOMER_SORT_FIELDS = ["created_at", "updated_at"]
+
+@router.get("/", response_model=Union[List[schemas.Customer], schemas.CustomerPage])
+async def get_customers(
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    # Modo esparso: ?fields=campo1,campo2 projeta apenas esses campos no MongoDB
+    selected = parse_fields(fields, schemas.Customer)
+    projection = build_projection(selected) if selected else None
+
+    # Paginação por cursor: envie cursor vazio na primeira página e next_cursor nas seguintes
+    if cursor is not None:
+        docs, next_cursor = await find_page(customers_collection, {}, limit, cursor, sort, CUSTOMER_SORT_FIELDS, projection)
+        if selected:
+            return sparse_response(schemas.Customer, selected, docs, next_cursor, paged=True)
+        return {"items": [customer_helper(doc) for doc in docs], "next_cursor": next_cursor}
+
+    query = customers_collection.find({}, projection)
+    if sort:
+        query = query.sort(sort_spec(*parse_sort(sort, CUSTOMER_SORT_FIELDS)))
+
+    if selected:
+        docs = await query.skip(skip).limit(limit).to_list(limit)
+        return sparse_response(schemas.Customer, selected, docs)
+
     customers = []
-    async for customer in customers_collection.find().skip(skip).limit(limit):
+    async for customer in query.skip(skip).limit(limit):
         customers.append(customer_helper(customer))
     return customers
 
 @router.get("/{customer_id}", response_model=schemas.Customer)
-async def get_customer(customer_id: str):
+async def get_customer(customer_id: str, fields: Optional[str] = None):
     if not ObjectId.is_valid(customer_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    customer = await customers_collection.find_one({"_id": ObjectId(customer_id)})
+    selected = parse_fields(fields, schemas.Customer)
+    projection = build_projection(selected) if selected else None
+
+    customer = await customers_collection.find_one({"_id": ObjectId(customer_id)}, projection)
     if customer is None:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    if selected:
+        return sparse_response(schemas.Customer, selected, customer)
     return customer_helper(customer)
 
 @router.post("/", response_model=schemas.Customer)
@@ -31,8 +70,12 @@ async def create_customer(customer: schemas.CustomerCreate):
     customer_dict["created_at"] = datetime.utcnow()
     customer_dict["updated_at"] = datetime.utcnow()
 
-    result = await customers_collection.insert_one(customer_dict)
-    new_customer = await customers_collection.find_one({"_id": result.inserted_id})
+    try:
+        new_customer = await insert_and_return(customers_collection, customer_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Já existe um cliente com este email")
+    await apply_delta(customer_delta(after=new_customer))
+    await mark_lead_dirty(new_customer["_id"])
     return customer_helper(new_customer)
 
 @router.put("/{customer_id}", response_model=schemas.Customer)
@@ -47,17 +90,17 @@ async def update_customer(customer_id: str, customer: schemas.CustomerUpdate):
 
     update_data["updated_at"] = datetime.utcnow()
 
-    result = await customers_collection.update_one(
-        {"_id": ObjectId(customer_id)},
-        {"$set": update_data}
-    )
+    try:
+        previous_customer, updated_customer = await update_with_images(customers_collection, ObjectId(customer_id), update_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Já existe um cliente com este email")
+    if updated_customer is None:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
 
-    if result.modified_count == 0:
-        existing = await customers_collection.find_one({"_id": ObjectId(customer_id)})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await apply_delta(customer_delta(previous_customer, updated_customer))
+    if score_inputs_changed(previous_customer, updated_customer):
+        await mark_lead_dirty(updated_customer["_id"])
 
-    updated_customer = await customers_collection.find_one({"_id": ObjectId(customer_id)})
     return customer_helper(updated_customer)
 
 @router.delete("/{customer_id}")
@@ -65,9 +108,11 @@ async def delete_customer(customer_id: str):
     if not ObjectId.is_valid(customer_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    result = await customers_collection.delete_one({"_id": ObjectId(customer_id)})
+    deleted_customer = await customers_collection.find_one_and_delete({"_id": ObjectId(customer_id)}, {"status": 1})
 
-    if result.deleted_count == 0:
+    if deleted_customer is None:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
 
+    await apply_delta(customer_delta(before=deleted_customer))
+
     return {"message": "Cliente deletado com sucesso"}
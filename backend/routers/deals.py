@@ -1,28 +1,66 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional, Union
 from datetime import datetime
 from bson import ObjectId
 import schemas
 from database import deals_collection, customers_collection
 from models import deal_helper
+from pagination import find_page, parse_sort, sort_spec
+from sparse import parse_fields, build_projection, sparse_response
+from counters import apply_delta, deal_delta, merge_deltas
+from stage_events import record_stage_change, record_stage_events
+from crud import insert_and_return, update_with_images, exists, existing_ids, check_bulk_size, bulk_insert, inserted_documents
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Deal])
-async def get_deals(skip: int = 0, limit: int = 100):
+# Campos de ordenação cobertos pelos índices (campo, _id)
+DEAL_SORT_FIELDS = ["created_at", "updated_at"]
+
+@router.get("/", response_model=Union[List[schemas.Deal], schemas.DealPage])
+async def get_deals(
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    # Modo esparso: ?fields=campo1,campo2 projeta apenas esses campos no MongoDB
+    selected = parse_fields(fields, schemas.Deal)
+    projection = build_projection(selected) if selected else None
+
+    # Paginação por cursor: envie cursor vazio na primeira página e next_cursor nas seguintes
+    if cursor is not None:
+        docs, next_cursor = await find_page(deals_collection, {}, limit, cursor, sort, DEAL_SORT_FIELDS, projection)
+        if selected:
+            return sparse_response(schemas.Deal, selected, docs, next_cursor, paged=True)
+        return {"items": [deal_helper(doc) for doc in docs], "next_cursor": next_cursor}
+
+    query = deals_collection.find({}, projection)
+    if sort:
+        query = query.sort(sort_spec(*parse_sort(sort, DEAL_SORT_FIELDS)))
+
+    if selected:
+        docs = await query.skip(skip).limit(limit).to_list(limit)
+        return sparse_response(schemas.Deal, selected, docs)
+
     deals = []
-    async for deal in deals_collection.find().skip(skip).limit(limit):
+    async for deal in query.skip(skip).limit(limit):
         deals.append(deal_helper(deal))
     return deals
 
 @router.get("/{deal_id}", response_model=schemas.Deal)
-async def get_deal(deal_id: str):
+async def get_deal(deal_id: str, fields: Optional[str] = None):
     if not ObjectId.is_valid(deal_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    deal = await deals_collection.find_one({"_id": ObjectId(deal_id)})
+    selected = parse_fields(fields, schemas.Deal)
+    projection = build_projection(selected) if selected else None
+
+    deal = await deals_collection.find_one({"_id": ObjectId(deal_id)}, projection)
     if deal is None:
         raise HTTPException(status_code=404, detail="Negócio não encontrado")
+    if selected:
+        return sparse_response(schemas.Deal, selected, deal)
     return deal_helper(deal)
 
 @router.post("/", response_model=schemas.Deal)
@@ -31,19 +69,54 @@ async def create_deal(deal: schemas.DealCreate):
     if not ObjectId.is_valid(deal.customer_id):
         raise HTTPException(status_code=400, detail="ID do cliente inválido")
 
-    customer = await customers_collection.find_one({"_id": ObjectId(deal.customer_id)})
-    if not customer:
+    if not await exists(customers_collection, ObjectId(deal.customer_id)):
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
 
     deal_dict = deal.model_dump()
     deal_dict["customer_id"] = ObjectId(deal.customer_id)
     deal_dict["created_at"] = datetime.utcnow()
     deal_dict["updated_at"] = datetime.utcnow()
+    deal_dict["stage_entered_at"] = deal_dict["created_at"]
 
-    result = await deals_collection.insert_one(deal_dict)
-    new_deal = await deals_collection.find_one({"_id": result.inserted_id})
+    new_deal = await insert_and_return(deals_collection, deal_dict)
+    await apply_delta(deal_delta(after=new_deal))
+    await record_stage_change(None, new_deal)
     return deal_helper(new_deal)
 
+@router.post("/bulk", response_model=schemas.BulkCreateResult)
+async def create_deals_bulk(deals: List[schemas.DealCreate]):
+    # Clientes referenciados validados com uma única consulta $in
+    check_bulk_size(deals)
+
+    customer_ids = [ObjectId(item.customer_id) for item in deals if ObjectId.is_valid(item.customer_id)]
+    found_customers = await existing_ids(customers_collection, customer_ids)
+
+    results = [None] * len(deals)
+    documents, positions = [], []
+    now = datetime.utcnow()
+
+    for idx, deal in enumerate(deals):
+        if not ObjectId.is_valid(deal.customer_id):
+            results[idx] = {"index": idx, "success": False, "error": "ID do cliente inválido"}
+            continue
+        if ObjectId(deal.customer_id) not in found_customers:
+            results[idx] = {"index": idx, "success": False, "error": "Cliente não encontrado"}
+            continue
+
+        deal_dict = deal.model_dump()
+        deal_dict["customer_id"] = ObjectId(deal.customer_id)
+        deal_dict["created_at"] = now
+        deal_dict["updated_at"] = now
+        deal_dict["stage_entered_at"] = now
+        documents.append(deal_dict)
+        positions.append(idx)
+
+    result = await bulk_insert(deals_collection, results, documents, positions)
+    inserted = inserted_documents(result, documents, positions)
+    await apply_delta(merge_deltas(*(deal_delta(after=doc) for doc in inserted)))
+    await record_stage_events([(None, doc) for doc in inserted])
+    return result
+
 @router.put("/{deal_id}", response_model=schemas.Deal)
 async def update_deal(deal_id: str, deal: schemas.DealUpdate):
     if not ObjectId.is_valid(deal_id):
@@ -56,17 +129,13 @@ async def update_deal(deal_id: str, deal: schemas.DealUpdate):
 
     update_data["updated_at"] = datetime.utcnow()
 
-    result = await deals_collection.update_one(
-        {"_id": ObjectId(deal_id)},
-        {"$set": update_data}
-    )
+    previous_deal, updated_deal = await update_with_images(deals_collection, ObjectId(deal_id), update_data)
+    if updated_deal is None:
+        raise HTTPException(status_code=404, detail="Negócio não encontrado")
 
-    if result.modified_count == 0:
-        existing = await deals_collection.find_one({"_id": ObjectId(deal_id)})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Negócio não encontrado")
+    await apply_delta(deal_delta(previous_deal, updated_deal))
+    await record_stage_change(previous_deal, updated_deal)
 
-    updated_deal = await deals_collection.find_one({"_id": ObjectId(deal_id)})
     return deal_helper(updated_deal)
 
 @router.delete("/{deal_id}")
@@ -74,9 +143,11 @@ async def delete_deal(deal_id: str):
     if not ObjectId.is_valid(deal_id):
         raise HTTPException(status_code=400, detail="ID inválido")
 
-    result = await deals_collection.delete_one({"_id": ObjectId(deal_id)})
+    deleted_deal = await deals_collection.find_one_and_delete({"_id": ObjectId(deal_id)}, {"status": 1, "value": 1})
 
-    if result.deleted_count == 0:
+    if deleted_deal is None:
         raise HTTPException(status_code=404, detail="Negócio não encontrado")
 
+    await apply_delta(deal_delta(before=deleted_deal))
+
     return {"message": "Negócio deletado com sucesso"}
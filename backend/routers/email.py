@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 from bson import ObjectId
 from pydantic import BaseModel, EmailStr
 from ..database import customers_collection, activities_collection
+from ..counters import apply_delta, activity_delta
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -123,6 +124,7 @@ async def send_email(email_data: EmailSend, background_tasks: BackgroundTasks):
                 "created_at": datetime.now()
             }
             await activities_collection.insert_one(activity)
+            await apply_delta(activity_delta(after=activity))
 
         return {
             "message": "Email agendado para envio",
@@ -184,6 +186,7 @@ async def send_template_email(
         "created_at": datetime.now()
     }
     await activities_collection.insert_one(activity)
+    await apply_delta(activity_delta(after=activity))
 
     return {
         "message": "Email agendado para envio",
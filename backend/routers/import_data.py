@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File
-from typing import List
-from datetime import datetime
-from bson import ObjectId
+from typing import List, Optional
 from ..database import customers_collection
+from ..customer_import import IMPORT_CHUNK_SIZE, customer_from_csv_row, import_customers, validate_import_options
+from ..uploads import csv_dict_rows
+from ..import_jobs import add_progress_listener, create_import_job, get_import_job, resume_import_job, import_job_helper
+from .notifications import manager
 import csv
 import io
+import json
 from pydantic import BaseModel, EmailStr
 
 router = APIRouter()
@@ -18,67 +21,53 @@ class CustomerImport(BaseModel):
     status: str = "lead"
     origem: str = "importacao"
 
+def _import_message(result: dict, mode: str) -> str:
+    if mode == "upsert":
+        summary = result["summary"]
+        return (
+            f"{summary['created']} criados, {summary['updated']} atualizados, "
+            f"{summary['unchanged']} sem alteração, {summary['skipped']} ignorados"
+        )
+    return f"{result['imported']} clientes importados com sucesso"
+
+
 @router.post("/import/customers/csv")
-async def import_customers_csv(file: UploadFile = File(...)):
-    """Importar clientes de arquivo CSV"""
+async def import_customers_csv(
+    file: UploadFile = File(...),
+    mode: str = "insert",
+    key: str = "email",
+    on_conflict: str = "overwrite"
+):
+    """Importar clientes de arquivo CSV
+
+    mode=upsert atualiza os clientes existentes (localizados por email ou CNPJ,
+    conforme key) segundo on_conflict: overwrite, fill_empty ou skip.
+    """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
+    validate_import_options(mode, key, on_conflict)
 
     try:
-        # Ler arquivo
-        contents = await file.read()
-        decoded = contents.decode('utf-8-sig')
-        csv_file = io.StringIO(decoded)
-        reader = csv.DictReader(csv_file)
-
-        imported = 0
-        errors = []
-
-        for row_num, row in enumerate(reader, start=2):
-            try:
-                # Validar campos obrigatórios
-                if not row.get('name') or not row.get('email'):
-                    errors.append(f"Linha {row_num}: Nome e email são obrigatórios")
-                    continue
-
-                # Verificar se já existe
-                existing = await customers_collection.find_one({"email": row['email']})
-                if existing:
-                    errors.append(f"Linha {row_num}: Cliente com email {row['email']} já existe")
-                    continue
-
-                # Criar cliente
-                customer = {
-                    "name": row.get('name', ''),
-                    "email": row.get('email', ''),
-                    "phone": row.get('phone', ''),
-                    "company": row.get('company', ''),
-                    "cnpj": row.get('cnpj', ''),
-                    "status": row.get('status', 'lead'),
-                    "origem": row.get('origem', 'importacao'),
-                    "categoria": row.get('categoria', ''),
-                    "segmento": row.get('segmento', ''),
-                    "responsavel": row.get('responsavel', ''),
-                    "cep": row.get('cep', ''),
-                    "municipio": row.get('municipio', ''),
-                    "uf": row.get('uf', ''),
-                    "observacoes": row.get('observacoes', ''),
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                }
-
-                await customers_collection.insert_one(customer)
-                imported += 1
-
-            except Exception as e:
-                errors.append(f"Linha {row_num}: {str(e)}")
+        # Leitura incremental do upload e gravação em blocos (ver uploads.py e customer_import.py)
+        with_defaults = mode == "insert"
+        result = await import_customers(
+            ((row_num, customer_from_csv_row(row, with_defaults)) async for row_num, row in csv_dict_rows(file)),
+            label="Linha",
+            mode=mode,
+            key=key,
+            on_conflict=on_conflict
+        )
 
         return {
-            "message": f"{imported} clientes importados com sucesso",
-            "imported": imported,
-            "errors": errors
+            "message": _import_message(result, mode),
+            "imported": result["imported"],
+            "summary": result["summary"],
+            "batches": result["batches"],
+            "errors": result["errors"]
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao importar: {str(e)}")
 
@@ -87,38 +76,68 @@ async def import_customers_csv(file: UploadFile = File(...)):
 async def import_customers_bulk(customers: List[CustomerImport]):
     """Importar múltiplos clientes via JSON"""
     try:
-        imported = 0
-        errors = []
-
-        for idx, customer_data in enumerate(customers):
-            try:
-                # Verificar se já existe
-                existing = await customers_collection.find_one({"email": customer_data.email})
-                if existing:
-                    errors.append(f"Cliente {idx+1}: Email {customer_data.email} já existe")
-                    continue
-
-                customer_dict = customer_data.model_dump()
-                customer_dict["created_at"] = datetime.now()
-                customer_dict["updated_at"] = datetime.now()
-
-                await customers_collection.insert_one(customer_dict)
-                imported += 1
-
-            except Exception as e:
-                errors.append(f"Cliente {idx+1}: {str(e)}")
+        result = await import_customers(
+            ((idx + 1, customer_data.model_dump()) for idx, customer_data in enumerate(customers)),
+            label="Cliente"
+        )
 
         return {
-            "message": f"{imported} clientes importados com sucesso",
-            "imported": imported,
+            "message": f"{result['imported']} clientes importados com sucesso",
+            "imported": result["imported"],
             "total": len(customers),
-            "errors": errors
+            "errors": result["errors"]
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao importar: {str(e)}")
 
 
+# Jobs de importação: processamento em segundo plano com progresso (ver import_jobs.py)
+async def _send_import_progress(progress: dict):
+    if not progress.get("user_id"):
+        return
+    message = json.dumps({"type": "import_progress", **progress}, default=str)
+    await manager.send_personal_message(message, progress["user_id"])
+
+
+add_progress_listener(_send_import_progress)
+
+
+@router.post("/import/jobs/customers/csv", status_code=202)
+async def create_customers_import_job(
+    file: UploadFile = File(...),
+    user_id: Optional[str] = None,
+    mode: str = "insert",
+    key: str = "email",
+    on_conflict: str = "overwrite"
+):
+    """Enviar CSV para importação em segundo plano
+
+    O progresso pode ser acompanhado por GET /import/jobs/{job_id} e, com user_id,
+    pelo WebSocket de notificações (mensagens do tipo import_progress).
+    Aceita as mesmas opções de upsert de POST /import/customers/csv.
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
+    validate_import_options(mode, key, on_conflict)
+
+    options = {"mode": mode, "key": key, "on_conflict": on_conflict}
+    job = await create_import_job(file, "customers_csv", user_id, options)
+    return import_job_helper(job)
+
+
+@router.get("/import/jobs/{job_id}")
+async def get_customers_import_job(job_id: str):
+    """Progresso do job de importação"""
+    return import_job_helper(await get_import_job(job_id))
+
+
+@router.post("/import/jobs/{job_id}/resume")
+async def resume_customers_import_job(job_id: str):
+    """Retomar job que falhou a partir do último bloco gravado"""
+    return import_job_helper(await resume_import_job(job_id))
+
+
 @router.get("/import/template/csv")
 async def download_import_template():
     """Baixar template CSV para importação"""
@@ -176,18 +195,32 @@ async def validate_csv_before_import(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
 
     try:
-        contents = await file.read()
-        decoded = contents.decode('utf-8-sig')
-        csv_file = io.StringIO(decoded)
-        reader = csv.DictReader(csv_file)
-
         valid_rows = 0
         invalid_rows = []
         duplicate_emails = []
+        pending = []
 
         required_fields = ['name', 'email']
 
-        for row_num, row in enumerate(reader, start=2):
+        async def check_pending():
+            # Verificar emails duplicados no banco (uma consulta por bloco)
+            nonlocal valid_rows
+            emails = [email for _, email in pending]
+            existing = {
+                doc["email"]
+                async for doc in customers_collection.find({"email": {"$in": emails}}, {"email": 1})
+            }
+            for row_num, email in pending:
+                if email in existing:
+                    duplicate_emails.append({
+                        "row": row_num,
+                        "email": email
+                    })
+                else:
+                    valid_rows += 1
+            pending.clear()
+
+        async for row_num, row in csv_dict_rows(file):
             # Verificar campos obrigatórios
             missing_fields = [field for field in required_fields if not row.get(field)]
             if missing_fields:
@@ -197,16 +230,11 @@ async def validate_csv_before_import(file: UploadFile = File(...)):
                 })
                 continue
 
-            # Verificar email duplicado no banco
-            existing = await customers_collection.find_one({"email": row['email']})
-            if existing:
-                duplicate_emails.append({
-                    "row": row_num,
-                    "email": row['email']
-                })
-                continue
+            pending.append((row_num, row['email'].strip()))
+            if len(pending) >= IMPORT_CHUNK_SIZE:
+                await check_pending()
 
-            valid_rows += 1
+        await check_pending()
 
         return {
             "valid_rows": valid_rows,
@@ -219,5 +247,7 @@ async def validate_csv_before_import(file: UploadFile = File(...)):
             "can_import": len(invalid_rows) == 0 and len(duplicate_emails) == 0
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao validar: {str(e)}")
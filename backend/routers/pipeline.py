@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
+from typing import List, Optional, Dict
 from datetime import datetime
 from bson import ObjectId
 from ..database import deals_collection, customers_collection, activities_collection
+from ..counters import apply_delta, deal_delta, customer_delta, activity_delta, merge_deltas
+from ..stage_events import record_stage_change, stage_stats, rebuild_stage_stats, stage_history_seeded
+from pymongo import ReturnDocument
 from pydantic import BaseModel
+import asyncio
+import os
+import time
 
 router = APIRouter()
 
@@ -34,50 +40,108 @@ async def get_pipeline_stages():
     """Obter estágios do pipeline"""
     return {"stages": DEFAULT_STAGES}
 
+# Limites da paginação do board: skip + limit vira o n do $topN de cada estágio
+BOARD_MAX_LIMIT = 500
+BOARD_MAX_SKIP = 5000
+
 @router.get("/pipeline/board")
-async def get_pipeline_board():
-    """Obter board do pipeline com todos os deals por estágio"""
+async def get_pipeline_board(
+    stage: Optional[str] = None,
+    skip: int = Query(0, ge=0, le=BOARD_MAX_SKIP),
+    limit: int = Query(100, ge=1, le=BOARD_MAX_LIMIT)
+):
+    """Obter board do pipeline com todos os deals por estágio
+
+    Informe stage (com skip/limit) para carregar mais deals de uma coluna.
+    """
+    stages = DEFAULT_STAGES
+    if stage:
+        stages = [s for s in DEFAULT_STAGES if s["name"] == stage]
+        if not stages:
+            raise HTTPException(status_code=400, detail="Estágio inválido")
+
     try:
-        pipeline_data = []
+        # Uma agregação: contagem, valor total e os deals mais recentes de cada estágio
+        pipeline = [
+            {"$match": {
+                "status": "open",
+                "stage": {"$in": [s["name"] for s in stages]}
+            }},
+            {"$group": {
+                "_id": "$stage",
+                "count": {"$sum": 1},
+                "total_value": {"$sum": {"$ifNull": ["$value", 0]}},
+                "deals": {"$topN": {
+                    "n": skip + limit,
+                    "sortBy": {"created_at": -1, "_id": -1},
+                    "output": {
+                        "_id": "$_id",
+                        "title": "$title",
+                        "value": "$value",
+                        "customer_id": "$customer_id",
+                        "created_at": "$created_at",
+                        "updated_at": "$updated_at",
+                        "probability": "$probability",
+                        "expected_close_date": "$expected_close_date",
+                        "description": "$description"
+                    }
+                }}
+            }},
+            {"$project": {
+                "count": 1,
+                "total_value": 1,
+                "deals": {"$slice": ["$deals", skip, limit]}
+            }}
+        ]
+        groups = {
+            g["_id"]: g
+            for g in await deals_collection.aggregate(pipeline).to_list(len(stages))
+        }
 
-        for stage in DEFAULT_STAGES:
-            # Buscar deals neste estágio
-            deals = await deals_collection.find({
-                "stage": stage["name"],
-                "status": "open"
-            }).sort("created_at", -1).to_list(100)
+        # Enriquecer com nomes dos clientes em uma única consulta $in
+        customer_ids = {
+            ObjectId(str(deal["customer_id"]))
+            for group in groups.values()
+            for deal in group["deals"]
+            if ObjectId.is_valid(str(deal.get("customer_id")))
+        }
+        customer_names = {}
+        if customer_ids:
+            async for customer in customers_collection.find(
+                {"_id": {"$in": list(customer_ids)}},
+                {"name": 1}
+            ):
+                customer_names[str(customer["_id"])] = customer.get("name")
 
-            # Enriquecer com dados do cliente
-            enriched_deals = []
-            total_value = 0
+        pipeline_data = []
 
-            for deal in deals:
-                customer = await customers_collection.find_one({
-                    "_id": ObjectId(deal["customer_id"])
-                })
+        for stage_info in stages:
+            group = groups.get(stage_info["name"], {"count": 0, "total_value": 0, "deals": []})
 
-                enriched_deals.append({
+            enriched_deals = [
+                {
                     "id": str(deal["_id"]),
                     "title": deal["title"],
                     "value": deal.get("value", 0),
-                    "customer_name": customer["name"] if customer else "N/A",
-                    "customer_id": deal["customer_id"],
+                    "customer_name": customer_names.get(str(deal.get("customer_id")), "N/A"),
+                    "customer_id": str(deal.get("customer_id")),
                     "created_at": deal["created_at"],
                     "updated_at": deal.get("updated_at"),
                     "probability": deal.get("probability", 50),
                     "expected_close_date": deal.get("expected_close_date"),
                     "description": deal.get("description")
-                })
-
-                total_value += deal.get("value", 0)
+                }
+                for deal in group["deals"]
+            ]
 
             pipeline_data.append({
-                "stage": stage["name"],
-                "order": stage["order"],
-                "color": stage["color"],
+                "stage": stage_info["name"],
+                "order": stage_info["order"],
+                "color": stage_info["color"],
                 "deals": enriched_deals,
-                "count": len(enriched_deals),
-                "total_value": total_value
+                "count": group["count"],
+                "total_value": group["total_value"],
+                "has_more": skip + len(enriched_deals) < group["count"]
             })
 
         # Calcular totais
@@ -106,30 +170,35 @@ async def move_deal(move: DealMove):
     if move.new_stage not in valid_stages:
         raise HTTPException(status_code=400, detail="Estágio inválido")
 
-    # Atualizar deal
-    result = await deals_collection.update_one(
+    # Atualizar deal (imagem anterior usada no histórico de estágios)
+    deal_update = {
+        "stage": move.new_stage,
+        "updated_at": datetime.utcnow()
+    }
+    deal = await deals_collection.find_one_and_update(
         {"_id": ObjectId(move.deal_id)},
-        {"$set": {
-            "stage": move.new_stage,
-            "updated_at": datetime.now()
-        }}
+        {"$set": deal_update},
+        return_document=ReturnDocument.BEFORE
     )
 
-    if result.matched_count == 0:
+    if deal is None:
         raise HTTPException(status_code=404, detail="Deal não encontrado")
 
+    await record_stage_change(deal, {**deal, **deal_update})
+
     # Registrar atividade
-    deal = await deals_collection.find_one({"_id": ObjectId(move.deal_id)})
-    await activities_collection.insert_one({
+    activity = {
         "title": f"Deal movido para {move.new_stage}",
         "description": f"Deal '{deal['title']}' foi movido para o estágio {move.new_stage}",
         "activity_type": "pipeline_move",
         "status": "completed",
         "customer_id": deal["customer_id"],
         "deal_id": move.deal_id,
-        "created_at": datetime.now(),
+        "created_at": datetime.utcnow(),
         "automated": True
-    })
+    }
+    await activities_collection.insert_one(activity)
+    await apply_delta(activity_delta(after=activity))
 
     return {
         "message": "Deal movido com sucesso",
@@ -148,37 +217,49 @@ async def win_deal(deal_id: str):
         raise HTTPException(status_code=404, detail="Deal não encontrado")
 
     # Atualizar deal
+    deal_update = {
+        "status": "won",
+        "stage": "Fechamento",
+        "closed_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
     await deals_collection.update_one(
         {"_id": ObjectId(deal_id)},
-        {"$set": {
-            "status": "won",
-            "stage": "Fechamento",
-            "closed_at": datetime.now(),
-            "updated_at": datetime.now()
-        }}
+        {"$set": deal_update}
     )
 
-    # Atualizar cliente para "cliente"
-    await customers_collection.update_one(
+    # Atualizar cliente para "cliente" (imagem anterior usada nos contadores)
+    customer_update = {
+        "status": "cliente",
+        "valor_contrato": deal.get("value", 0),
+        "updated_at": datetime.utcnow()
+    }
+    previous_customer = await customers_collection.find_one_and_update(
         {"_id": ObjectId(deal["customer_id"])},
-        {"$set": {
-            "status": "cliente",
-            "valor_contrato": deal.get("value", 0),
-            "updated_at": datetime.now()
-        }}
+        {"$set": customer_update},
+        projection={"status": 1},
+        return_document=ReturnDocument.BEFORE
     )
 
     # Registrar atividade
-    await activities_collection.insert_one({
+    activity = {
         "title": f"Deal ganho: {deal['title']}",
         "description": f"Deal fechado com sucesso no valor de R$ {deal.get('value', 0):.2f}",
         "activity_type": "deal_won",
         "status": "completed",
         "customer_id": deal["customer_id"],
         "deal_id": deal_id,
-        "created_at": datetime.now(),
+        "created_at": datetime.utcnow(),
         "automated": True
-    })
+    }
+    await activities_collection.insert_one(activity)
+
+    await record_stage_change(deal, {**deal, **deal_update})
+    await apply_delta(merge_deltas(
+        deal_delta(deal, {**deal, **deal_update}),
+        customer_delta(previous_customer, {**previous_customer, **customer_update}) if previous_customer else {},
+        activity_delta(after=activity)
+    ))
 
     return {
         "message": "Deal marcado como ganho!",
@@ -197,27 +278,35 @@ async def lose_deal(deal_id: str, reason: Optional[str] = None):
         raise HTTPException(status_code=404, detail="Deal não encontrado")
 
     # Atualizar deal
+    deal_update = {
+        "status": "lost",
+        "lost_reason": reason,
+        "closed_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
     await deals_collection.update_one(
         {"_id": ObjectId(deal_id)},
-        {"$set": {
-            "status": "lost",
-            "lost_reason": reason,
-            "closed_at": datetime.now(),
-            "updated_at": datetime.now()
-        }}
+        {"$set": deal_update}
     )
 
     # Registrar atividade
-    await activities_collection.insert_one({
+    activity = {
         "title": f"Deal perdido: {deal['title']}",
         "description": f"Deal perdido. Motivo: {reason or 'Não especificado'}",
         "activity_type": "deal_lost",
         "status": "completed",
         "customer_id": deal["customer_id"],
         "deal_id": deal_id,
-        "created_at": datetime.now(),
+        "created_at": datetime.utcnow(),
         "automated": True
-    })
+    }
+    await activities_collection.insert_one(activity)
+
+    await record_stage_change(deal, {**deal, **deal_update})
+    await apply_delta(merge_deltas(
+        deal_delta(deal, {**deal, **deal_update}),
+        activity_delta(after=activity)
+    ))
 
     return {
         "message": "Deal marcado como perdido",
@@ -225,136 +314,258 @@ async def lose_deal(deal_id: str, reason: Optional[str] = None):
     }
 
 
-@router.get("/pipeline/metrics")
-async def get_pipeline_metrics():
-    """Métricas do pipeline de vendas"""
+# Cache das métricas do pipeline: {(start, end): (expira_em, resultado)}
+METRICS_CACHE_TTL = int(os.getenv("PIPELINE_METRICS_CACHE_TTL", "60"))
+METRICS_CACHE_MAX_ENTRIES = 128
+_metrics_cache: Dict[tuple, tuple] = {}
+
+
+def _parse_period(start_date: Optional[str], end_date: Optional[str]):
+    """Converter datas ISO opcionais, retornando 400 se inválidas"""
     try:
-        # Taxa de conversão por estágio
-        conversion_rates = []
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida, use o formato ISO (AAAA-MM-DD)")
+    return start, end
+
+
+async def compute_pipeline_metrics(start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Conversão, tempo por estágio, taxa de vitória e valor médio em uma única agregação"""
+    match = {}
+    if start or end:
+        match["created_at"] = {}
+        if start:
+            match["created_at"]["$gte"] = start
+        if end:
+            match["created_at"]["$lte"] = end
+
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            # Por estágio: abertos, abertos+ganhos e tempo médio (dias)
+            "by_stage": [
+                {"$group": {
+                    "_id": "$stage",
+                    "open": {"$sum": {"$cond": [{"$eq": ["$status", "open"]}, 1, 0]}},
+                    "open_or_won": {"$sum": {"$cond": [{"$in": ["$status", ["open", "won"]]}, 1, 0]}},
+                    "avg_days": {"$avg": {"$divide": [
+                        {"$subtract": [{"$ifNull": ["$updated_at", datetime.utcnow()]}, "$created_at"]},
+                        86400000  # Convert milliseconds to days
+                    ]}}
+                }}
+            ],
+            # Deals fechados: quantidade e valores por resultado
+            "outcomes": [
+                {"$match": {"status": {"$in": ["won", "lost"]}}},
+                {"$group": {
+                    "_id": "$status",
+                    "count": {"$sum": 1},
+                    "avg_value": {"$avg": "$value"},
+                    "total_value": {"$sum": "$value"}
+                }}
+            ]
+        }}
+    ]
+    result, stats = await asyncio.gather(
+        deals_collection.aggregate(pipeline).to_list(1),
+        stage_stats(start, end)
+    )
+    data = result[0] if result else {"by_stage": [], "outcomes": []}
+
+    by_stage = {row["_id"]: row for row in data["by_stage"]}
+    outcomes = {row["_id"]: row for row in data["outcomes"]}
+
+    # Com histórico de estágios (e os deals antigos já com evento inicial) os
+    # números vêm dos eventos; antes disso, da foto atual dos deals
+    use_events = bool(stats) and await stage_history_seeded()
+    source = "events" if use_events else "snapshot"
+
+    # Taxa de conversão por estágio
+    conversion_rates = []
+    for i, stage in enumerate(DEFAULT_STAGES[:-1]):
+        current_stage = stage["name"]
+        next_stage = DEFAULT_STAGES[i + 1]["name"]
+
+        if use_events:
+            # Deals que passaram pelo estágio e avançaram (deals anteriores ao
+            # histórico não têm evento de entrada, mas têm o de saída)
+            stage_data = stats.get(current_stage, {})
+            current_count = max(stage_data.get("entered", 0), stage_data.get("exits", 0))
+            moved_count = stage_data.get("advanced", 0)
+        else:
+            current_count = by_stage.get(current_stage, {}).get("open", 0)
+            # Deals que passaram para o próximo estágio
+            moved_count = by_stage.get(next_stage, {}).get("open_or_won", 0)
 
-        for i, stage in enumerate(DEFAULT_STAGES[:-1]):
-            current_stage = stage["name"]
-            next_stage = DEFAULT_STAGES[i + 1]["name"]
+        conversion_rate = (moved_count / current_count * 100) if current_count > 0 else 0
 
-            current_count = await deals_collection.count_documents({
-                "stage": current_stage,
-                "status": "open"
-            })
+        conversion_rates.append({
+            "from": current_stage,
+            "to": next_stage,
+            "conversion_rate": round(conversion_rate, 2)
+        })
 
-            # Deals que passaram para o próximo estágio
-            moved_count = await deals_collection.count_documents({
-                "stage": next_stage,
-                "status": {"$in": ["open", "won"]}
-            })
+    # Tempo médio por estágio
+    avg_time_by_stage = []
+    for stage in DEFAULT_STAGES:
+        if use_events:
+            stage_data = stats.get(stage["name"], {})
+            exits = stage_data.get("exits", 0)
+            avg_days = stage_data.get("seconds", 0) / exits / 86400 if exits > 0 else 0
+        else:
+            avg_days = by_stage.get(stage["name"], {}).get("avg_days") or 0
+        avg_time_by_stage.append({"stage": stage["name"], "avg_days": round(avg_days, 1)})
+
+    # Funil por estágio a partir dos eventos
+    funnel = [
+        {
+            "stage": stage["name"],
+            "entered": stats.get(stage["name"], {}).get("entered", 0),
+            "advanced": stats.get(stage["name"], {}).get("advanced", 0),
+            "won": stats.get(stage["name"], {}).get("won", 0),
+            "lost": stats.get(stage["name"], {}).get("lost", 0)
+        }
+        for stage in DEFAULT_STAGES
+    ]
 
-            conversion_rate = (moved_count / current_count * 100) if current_count > 0 else 0
+    # Taxa de vitória geral
+    won = outcomes.get("won", {})
+    total_won = won.get("count", 0)
+    total_closed = total_won + outcomes.get("lost", {}).get("count", 0)
+    win_rate = (total_won / total_closed * 100) if total_closed > 0 else 0
 
-            conversion_rates.append({
-                "from": current_stage,
-                "to": next_stage,
-                "conversion_rate": round(conversion_rate, 2)
-            })
+    return {
+        "conversion_rates": conversion_rates,
+        "avg_time_by_stage": avg_time_by_stage,
+        "win_rate": round(win_rate, 2),
+        "avg_deal_value": round(won.get("avg_value") or 0, 2),
+        "total_won_value": round(won.get("total_value") or 0, 2),
+        "total_closed_deals": total_closed,
+        "total_won_deals": total_won,
+        "funnel": funnel,
+        "source": source
+    }
 
-        # Tempo médio por estágio
-        avg_time_by_stage = []
-
-        for stage in DEFAULT_STAGES:
-            pipeline = [
-                {"$match": {"stage": stage["name"]}},
-                {"$addFields": {
-                    "time_in_stage": {
-                        "$divide": [
-                            {"$subtract": [
-                                {"$ifNull": ["$updated_at", datetime.now()]},
-                                "$created_at"
-                            ]},
-                            86400000  # Convert milliseconds to days
-                        ]
-                    }
-                }},
-                {"$group": {
-                    "_id": None,
-                    "avg_days": {"$avg": "$time_in_stage"}
-                }}
-            ]
 
-            result = await deals_collection.aggregate(pipeline).to_list(1)
-            avg_days = result[0]["avg_days"] if result and result[0].get("avg_days") else 0
+@router.get("/pipeline/metrics")
+async def get_pipeline_metrics(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Métricas do pipeline de vendas
 
-            avg_time_by_stage.append({
-                "stage": stage["name"],
-                "avg_days": round(avg_days, 1)
-            })
+    Janela opcional: data de criação dos deals e data dos eventos de estágio.
+    Resultado em cache por PIPELINE_METRICS_CACHE_TTL segundos.
+    """
+    start, end = _parse_period(start_date, end_date)
+    cache_key = (start, end)
 
-        # Taxa de vitória geral
-        total_closed = await deals_collection.count_documents({
-            "status": {"$in": ["won", "lost"]}
-        })
-        total_won = await deals_collection.count_documents({"status": "won"})
-        win_rate = (total_won / total_closed * 100) if total_closed > 0 else 0
+    cached = _metrics_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
 
-        # Valor médio de deal
-        pipeline = [
-            {"$match": {"status": "won"}},
-            {"$group": {
-                "_id": None,
-                "avg_value": {"$avg": "$value"},
-                "total_value": {"$sum": "$value"}
-            }}
+    try:
+        metrics = await compute_pipeline_metrics(start, end)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular métricas: {str(e)}")
+
+    if METRICS_CACHE_TTL > 0:
+        if len(_metrics_cache) >= METRICS_CACHE_MAX_ENTRIES:
+            _metrics_cache.clear()
+        _metrics_cache[cache_key] = (time.monotonic() + METRICS_CACHE_TTL, metrics)
+
+    return metrics
+
+
+@router.post("/pipeline/stage-stats/rebuild")
+async def rebuild_pipeline_stage_stats():
+    """Reconstruir o rollup de estágios a partir do histórico de eventos"""
+    try:
+        stages = await rebuild_stage_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao reconstruir estatísticas: {str(e)}")
+
+    _metrics_cache.clear()
+    return {"message": "Estatísticas de estágio reconstruídas", "stages": stages}
+
+
+async def forecast_by_stage(
+    owner: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> List[dict]:
+    """Valor total e ponderado (valor x probabilidade) dos deals abertos por estágio"""
+    match = {
+        "status": "open",
+        "stage": {"$in": [s["name"] for s in DEFAULT_STAGES]}
+    }
+    if start_date or end_date:
+        match["expected_close_date"] = {}
+        if start_date:
+            match["expected_close_date"]["$gte"] = start_date
+        if end_date:
+            match["expected_close_date"]["$lte"] = end_date
+
+    pipeline = [{"$match": match}]
+    if owner:
+        # O responsável fica no cliente do deal ($lookup + $unwind + $match é
+        # combinado pelo servidor em uma única busca pelo _id do cliente)
+        pipeline += [
+            {"$lookup": {
+                "from": customers_collection.name,
+                "localField": "customer_id",
+                "foreignField": "_id",
+                "as": "customer"
+            }},
+            {"$unwind": "$customer"},
+            {"$match": {"customer.responsavel": owner}},
         ]
-        value_stats = await deals_collection.aggregate(pipeline).to_list(1)
-        avg_deal_value = value_stats[0]["avg_value"] if value_stats else 0
-        total_won_value = value_stats[0]["total_value"] if value_stats else 0
 
-        return {
-            "conversion_rates": conversion_rates,
-            "avg_time_by_stage": avg_time_by_stage,
-            "win_rate": round(win_rate, 2),
-            "avg_deal_value": round(avg_deal_value, 2),
-            "total_won_value": round(total_won_value, 2),
-            "total_closed_deals": total_closed,
-            "total_won_deals": total_won
+    pipeline += [
+        {"$group": {
+            "_id": "$stage",
+            "total_value": {"$sum": {"$ifNull": ["$value", 0]}},
+            "weighted_value": {"$sum": {"$multiply": [
+                {"$ifNull": ["$value", 0]},
+                {"$divide": [{"$ifNull": ["$probability", 50]}, 100]}
+            ]}},
+            "deals_count": {"$sum": 1}
+        }}
+    ]
+    groups = {
+        g["_id"]: g
+        for g in await deals_collection.aggregate(pipeline).to_list(len(DEFAULT_STAGES))
+    }
+
+    return [
+        {
+            "stage": stage["name"],
+            "total_value": groups.get(stage["name"], {}).get("total_value", 0),
+            "weighted_value": groups.get(stage["name"], {}).get("weighted_value", 0),
+            "deals_count": groups.get(stage["name"], {}).get("deals_count", 0)
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao calcular métricas: {str(e)}")
+        for stage in DEFAULT_STAGES
+    ]
 
 
 @router.get("/pipeline/forecast")
-async def get_pipeline_forecast():
-    """Previsão de faturamento baseado no pipeline"""
-    try:
-        forecast = []
-        total_weighted_value = 0
-
-        for stage in DEFAULT_STAGES:
-            deals = await deals_collection.find({
-                "stage": stage["name"],
-                "status": "open"
-            }).to_list(1000)
-
-            stage_value = 0
-            weighted_value = 0
-
-            for deal in deals:
-                value = deal.get("value", 0)
-                probability = deal.get("probability", 50) / 100
-
-                stage_value += value
-                weighted_value += value * probability
-
-            forecast.append({
-                "stage": stage["name"],
-                "total_value": stage_value,
-                "weighted_value": weighted_value,
-                "deals_count": len(deals)
-            })
+async def get_pipeline_forecast(
+    owner: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """Previsão de faturamento baseado no pipeline
 
-            total_weighted_value += weighted_value
+    Filtros opcionais: responsável (owner) e período de fechamento previsto.
+    """
+    start, end = _parse_period(start_date, end_date)
+
+    try:
+        forecast = await forecast_by_stage(owner, start, end)
+        total_weighted_value = sum(stage["weighted_value"] for stage in forecast)
 
         return {
             "forecast_by_stage": forecast,
             "total_weighted_forecast": round(total_weighted_value, 2),
-            "generated_at": datetime.now().isoformat()
+            "generated_at": datetime.utcnow().isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar forecast: {str(e)}")
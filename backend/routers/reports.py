@@ -1,255 +1,217 @@
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
 from bson import ObjectId
 from ..database import customers_collection, deals_collection, interactions_collection, activities_collection
-import csv
-import io
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+from ..counters import get_counters
+from .pipeline import forecast_by_stage
+from ..exports import EXPORT_BATCH_SIZE, EXCEL_MEDIA_TYPE, csv_file, csv_stream, csv_response, excel_file, excel_response, format_date
+from ..report_jobs import register_report, create_job, get_job, open_artifact, job_helper
+from ..rendering import render_pipeline_pdf, run_render
 
 router = APIRouter()
 
+# Colunas da exportação de clientes
+CUSTOMER_EXPORT_HEADERS = [
+    'ID', 'Nome', 'Email', 'Telefone', 'Empresa', 'CNPJ', 'Status',
+    'Cidade', 'UF', 'Categoria', 'Origem', 'Responsável', 'Score',
+    'Valor Contrato', 'Data Cadastro'
+]
+
+CUSTOMER_EXPORT_PROJECTION = {
+    field: 1 for field in (
+        'name', 'email', 'phone', 'company', 'cnpj', 'status', 'municipio', 'uf',
+        'categoria', 'origem', 'responsavel', 'score', 'valor_contrato', 'created_at'
+    )
+}
+
+
+def customer_export_row(customer: dict) -> list:
+    return [
+        str(customer['_id']),
+        customer.get('name', ''),
+        customer.get('email', ''),
+        customer.get('phone', ''),
+        customer.get('company', ''),
+        customer.get('cnpj', ''),
+        customer.get('status', ''),
+        customer.get('municipio', ''),
+        customer.get('uf', ''),
+        customer.get('categoria', ''),
+        customer.get('origem', ''),
+        customer.get('responsavel', ''),
+        customer.get('score', 0),
+        customer.get('valor_contrato', 0),
+        (customer.get('created_at') or datetime.now()).strftime('%d/%m/%Y')
+    ]
+
+
+def _customers_query(status: Optional[str]) -> dict:
+    query = {}
+    if status:
+        query["status"] = status
+    return query
+
+
 @router.get("/reports/customers/csv")
 async def export_customers_csv(status: Optional[str] = None):
-    """Exportar clientes para CSV"""
-    try:
-        query = {}
-        if status:
-            query["status"] = status
+    """Exportar clientes para CSV (streaming, sem limite de linhas)"""
+    cursor = customers_collection.find(_customers_query(status), CUSTOMER_EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
 
-        customers = await customers_collection.find(query).to_list(10000)
+    return csv_response(
+        csv_stream(cursor, CUSTOMER_EXPORT_HEADERS, customer_export_row),
+        f'clientes_{datetime.now().strftime("%Y%m%d")}.csv'
+    )
 
-        # Criar CSV em memória
-        output = io.StringIO()
-        writer = csv.writer(output)
 
-        # Cabeçalhos
-        headers = [
-            'ID', 'Nome', 'Email', 'Telefone', 'Empresa', 'CNPJ', 'Status',
-            'Cidade', 'UF', 'Categoria', 'Origem', 'Responsável', 'Score',
-            'Valor Contrato', 'Data Cadastro'
-        ]
-        writer.writerow(headers)
-
-        # Dados
-        for customer in customers:
-            writer.writerow([
-                str(customer['_id']),
-                customer.get('name', ''),
-                customer.get('email', ''),
-                customer.get('phone', ''),
-                customer.get('company', ''),
-                customer.get('cnpj', ''),
-                customer.get('status', ''),
-                customer.get('municipio', ''),
-                customer.get('uf', ''),
-                customer.get('categoria', ''),
-                customer.get('origem', ''),
-                customer.get('responsavel', ''),
-                customer.get('score', 0),
-                customer.get('valor_contrato', 0),
-                customer.get('created_at', datetime.now()).strftime('%d/%m/%Y')
-            ])
-
-        csv_content = output.getvalue()
-        output.close()
+@router.get("/reports/customers/excel")
+async def export_customers_excel(request: Request, status: Optional[str] = None):
+    """Exportar clientes para Excel com formatação (write-only, gravado em disco)"""
+    cursor = customers_collection.find(_customers_query(status), CUSTOMER_EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
 
-        return Response(
-            content=csv_content.encode('utf-8-sig'),
-            media_type='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename=clientes_{datetime.now().strftime("%Y%m%d")}.csv'
-            }
-        )
+    try:
+        path = await excel_file(cursor, "Clientes", CUSTOMER_EXPORT_HEADERS, customer_export_row, request=request)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao exportar CSV: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao exportar Excel: {str(e)}")
 
+    return excel_response(path, f'clientes_{datetime.now().strftime("%Y%m%d")}.xlsx')
 
-@router.get("/reports/customers/excel")
-async def export_customers_excel(status: Optional[str] = None):
-    """Exportar clientes para Excel com formatação"""
-    try:
-        query = {}
-        if status:
-            query["status"] = status
-
-        customers = await customers_collection.find(query).to_list(10000)
-
-        # Criar workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Clientes"
-
-        # Estilos
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-
-        # Cabeçalhos
-        headers = [
-            'ID', 'Nome', 'Email', 'Telefone', 'Empresa', 'CNPJ', 'Status',
-            'Cidade', 'UF', 'Categoria', 'Origem', 'Responsável', 'Score',
-            'Valor Contrato', 'Data Cadastro'
-        ]
 
-        for col, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-
-        # Dados
-        for row, customer in enumerate(customers, start=2):
-            ws.cell(row=row, column=1, value=str(customer['_id']))
-            ws.cell(row=row, column=2, value=customer.get('name', ''))
-            ws.cell(row=row, column=3, value=customer.get('email', ''))
-            ws.cell(row=row, column=4, value=customer.get('phone', ''))
-            ws.cell(row=row, column=5, value=customer.get('company', ''))
-            ws.cell(row=row, column=6, value=customer.get('cnpj', ''))
-            ws.cell(row=row, column=7, value=customer.get('status', ''))
-            ws.cell(row=row, column=8, value=customer.get('municipio', ''))
-            ws.cell(row=row, column=9, value=customer.get('uf', ''))
-            ws.cell(row=row, column=10, value=customer.get('categoria', ''))
-            ws.cell(row=row, column=11, value=customer.get('origem', ''))
-            ws.cell(row=row, column=12, value=customer.get('responsavel', ''))
-            ws.cell(row=row, column=13, value=customer.get('score', 0))
-            ws.cell(row=row, column=14, value=customer.get('valor_contrato', 0))
-            ws.cell(row=row, column=15, value=customer.get('created_at', datetime.now()).strftime('%d/%m/%Y'))
-
-        # Ajustar largura das colunas
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column].width = adjusted_width
-
-        # Salvar em memória
-        excel_file = io.BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
+DEAL_EXPORT_HEADERS = [
+    'ID', 'Título', 'Cliente', 'Valor', 'Estágio', 'Status', 'Probabilidade',
+    'Previsão Fechamento', 'Data Fechamento', 'Motivo Perda', 'Data Cadastro'
+]
 
-        return Response(
-            content=excel_file.getvalue(),
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={
-                'Content-Disposition': f'attachment; filename=clientes_{datetime.now().strftime("%Y%m%d")}.xlsx'
-            }
-        )
+DEAL_EXPORT_PROJECTION = {
+    field: 1 for field in (
+        'title', 'customer_id', 'value', 'stage', 'status', 'probability',
+        'expected_close_date', 'closed_at', 'lost_reason', 'created_at'
+    )
+}
+
+
+def deal_export_row(deal: dict) -> list:
+    return [
+        str(deal['_id']),
+        deal.get('title', ''),
+        str(deal.get('customer_id') or ''),
+        deal.get('value', 0),
+        deal.get('stage', ''),
+        deal.get('status', ''),
+        deal.get('probability', 0),
+        format_date(deal.get('expected_close_date'), '%d/%m/%Y'),
+        format_date(deal.get('closed_at'), '%d/%m/%Y'),
+        deal.get('lost_reason') or '',
+        format_date(deal.get('created_at'), '%d/%m/%Y')
+    ]
+
+
+def _deals_query(status: Optional[str], stage: Optional[str]) -> dict:
+    query = {}
+    if status:
+        query["status"] = status
+    if stage:
+        query["stage"] = stage
+    return query
+
+
+@router.get("/reports/deals/excel")
+async def export_deals_excel(request: Request, status: Optional[str] = None, stage: Optional[str] = None):
+    """Exportar negócios para Excel (write-only, gravado em disco)"""
+    cursor = deals_collection.find(_deals_query(status, stage), DEAL_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+
+    try:
+        path = await excel_file(cursor, "Negócios", DEAL_EXPORT_HEADERS, deal_export_row, request=request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao exportar Excel: {str(e)}")
 
+    return excel_response(path, f'negocios_{datetime.now().strftime("%Y%m%d")}.xlsx')
+
+
+async def _pipeline_pdf_data() -> list:
+    # Buscar dados (mesma agregação do forecast do pipeline)
+    return [
+        [stage["stage"], stage["deals_count"], stage["total_value"]]
+        for stage in await forecast_by_stage()
+    ]
+
 
 @router.get("/reports/pipeline/pdf")
-async def export_pipeline_pdf():
-    """Exportar relatório do pipeline em PDF"""
+async def export_pipeline_pdf(request: Request):
+    """Exportar relatório do pipeline em PDF (renderizado no pool de processos)"""
     try:
-        # Buscar dados
-        pipeline_stages = ["Prospecção", "Qualificação", "Proposta", "Negociação", "Fechamento"]
-        pipeline_data = []
-
-        for stage in pipeline_stages:
-            deals = await deals_collection.find({"stage": stage, "status": "open"}).to_list(1000)
-            total_value = sum(d.get('value', 0) for d in deals)
-            pipeline_data.append([
-                stage,
-                len(deals),
-                f"R$ {total_value:,.2f}"
-            ])
-
-        # Criar PDF
-        pdf_file = io.BytesIO()
-        doc = SimpleDocTemplate(pdf_file, pagesize=A4)
-        elements = []
-        styles = getSampleStyleSheet()
-
-        # Título
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1a1a1a'),
-            spaceAfter=30,
-            alignment=1  # Center
-        )
-        title = Paragraph("Relatório Pipeline de Vendas", title_style)
-        elements.append(title)
-
-        # Data
-        date_style = ParagraphStyle(
-            'DateStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.grey,
-            alignment=1
-        )
-        date_text = Paragraph(f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}", date_style)
-        elements.append(date_text)
-        elements.append(Spacer(1, 20))
-
-        # Tabela
-        table_data = [['Estágio', 'Quantidade', 'Valor Total']] + pipeline_data
-        table = Table(table_data, colWidths=[2*inch, 1.5*inch, 2*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(table)
-
-        # Stats adicionais
-        elements.append(Spacer(1, 30))
-        total_deals = sum(row[1] for row in pipeline_data)
-        total_value = sum(float(row[2].replace('R$ ', '').replace(',', '')) for row in pipeline_data)
-
-        stats_text = f"""
-        <b>Resumo Geral:</b><br/>
-        Total de Deals Abertos: {total_deals}<br/>
-        Valor Total em Negociação: R$ {total_value:,.2f}
-        """
-        stats_para = Paragraph(stats_text, styles['Normal'])
-        elements.append(stats_para)
-
-        doc.build(elements)
-        pdf_file.seek(0)
+        pdf_content = await run_render(render_pipeline_pdf, await _pipeline_pdf_data(), datetime.now(), request=request)
 
         return Response(
-            content=pdf_file.getvalue(),
+            content=pdf_content,
             media_type='application/pdf',
             headers={
                 'Content-Disposition': f'attachment; filename=pipeline_{datetime.now().strftime("%Y%m%d")}.pdf'
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar PDF: {str(e)}")
 
 
-@router.get("/reports/activities")
-async def export_activities_report(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    status: Optional[str] = None
-):
-    """Relatório de atividades com filtros"""
-    try:
-        query = {}
+def _export_mode(format: str) -> str:
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Formato inválido. Use json ou csv")
+    return format
+
+
+async def _report_summary(collection, query: dict, sort: list, group_fields: dict, projection: dict) -> dict:
+    """Total, contagens agrupadas e as 100 primeiras linhas em uma única agregação"""
+    facets = {
+        "total": [{"$count": "count"}],
+        "items": [{"$sort": dict(sort)}, {"$limit": 100}, {"$project": projection}]
+    }
+    for name, (field, default) in group_fields.items():
+        facets[name] = [{"$group": {"_id": {"$ifNull": [f"${field}", default]}, "count": {"$sum": 1}}}]
+
+    result = await collection.aggregate([{"$match": query}, {"$facet": facets}]).to_list(1)
+    data = result[0]
+
+    summary = {
+        "total": data["total"][0]["count"] if data["total"] else 0,
+        "items": data["items"]
+    }
+    for name in group_fields:
+        summary[name] = {row["_id"]: row["count"] for row in data[name]}
+    return summary
 
+
+ACTIVITY_EXPORT_HEADERS = ['ID', 'Título', 'Tipo', 'Status', 'Cliente', 'Negócio', 'Data Criação', 'Vencimento']
+
+ACTIVITY_EXPORT_PROJECTION = {
+    field: 1 for field in ('title', 'activity_type', 'status', 'customer_id', 'deal_id', 'created_at', 'due_date')
+}
+
+
+def activity_export_row(act: dict) -> list:
+    return [
+        str(act['_id']),
+        act.get('title', ''),
+        act.get('activity_type', ''),
+        act.get('status', ''),
+        str(act.get('customer_id') or ''),
+        str(act.get('deal_id') or ''),
+        format_date(act.get('created_at')),
+        format_date(act.get('due_date'))
+    ]
+
+
+def _activities_query(start_date: Optional[str], end_date: Optional[str], status: Optional[str]) -> dict:
+    query = {}
+
+    try:
         if start_date:
             query["created_at"] = {"$gte": datetime.fromisoformat(start_date)}
         if end_date:
@@ -257,31 +219,49 @@ async def export_activities_report(
                 query["created_at"]["$lte"] = datetime.fromisoformat(end_date)
             else:
                 query["created_at"] = {"$lte": datetime.fromisoformat(end_date)}
-        if status:
-            query["status"] = status
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida, use o formato ISO (AAAA-MM-DD)")
+    if status:
+        query["status"] = status
 
-        activities = await activities_collection.find(query).to_list(10000)
+    return query
 
-        # Estatísticas
-        total = len(activities)
-        by_type = {}
-        by_status = {}
 
-        for activity in activities:
-            act_type = activity.get('activity_type', 'outros')
-            act_status = activity.get('status', 'unknown')
+@router.get("/reports/activities")
+async def export_activities_report(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None,
+    format: str = "json"
+):
+    """Relatório de atividades com filtros (format=csv exporta todas as linhas em streaming)"""
+    mode = _export_mode(format)
+    query = _activities_query(start_date, end_date, status)
+
+    if mode == "csv":
+        cursor = activities_collection.find(query, ACTIVITY_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+        return csv_response(
+            csv_stream(cursor, ACTIVITY_EXPORT_HEADERS, activity_export_row),
+            f'atividades_{datetime.now().strftime("%Y%m%d")}.csv'
+        )
 
-            by_type[act_type] = by_type.get(act_type, 0) + 1
-            by_status[act_status] = by_status.get(act_status, 0) + 1
+    try:
+        summary = await _report_summary(
+            activities_collection,
+            query,
+            [("created_at", -1)],
+            {"by_type": ("activity_type", "outros"), "by_status": ("status", "unknown")},
+            ACTIVITY_EXPORT_PROJECTION
+        )
 
         return {
             "period": {
                 "start": start_date or "início",
                 "end": end_date or "hoje"
             },
-            "total_activities": total,
-            "by_type": by_type,
-            "by_status": by_status,
+            "total_activities": summary["total"],
+            "by_type": summary["by_type"],
+            "by_status": summary["by_status"],
             "activities": [
                 {
                     "id": str(act["_id"]),
@@ -292,41 +272,89 @@ async def export_activities_report(
                     "created_at": act.get("created_at"),
                     "due_date": act.get("due_date")
                 }
-                for act in activities[:100]  # Limitar a 100 na resposta
+                for act in summary["items"]  # Limitar a 100 na resposta
             ]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório: {str(e)}")
 
 
-@router.get("/reports/interactions")
-async def export_interactions_report(customer_id: Optional[str] = None, days: int = 30):
-    """Relatório de interações dos últimos N dias"""
+@router.get("/reports/activities/excel")
+async def export_activities_excel(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """Exportar atividades para Excel (write-only, gravado em disco)"""
+    query = _activities_query(start_date, end_date, status)
+    cursor = activities_collection.find(query, ACTIVITY_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+
     try:
-        start_date = datetime.now() - timedelta(days=days)
-        query = {"created_at": {"$gte": start_date}}
+        path = await excel_file(cursor, "Atividades", ACTIVITY_EXPORT_HEADERS, activity_export_row, request=request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao exportar Excel: {str(e)}")
+
+    return excel_response(path, f'atividades_{datetime.now().strftime("%Y%m%d")}.xlsx')
+
+
+INTERACTION_EXPORT_HEADERS = ['ID', 'Cliente', 'Tipo', 'Título', 'Resultado', 'Data', 'Data Criação']
 
-        if customer_id:
-            query["customer_id"] = customer_id
+INTERACTION_EXPORT_PROJECTION = {
+    field: 1 for field in ('customer_id', 'tipo', 'titulo', 'resultado', 'data', 'created_at')
+}
 
-        interactions = await interactions_collection.find(query).sort("created_at", -1).to_list(10000)
 
-        # Estatísticas
-        by_type = {}
-        by_result = {}
+def interaction_export_row(i: dict) -> list:
+    return [
+        str(i['_id']),
+        str(i.get('customer_id') or ''),
+        i.get('tipo', ''),
+        i.get('titulo', ''),
+        i.get('resultado', ''),
+        format_date(i.get('data')),
+        format_date(i.get('created_at'))
+    ]
 
-        for interaction in interactions:
-            int_type = interaction.get('tipo', 'outros')
-            int_result = interaction.get('resultado', 'pendente')
 
-            by_type[int_type] = by_type.get(int_type, 0) + 1
-            by_result[int_result] = by_result.get(int_result, 0) + 1
+def _interactions_query(customer_id: Optional[str], days: int) -> dict:
+    start_date = datetime.now() - timedelta(days=days)
+    query = {"created_at": {"$gte": start_date}}
+
+    if customer_id:
+        query["customer_id"] = customer_id
+    return query
+
+
+@router.get("/reports/interactions")
+async def export_interactions_report(customer_id: Optional[str] = None, days: int = 30, format: str = "json"):
+    """Relatório de interações dos últimos N dias (format=csv exporta todas as linhas em streaming)"""
+    mode = _export_mode(format)
+    query = _interactions_query(customer_id, days)
+
+    if mode == "csv":
+        cursor = interactions_collection.find(query, INTERACTION_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+        return csv_response(
+            csv_stream(cursor, INTERACTION_EXPORT_HEADERS, interaction_export_row),
+            f'interacoes_{datetime.now().strftime("%Y%m%d")}.csv'
+        )
+
+    try:
+        summary = await _report_summary(
+            interactions_collection,
+            query,
+            [("created_at", -1)],
+            {"by_type": ("tipo", "outros"), "by_result": ("resultado", "pendente")},
+            INTERACTION_EXPORT_PROJECTION
+        )
 
         return {
             "period_days": days,
-            "total_interactions": len(interactions),
-            "by_type": by_type,
-            "by_result": by_result,
+            "total_interactions": summary["total"],
+            "by_type": summary["by_type"],
+            "by_result": summary["by_result"],
             "interactions": [
                 {
                     "id": str(i["_id"]),
@@ -337,7 +365,7 @@ async def export_interactions_report(customer_id: Optional[str] = None, days: in
                     "data": i.get("data"),
                     "created_at": i.get("created_at")
                 }
-                for i in interactions[:100]
+                for i in summary["items"]
             ]
         }
     except Exception as e:
@@ -348,11 +376,12 @@ async def export_interactions_report(customer_id: Optional[str] = None, days: in
 async def conversion_funnel_report():
     """Relatório detalhado do funil de conversão"""
     try:
-        # Contar por status
-        total = await customers_collection.count_documents({})
-        leads = await customers_collection.count_documents({"status": "lead"})
-        prospects = await customers_collection.count_documents({"status": "prospect"})
-        clientes = await customers_collection.count_documents({"status": "cliente"})
+        # Contar por status (contadores materializados)
+        counters = await get_counters()
+        total = counters["customers"]["total"]
+        leads = counters["customers"]["status"].get("lead", 0)
+        prospects = counters["customers"]["status"].get("prospect", 0)
+        clientes = counters["customers"]["status"].get("cliente", 0)
 
         # Calcular conversões
         lead_to_prospect = (prospects / leads * 100) if leads > 0 else 0
@@ -405,3 +434,111 @@ async def conversion_funnel_report():
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório: {str(e)}")
+
+
+# Jobs de relatório: mesmos relatórios gerados em segundo plano (ver report_jobs.py)
+class ReportJobCreate(BaseModel):
+    report_type: str
+    params: dict = {}
+
+
+def _dated(prefix: str, extension: str) -> str:
+    return f'{prefix}_{datetime.now().strftime("%Y%m%d")}.{extension}'
+
+
+async def _customers_csv_job(params: dict):
+    cursor = customers_collection.find(_customers_query(params.get("status")), CUSTOMER_EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
+    return await csv_file(cursor, CUSTOMER_EXPORT_HEADERS, customer_export_row), _dated("clientes", "csv"), "text/csv"
+
+
+async def _customers_excel_job(params: dict):
+    cursor = customers_collection.find(_customers_query(params.get("status")), CUSTOMER_EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
+    path = await excel_file(cursor, "Clientes", CUSTOMER_EXPORT_HEADERS, customer_export_row)
+    return path, _dated("clientes", "xlsx"), EXCEL_MEDIA_TYPE
+
+
+async def _deals_excel_job(params: dict):
+    query = _deals_query(params.get("status"), params.get("stage"))
+    cursor = deals_collection.find(query, DEAL_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+    path = await excel_file(cursor, "Negócios", DEAL_EXPORT_HEADERS, deal_export_row)
+    return path, _dated("negocios", "xlsx"), EXCEL_MEDIA_TYPE
+
+
+def _activities_cursor(params: dict):
+    query = _activities_query(params.get("start_date"), params.get("end_date"), params.get("status"))
+    return activities_collection.find(query, ACTIVITY_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+
+
+async def _activities_csv_job(params: dict):
+    path = await csv_file(_activities_cursor(params), ACTIVITY_EXPORT_HEADERS, activity_export_row)
+    return path, _dated("atividades", "csv"), "text/csv"
+
+
+async def _activities_excel_job(params: dict):
+    path = await excel_file(_activities_cursor(params), "Atividades", ACTIVITY_EXPORT_HEADERS, activity_export_row)
+    return path, _dated("atividades", "xlsx"), EXCEL_MEDIA_TYPE
+
+
+async def _interactions_csv_job(params: dict):
+    query = _interactions_query(params.get("customer_id"), int(params.get("days", 30)))
+    cursor = interactions_collection.find(query, INTERACTION_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+    path = await csv_file(cursor, INTERACTION_EXPORT_HEADERS, interaction_export_row)
+    return path, _dated("interacoes", "csv"), "text/csv"
+
+
+async def _pipeline_pdf_job(params: dict):
+    content = await run_render(render_pipeline_pdf, await _pipeline_pdf_data(), datetime.now())
+    return content, _dated("pipeline", "pdf"), "application/pdf"
+
+
+register_report("customers_csv", _customers_csv_job, ("status",))
+register_report("customers_excel", _customers_excel_job, ("status",))
+register_report("deals_excel", _deals_excel_job, ("status", "stage"))
+register_report("activities_csv", _activities_csv_job, ("start_date", "end_date", "status"))
+register_report("activities_excel", _activities_excel_job, ("start_date", "end_date", "status"))
+register_report("interactions_csv", _interactions_csv_job, ("customer_id", "days"))
+register_report("pipeline_pdf", _pipeline_pdf_job)
+
+
+def _job_response(request: Request, job: dict) -> dict:
+    data = job_helper(job)
+    data["download_url"] = (
+        str(request.url_for("download_report_job", job_id=data["id"])) if job["status"] == "done" else None
+    )
+    return data
+
+
+@router.post("/reports/jobs", status_code=202)
+async def create_report_job(job_data: ReportJobCreate, request: Request):
+    """Solicitar relatório em segundo plano (pedidos idênticos reaproveitam o mesmo job)"""
+    job, deduplicated = await create_job(job_data.report_type, job_data.params)
+    return {**_job_response(request, job), "deduplicated": deduplicated}
+
+
+@router.get("/reports/jobs/{job_id}")
+async def get_report_job(job_id: str, request: Request):
+    """Consultar status do job de relatório"""
+    return _job_response(request, await get_job(job_id))
+
+
+@router.get("/reports/jobs/{job_id}/download", name="download_report_job")
+async def download_report_job(job_id: str):
+    """Baixar o arquivo gerado pelo job"""
+    job = await get_job(job_id)
+    artifact = await open_artifact(job)
+
+    async def chunks():
+        while True:
+            chunk = await artifact.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type=job["media_type"],
+        headers={
+            'Content-Disposition': f'attachment; filename={job["filename"]}',
+            'Content-Length': str(job["size"])
+        }
+    )
@@ -4,6 +4,8 @@ from datetime import datetime, timedelta
 from bson import ObjectId
 from pydantic import BaseModel
 from ..database import customers_collection, activities_collection, db
+from ..http_clients import get_http_client
+from ..counters import apply_delta, activity_delta
 import httpx
 import os
 
@@ -88,19 +90,18 @@ async def send_whatsapp_message(message: WhatsAppMessage, background_tasks: Back
             raise HTTPException(status_code=400, detail="Tipo de mensagem inválido")
         
         # Enviar via API do WhatsApp
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_ID}/messages",
-                headers={
-                    "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-                    "Content-Type": "application/json"
-                },
-                json=payload,
-                timeout=30.0
-            )
-            
-            response.raise_for_status()
-            result = response.json()
+        # Cliente compartilhado (ver http_clients.py); envio não é repetido em caso de falha
+        response = await get_http_client("whatsapp").post(
+            f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_ID}/messages",
+            headers={
+                "Authorization": f"Bearer {WHATSAPP_TOKEN}",
+                "Content-Type": "application/json"
+            },
+            json=payload
+        )
+
+        response.raise_for_status()
+        result = response.json()
         
         # Salvar mensagem no banco
         message_record = {
@@ -127,6 +128,7 @@ async def send_whatsapp_message(message: WhatsAppMessage, background_tasks: Back
                 "created_at": datetime.now()
             }
             await activities_collection.insert_one(activity)
+            await apply_delta(activity_delta(after=activity))
         
         return {
             "message": "WhatsApp enviado com sucesso",
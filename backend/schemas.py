@@ -119,6 +119,10 @@ class Customer(CustomerBase):
         populate_by_name = True
         json_encoders = {ObjectId: str}
 
+class CustomerPage(BaseModel):
+    items: List[Customer]
+    next_cursor: Optional[str] = None
+
 # Schema para resposta da API CNPJ
 class CNPJData(BaseModel):
     cnpj: str
@@ -177,6 +181,10 @@ class Deal(DealBase):
         populate_by_name = True
         json_encoders = {ObjectId: str}
 
+class DealPage(BaseModel):
+    items: List[Deal]
+    next_cursor: Optional[str] = None
+
 
 # Contact Schemas
 class ContactBase(BaseModel):
@@ -203,6 +211,10 @@ class Contact(ContactBase):
         populate_by_name = True
         json_encoders = {ObjectId: str}
 
+class ContactPage(BaseModel):
+    items: List[Contact]
+    next_cursor: Optional[str] = None
+
 
 # Attachment Schemas (Anexos)
 class AttachmentBase(BaseModel):
@@ -302,3 +314,20 @@ class Activity(ActivityBase):
     class Config:
         populate_by_name = True
         json_encoders = {ObjectId: str}
+
+class ActivityPage(BaseModel):
+    items: List[Activity]
+    next_cursor: Optional[str] = None
+
+
+# Resultado de criação em lote
+class BulkItemResult(BaseModel):
+    index: int
+    success: bool
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkCreateResult(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkItemResult]
@@ -0,0 +1,67 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter, create_model
+from typing import List, Optional, Tuple
+from functools import lru_cache
+from bson import ObjectId
+
+# Modo de resposta esparsa: o cliente escolhe os campos (?fields=name,email,status),
+# a projeção é aplicada no MongoDB e a resposta usa um modelo reduzido.
+
+
+def parse_fields(fields: Optional[str], model) -> Optional[Tuple[str, ...]]:
+    """Validar o parâmetro fields contra os campos do schema"""
+    if not fields:
+        return None
+
+    requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    if not requested:
+        return None
+
+    allowed = [name for name in model.model_fields if name != "id"]
+    invalid = [f for f in requested if f not in allowed]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalid)}")
+
+    return requested
+
+
+def build_projection(fields: Tuple[str, ...]) -> dict:
+    """Projeção MongoDB para os campos solicitados (o _id sempre vem)"""
+    return {field: 1 for field in fields}
+
+
+def sparse_helper(doc: dict, fields: Tuple[str, ...]) -> dict:
+    """Converter documento projetado em dict com id e os campos solicitados"""
+    item = {"id": str(doc["_id"])}
+    for field in fields:
+        value = doc.get(field)
+        item[field] = str(value) if isinstance(value, ObjectId) else value
+    return item
+
+
+@lru_cache(maxsize=256)
+def _sparse_adapters(model, fields: Tuple[str, ...]):
+    """Modelo reduzido (e adapters) para o conjunto de campos, em cache"""
+    definitions = {
+        name: (Optional[model.model_fields[name].annotation], None)
+        for name in fields
+    }
+    sparse_model = create_model(f"{model.__name__}Sparse", __base__=BaseModel, id=(str, ...), **definitions)
+    return TypeAdapter(sparse_model), TypeAdapter(List[sparse_model])
+
+
+def sparse_response(model, fields: Tuple[str, ...], docs, next_cursor: Optional[str] = None, paged: bool = False) -> JSONResponse:
+    """Montar resposta esparsa para um documento ou uma lista de documentos"""
+    item_adapter, list_adapter = _sparse_adapters(model, fields)
+
+    if isinstance(docs, dict):
+        item = item_adapter.validate_python(sparse_helper(docs, fields))
+        return JSONResponse(content=item_adapter.dump_python(item, mode="json"))
+
+    items = list_adapter.validate_python([sparse_helper(doc, fields) for doc in docs])
+    content = list_adapter.dump_python(items, mode="json")
+
+    if paged:
+        return JSONResponse(content={"items": content, "next_cursor": next_cursor})
+    return JSONResponse(content=content)
@@ -0,0 +1,294 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+from database import database, deals_collection
+from crud import DUPLICATE_KEY_ERROR
+
+# Histórico append-only das mudanças de estágio/status dos deals.
+# Cada evento já traz os incrementos que causa (entrada, saída com duração,
+# avanço, ganho/perda); o rollup deal_stage_stats recebe esses incrementos
+# com $inc na escrita e pode ser reconstruído a partir dos eventos.
+deal_stage_events_collection = database.get_collection("deal_stage_events")
+deal_stage_stats_collection = database.get_collection("deal_stage_stats")
+schema_meta_collection = database.get_collection("schema_meta")
+
+# Deals anteriores ao histórico recebem um evento inicial (seed_stage_history);
+# até lá as métricas usam a foto atual dos deals
+STAGE_HISTORY_META_ID = "stage_history"
+SEED_BATCH_SIZE = 1000
+
+_history_seeded = False
+
+# Ordem dos estágios (mesma do pipeline) para detectar avanço
+STAGE_ORDER = {
+    "Prospecção": 1,
+    "Qualificação": 2,
+    "Proposta": 3,
+    "Negociação": 4,
+    "Fechamento": 5,
+}
+
+CLOSED_STATUSES = ("won", "lost")
+
+
+def _entered_at(deal: dict) -> Optional[datetime]:
+    """Quando o deal entrou no estágio atual (deals antigos usam updated/created_at)"""
+    return deal.get("stage_entered_at") or deal.get("updated_at") or deal.get("created_at")
+
+
+def build_event(before: Optional[dict], after: dict, ts: Optional[datetime] = None) -> Optional[dict]:
+    """Montar evento de mudança; None se estágio e status não mudaram"""
+    ts = ts or datetime.utcnow()
+    from_stage = before.get("stage") if before else None
+    from_status = before.get("status") if before else None
+    to_stage = after.get("stage")
+    to_status = after.get("status", "open")
+
+    if before is not None and from_stage == to_stage and from_status == to_status:
+        return None
+
+    stage_changed = before is None or from_stage != to_stage
+    closed = to_status in CLOSED_STATUSES and to_status != from_status
+
+    event = {
+        "deal_id": after["_id"],
+        "customer_id": after.get("customer_id"),
+        "from_stage": from_stage,
+        "to_stage": to_stage,
+        "from_status": from_status,
+        "to_status": to_status,
+        "value": after.get("value", 0),
+        "ts": ts,
+        # Entrada em um novo estágio (inclusive na criação)
+        "entered": stage_changed,
+        # Saída do estágio anterior, por mudança de estágio ou fechamento
+        "exited": before is not None and (stage_changed or closed),
+        "duration_seconds": None,
+        "advanced": (
+            before is not None and stage_changed
+            and STAGE_ORDER.get(to_stage, 0) > STAGE_ORDER.get(from_stage, 0)
+        ),
+        "outcome": to_status if closed else None,
+    }
+
+    if event["exited"]:
+        entered_at = _entered_at(before)
+        if entered_at:
+            event["duration_seconds"] = max((ts - entered_at).total_seconds(), 0)
+
+    return event
+
+
+def _stage_key(stage) -> str:
+    return str(stage).replace(".", "_").replace("$", "_")
+
+
+def event_increments(event: dict) -> dict:
+    """Incrementos do rollup por estágio causados por um evento: {estágio: {campo: n}}"""
+    increments = {}
+
+    def add(stage, field, amount):
+        if stage is None or not amount:
+            return
+        stage_inc = increments.setdefault(stage, {})
+        stage_inc[field] = stage_inc.get(field, 0) + amount
+
+    if event["entered"]:
+        add(event["to_stage"], "entered", 1)
+    if event["exited"]:
+        add(event["from_stage"], "exits", 1)
+        add(event["from_stage"], "seconds", event["duration_seconds"] or 0)
+    if event["advanced"]:
+        add(event["from_stage"], "advanced", 1)
+    if event["outcome"]:
+        add(event["to_stage"], event["outcome"], 1)
+
+    return increments
+
+
+async def record_stage_events(changes: List[tuple]):
+    """Registrar eventos para pares (antes, depois) e atualizar o rollup"""
+    now = datetime.utcnow()
+    events, moved_ids = [], []
+    for before, after in changes:
+        event = build_event(before, after, now)
+        if event is None:
+            continue
+        events.append(event)
+        # Deals criados já são inseridos com stage_entered_at
+        if before is not None and event["entered"]:
+            moved_ids.append(event["deal_id"])
+
+    if not events:
+        return
+
+    totals = {}
+    for event in events:
+        for stage, inc in event_increments(event).items():
+            stage_totals = totals.setdefault(stage, {})
+            for field, amount in inc.items():
+                stage_totals[field] = stage_totals.get(field, 0) + amount
+
+    writes = [deal_stage_events_collection.insert_many(events, ordered=False)]
+    writes += [
+        deal_stage_stats_collection.update_one(
+            {"_id": _stage_key(stage)},
+            {"$inc": inc, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for stage, inc in totals.items()
+    ]
+
+    # Marcar a entrada no novo estágio nos deals que mudaram de estágio
+    if moved_ids:
+        writes.append(deals_collection.update_many(
+            {"_id": {"$in": moved_ids}},
+            {"$set": {"stage_entered_at": now}}
+        ))
+
+    try:
+        await asyncio.gather(*writes)
+    except Exception as e:
+        print(f"Erro ao registrar eventos de estágio: {str(e)}")
+
+
+async def record_stage_change(before: Optional[dict], after: dict):
+    """Registrar evento de um único deal"""
+    await record_stage_events([(before, after)])
+
+
+def _events_stats_pipeline(match: dict) -> list:
+    """Agregação que reproduz o rollup a partir dos eventos"""
+    return [
+        {"$match": match},
+        {"$facet": {
+            "exits": [
+                {"$match": {"from_stage": {"$ne": None}}},
+                {"$group": {
+                    "_id": "$from_stage",
+                    "exits": {"$sum": {"$cond": ["$exited", 1, 0]}},
+                    "seconds": {"$sum": {"$cond": ["$exited", {"$ifNull": ["$duration_seconds", 0]}, 0]}},
+                    "advanced": {"$sum": {"$cond": ["$advanced", 1, 0]}}
+                }}
+            ],
+            "entries": [
+                {"$group": {
+                    "_id": "$to_stage",
+                    "entered": {"$sum": {"$cond": ["$entered", 1, 0]}},
+                    "won": {"$sum": {"$cond": [{"$eq": ["$outcome", "won"]}, 1, 0]}},
+                    "lost": {"$sum": {"$cond": [{"$eq": ["$outcome", "lost"]}, 1, 0]}}
+                }}
+            ]
+        }}
+    ]
+
+
+async def _stats_from_events(match: dict) -> dict:
+    result = await deal_stage_events_collection.aggregate(_events_stats_pipeline(match)).to_list(1)
+    stats = {}
+    if result:
+        for row in result[0]["exits"] + result[0]["entries"]:
+            stage_stats = stats.setdefault(_stage_key(row["_id"]), {})
+            stage_stats.update({k: v for k, v in row.items() if k != "_id"})
+    return stats
+
+
+async def stage_stats(start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Estatísticas por estágio: {estágio: {entered, exits, seconds, advanced, won, lost}}
+
+    Sem janela lê o rollup (O(estágios)); com janela agrega só os eventos do período.
+    """
+    if start or end:
+        match = {"ts": {}}
+        if start:
+            match["ts"]["$gte"] = start
+        if end:
+            match["ts"]["$lte"] = end
+        return await _stats_from_events(match)
+
+    stats = {}
+    async for row in deal_stage_stats_collection.find({}):
+        stats[row["_id"]] = {k: v for k, v in row.items() if k not in ("_id", "updated_at")}
+    return stats
+
+
+async def rebuild_stage_stats() -> int:
+    """Reconstruir o rollup a partir de todo o histórico de eventos"""
+    stats = await _stats_from_events({})
+    now = datetime.utcnow()
+    await deal_stage_stats_collection.delete_many({})
+    if stats:
+        await deal_stage_stats_collection.insert_many([
+            {"_id": stage, **values, "updated_at": now}
+            for stage, values in stats.items()
+        ])
+    return len(stats)
+
+
+async def stage_history_seeded() -> bool:
+    """Verificar se os deals anteriores ao histórico já receberam o evento inicial"""
+    global _history_seeded
+    if not _history_seeded:
+        _history_seeded = await schema_meta_collection.find_one({"_id": STAGE_HISTORY_META_ID}) is not None
+    return _history_seeded
+
+
+async def seed_stage_history() -> int:
+    """Registrar o evento inicial dos deals sem histórico e reconstruir o rollup
+
+    Cada deal sem stage_entered_at (criado antes do histórico) ganha um evento de
+    entrada no estágio atual (e o resultado, se fechado) na data de criação, e
+    stage_entered_at passa a ser o último updated_at. Idempotente: o _id do
+    evento é derivado do deal. Retorna quantos deals foram tratados.
+    """
+    global _history_seeded
+    seeded = 0
+    projection = {"stage": 1, "status": 1, "value": 1, "customer_id": 1, "created_at": 1, "updated_at": 1}
+
+    while True:
+        deals = await deals_collection.find(
+            {"stage_entered_at": {"$exists": False}}, projection
+        ).limit(SEED_BATCH_SIZE).to_list(SEED_BATCH_SIZE)
+        if not deals:
+            break
+
+        events, operations = [], []
+        for deal in deals:
+            entered_at = _entered_at(deal) or datetime.utcnow()
+            event = build_event(None, deal, deal.get("created_at") or entered_at)
+            events.append({"_id": f"seed_{deal['_id']}", **event, "seeded": True})
+            # Deal movido nesse meio tempo já tem stage_entered_at verdadeiro
+            operations.append(UpdateOne(
+                {"_id": deal["_id"], "stage_entered_at": {"$exists": False}},
+                {"$set": {"stage_entered_at": entered_at}}
+            ))
+
+        try:
+            await deal_stage_events_collection.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            # Eventos já gravados por uma execução interrompida
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        await deals_collection.bulk_write(operations, ordered=False)
+        seeded += len(deals)
+
+    await rebuild_stage_stats()
+    await schema_meta_collection.update_one(
+        {"_id": STAGE_HISTORY_META_ID},
+        {"$set": {"seeded_at": datetime.utcnow(), "seeded_deals": seeded}},
+        upsert=True
+    )
+    _history_seeded = True
+    return seeded
+
+
+async def ensure_stage_history():
+    """Executar o seed uma única vez (startup)"""
+    try:
+        if not await stage_history_seeded():
+            seeded = await seed_stage_history()
+            print(f"Histórico de estágios inicializado: {seeded} deals")
+    except Exception as e:
+        print(f"Erro ao inicializar histórico de estágios: {str(e)}")
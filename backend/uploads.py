@@ -0,0 +1,143 @@
+from fastapi import HTTPException, UploadFile
+from typing import AsyncIterator, Deque, List, Tuple
+from collections import deque
+import codecs
+import csv
+import os
+
+# Leitura incremental de uploads: o arquivo é lido em pedaços, decodificado
+# com um decoder incremental e entregue ao csv.DictReader registro a registro,
+# sem manter o conteúdo inteiro em memória.
+UPLOAD_READ_CHUNK = 64 * 1024
+
+# Tamanho máximo aceito para arquivos de importação
+IMPORT_MAX_UPLOAD_MB = int(os.getenv("IMPORT_MAX_UPLOAD_MB", "300"))
+IMPORT_MAX_UPLOAD_BYTES = IMPORT_MAX_UPLOAD_MB * 1024 * 1024
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Arquivo excede o limite de {IMPORT_MAX_UPLOAD_MB} MB")
+
+
+def check_upload_size(file: UploadFile, max_bytes: int = IMPORT_MAX_UPLOAD_BYTES):
+    """Rejeitar de imediato arquivos cujo tamanho já é conhecido e excede o limite"""
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        raise _too_large()
+
+
+async def upload_chunks(file, max_bytes: int = IMPORT_MAX_UPLOAD_BYTES) -> AsyncIterator[bytes]:
+    """Pedaços do arquivo (UploadFile ou qualquer objeto com read assíncrono), respeitando o limite"""
+    check_upload_size(file, max_bytes)
+
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            break
+
+        # Tamanho desconhecido de antemão: limite verificado durante a leitura
+        total += len(chunk)
+        if total > max_bytes:
+            raise _too_large()
+        yield chunk
+
+
+async def upload_lines(file: UploadFile, max_bytes: int = IMPORT_MAX_UPLOAD_BYTES) -> AsyncIterator[str]:
+    """Linhas do arquivo (com o terminador), decodificadas como UTF-8 com ou sem BOM"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+
+    async for chunk in upload_chunks(file, max_bytes):
+        pending += decoder.decode(chunk)
+        parts = pending.split("\n")
+        pending = parts.pop()
+        for part in parts:
+            yield part + "\n"
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+class _RecordSource:
+    """Iterador consumido pelo csv.DictReader; recebe as linhas de um registro completo por vez"""
+
+    def __init__(self):
+        self.records: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.records:
+            raise StopIteration
+        return self.records.popleft()
+
+
+class _NeedMoreLines(Exception):
+    pass
+
+
+def _first_record_lines(lines: List[str]) -> int:
+    """Linhas ocupadas pelo primeiro registro de lines (0 se ele continua além delas)
+
+    Quem decide onde o registro termina é o próprio módulo csv: aspas dentro de
+    um campo sem aspas (TV 5" inc) não abrem um campo de várias linhas.
+    """
+    def source():
+        yield from lines
+        raise _NeedMoreLines
+
+    reader = csv.reader(source())
+    try:
+        next(reader)
+    except _NeedMoreLines:
+        return 0
+    return reader.line_num
+
+
+async def csv_dict_rows(file: UploadFile, max_bytes: int = IMPORT_MAX_UPLOAD_BYTES) -> AsyncIterator[Tuple[int, dict]]:
+    """Registros do CSV como (número do registro, dict), a partir de 2 (1 é o cabeçalho)"""
+    source = _RecordSource()
+    reader = csv.DictReader(source)
+    header_read = False
+    row_num = 1
+
+    buffered: List[str] = []
+    # Registro incompleto só é reavaliado quando o buffer dobra (campos longos em tempo linear)
+    check_at = 1
+
+    async def lines_with_tail():
+        async for line in upload_lines(file, max_bytes):
+            yield line
+        # Sinaliza o fim para liberar um registro com aspas não fechadas
+        yield None
+
+    async for line in lines_with_tail():
+        if line is not None:
+            buffered.append(line)
+            if len(buffered) < check_at:
+                continue
+
+        while buffered:
+            size = _first_record_lines(buffered)
+            if not size and line is None:
+                # Fim do arquivo com aspas não fechadas: o restante é o último registro
+                size = len(buffered)
+            if not size:
+                check_at = len(buffered) * 2
+                break
+            record, buffered = buffered[:size], buffered[size:]
+            check_at = 1
+            if not "".join(record).strip():
+                continue
+
+            source.records.extend(record)
+            if not header_read:
+                # A primeira leitura de fieldnames consome o cabeçalho
+                header_read = bool(reader.fieldnames)
+                continue
+
+            row_num += 1
+            yield row_num, next(reader)